@@ -0,0 +1,212 @@
+"""Columnar statistics over all the scans of a database, computed with NumPy."""
+
+import collections
+import datetime
+
+import numpy
+
+from beerlog import beerlogdb
+from beerlog import errors
+
+# Per-character amounts for every hour of a chart.
+HourlySeries = collections.namedtuple("HourlySeries", ["hours", "cumulative", "windowed"])
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECONDS_PER_HOUR = 3600
+_MAX_AMOUNT = numpy.iinfo(numpy.int16).max
+
+
+def _ToEpoch(timestamp: datetime.datetime) -> int:
+  """Returns the number of seconds from the epoch to a (naive) timestamp."""
+  return (timestamp - _EPOCH) // datetime.timedelta(seconds=1)
+
+
+def _FloorHour(timestamp: datetime.datetime) -> datetime.datetime:
+  """Returns the start of the hour for a timestamp."""
+  return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def FindPeak(values: numpy.ndarray) -> int:
+  """Returns the index of the first highest value of a series.
+
+  Args:
+    values(numpy.ndarray): the series. It can't be empty.
+  Returns:
+    int: the index of the peak.
+  """
+  return int(numpy.argmax(values))
+
+
+class EntryColumns:
+  """The scans of a database, loaded once into NumPy arrays.
+
+  The arrays are refreshed incrementally, by loading the rows added since the
+  last refresh. When rows were updated or deleted, ie: by
+  BeerLogDB.StartSession() or BeerLogDB.CompactEntries(), everything is loaded
+  again.
+
+  Attributes:
+    ids(numpy.ndarray): the Entry ids, as int64.
+    timestamps(numpy.ndarray): the times of the scans, in seconds since the
+      epoch, as int64. Timestamps are naive, and so are these.
+    amounts(numpy.ndarray): the amounts drunk, in cL, as int16.
+    scans(numpy.ndarray): the number of scans of each row, as int32.
+    characters(numpy.ndarray): the Character ids, as int32.
+    sessions(numpy.ndarray): the Session ids, as int32.
+  """
+
+  _SELECT_SQL = (
+    "SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), amount, scans, character_id, "
+    "IFNULL(session_id, 0) FROM entry WHERE id > ? ORDER BY id"
+  )
+
+  def __init__(self, database: beerlogdb.BeerLogDB):
+    """Initializes an EntryColumns.
+
+    Args:
+      database(beerlogdb.BeerLogDB): the database.
+    """
+    self._database = database
+    self._data_version = None
+    self._rewrites = None
+    self._character_names = {}
+    self._Clear()
+
+  def _Clear(self):
+    """Drops all the loaded rows."""
+    self.ids = numpy.zeros(0, dtype=numpy.int64)
+    self.timestamps = numpy.zeros(0, dtype=numpy.int64)
+    self.amounts = numpy.zeros(0, dtype=numpy.int16)
+    self.scans = numpy.zeros(0, dtype=numpy.int32)
+    self.characters = numpy.zeros(0, dtype=numpy.int32)
+    self.sessions = numpy.zeros(0, dtype=numpy.int32)
+
+  def _Load(self, after_id: int) -> numpy.ndarray:
+    """Returns the rows added after an Entry id.
+
+    Args:
+      after_id(int): the last Entry id already loaded.
+    Returns:
+      numpy.ndarray: the rows, one per line, as int64.
+    """
+    cursor = self._database.database.execute_sql(self._SELECT_SQL, (after_id,))
+    return numpy.array(cursor.fetchall(), dtype=numpy.int64).reshape(-1, 6)
+
+  def Refresh(self) -> bool:
+    """Loads the rows written since the last refresh.
+
+    Returns:
+      bool: whether the database changed since the last refresh.
+    Raises:
+      errors.BeerLogError: if an amount doesn't fit in the arrays.
+    """
+    version = self._database.GetDataVersion()
+    if version == self._data_version:
+      return False
+    self._data_version = version
+
+    rewrites = self._database.GetEntryRewrites()
+    if rewrites != self._rewrites:
+      self._Clear()
+      self._rewrites = rewrites
+    rows = self._Load(int(self.ids[-1]) if len(self.ids) else 0)
+    if len(rows) and rows[:, 2].max() > _MAX_AMOUNT:
+      raise errors.BeerLogError(
+        "Entry {0:d} has an amount larger than {1:d}cL".format(
+          int(rows[rows[:, 2].argmax(), 0]), _MAX_AMOUNT
+        )
+      )
+    self.ids = numpy.concatenate([self.ids, rows[:, 0]])
+    self.timestamps = numpy.concatenate([self.timestamps, rows[:, 1]])
+    self.amounts = numpy.concatenate([self.amounts, rows[:, 2].astype(numpy.int16)])
+    self.scans = numpy.concatenate([self.scans, rows[:, 3].astype(numpy.int32)])
+    self.characters = numpy.concatenate([self.characters, rows[:, 4].astype(numpy.int32)])
+    self.sessions = numpy.concatenate([self.sessions, rows[:, 5].astype(numpy.int32)])
+
+    # Characters can be renamed, so this is always read again. It's small.
+    cursor = self._database.database.execute_sql("SELECT id, name FROM character")
+    self._character_names = dict(cursor.fetchall())
+    return True
+
+  def _SumByCharacter(self, mask: numpy.ndarray, bins: numpy.ndarray, bins_count: int):
+    """Sums the amounts of some rows, per character and bin.
+
+    Args:
+      mask(numpy.ndarray): the rows to sum, as booleans.
+      bins(numpy.ndarray): the bin of each selected row, from 0 to bins_count.
+      bins_count(int): the number of bins.
+    Returns:
+      numpy.ndarray: the sums, as int64, with one line per Character id.
+    """
+    characters_count = int(self.characters.max()) + 1 if len(self.characters) else 0
+    sums = numpy.bincount(
+      self.characters[mask].astype(numpy.int64) * bins_count + bins,
+      weights=self.amounts[mask],
+      minlength=characters_count * bins_count,
+    )
+    return sums.astype(numpy.int64).reshape(characters_count, bins_count)
+
+  def GetHourlySeries(
+    self,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    window_hours: int = 2,
+    session_id: int | None = None,
+  ) -> HourlySeries:
+    """Returns per-character hourly statistics.
+
+    Args:
+      start(datetime): the first hour of the series.
+      end(datetime): the last hour of the series.
+      window_hours(int): the width of the window, centered on each hour, used
+        to compute the windowed amounts.
+      session_id(int): the optional Session to only count the scans of.
+        Defaults to all of them.
+    Returns:
+      HourlySeries: with the following fields:
+        hours(list[datetime]): the start of every hour between start and end.
+        cumulative(dict[str, numpy.ndarray]): for each character, the amount
+          drunk before each hour, in cL.
+        windowed(dict[str, numpy.ndarray]): for each character, the amount
+          drunk during the window centered on each hour, in cL.
+    """
+    self.Refresh()
+    first_hour = _FloorHour(start)
+    hours_count = int((_FloorHour(end) - first_hour).total_seconds() // 3600) + 1
+    hours = [first_hour + datetime.timedelta(hours=i) for i in range(hours_count)]
+    half_window = window_hours // 2
+
+    # Hour of every scan, relative to the start of the first window.
+    hour_indexes = (self.timestamps - _ToEpoch(first_hour)) // _SECONDS_PER_HOUR + half_window
+    buckets_count = hours_count + window_hours - 1
+    in_session = numpy.ones(len(self.ids), dtype=bool)
+    if session_id is not None:
+      in_session = self.sessions == session_id
+    in_buckets = in_session & (hour_indexes >= 0) & (hour_indexes < buckets_count)
+    buckets = self._SumByCharacter(in_buckets, hour_indexes[in_buckets], buckets_count)
+
+    # Everything drunk before the series starts
+    before = in_session & (hour_indexes < half_window)
+    amount_before = self._SumByCharacter(before, numpy.zeros(before.sum(), dtype=numpy.int64), 1)
+
+    sums = numpy.zeros((len(buckets), buckets_count + 1), dtype=numpy.int64)
+    numpy.cumsum(buckets, axis=1, out=sums[:, 1:])
+    windowed = sums[:, window_hours:] - sums[:, :hours_count]
+    cumulative = (
+      amount_before
+      + sums[:, half_window : half_window + hours_count]
+      - (sums[:, half_window : half_window + 1])
+    )
+
+    present = numpy.bincount(
+      self.characters[in_buckets | before], minlength=len(buckets)
+    ).nonzero()[0]
+    names = [self._character_names[character] for character in present]
+    return HourlySeries(
+      hours,
+      dict(zip(names, cumulative[present])),
+      dict(zip(names, windowed[present])),
+    )
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
@@ -0,0 +1,151 @@
+"""Tests for the analytics module"""
+
+import collections
+import datetime
+import unittest
+
+import numpy
+
+from beerlog import analytics
+from beerlog import beerlogdb
+
+
+def _GetHourlySeriesFromSQL(db, start, end, window_hours=2, session_id=None):
+  """Computes the hourly series with plain SQL, as a reference.
+
+  Args:
+    db(beerlogdb.BeerLogDB): the database.
+    start(datetime): the first hour of the series.
+    end(datetime): the last hour of the series.
+    window_hours(int): the width of the window, centered on each hour.
+    session_id(int): the optional Session to only count the scans of.
+  Returns:
+    analytics.HourlySeries: the series, as lists.
+  """
+  first_hour = start.replace(minute=0, second=0, microsecond=0)
+  last_hour = end.replace(minute=0, second=0, microsecond=0)
+  hours_count = int((last_hour - first_hour).total_seconds() // 3600) + 1
+  hours = [first_hour + datetime.timedelta(hours=i) for i in range(hours_count)]
+  half_window = window_hours // 2
+
+  amounts = collections.defaultdict(lambda: collections.defaultdict(int))
+  cursor = db.database.execute_sql(
+    "SELECT strftime('%Y-%m-%d %H:00:00', entry.timestamp), character.name, SUM(entry.amount) "
+    "FROM entry JOIN character ON character.id = entry.character_id "
+    "WHERE ? IS NULL OR entry.session_id = ? GROUP BY 1, 2",
+    (session_id, session_id),
+  )
+  for hour, name, amount in cursor.fetchall():
+    amounts[name][datetime.datetime.fromisoformat(hour)] = amount
+
+  cumulative = {}
+  windowed = {}
+  for name, hourly_amounts in amounts.items():
+    index_amounts = {
+      int((hour - first_hour).total_seconds() // 3600): amount
+      for hour, amount in hourly_amounts.items()
+    }
+    before = [amount for hour, amount in hourly_amounts.items() if hour < first_hour]
+    in_windows = [
+      index
+      for index in index_amounts
+      if -half_window <= index < hours_count + window_hours - half_window - 1
+    ]
+    if not before and not in_windows:
+      continue
+    cumulative[name] = []
+    windowed[name] = []
+    amount = sum(before)
+    for index in range(hours_count):
+      cumulative[name].append(amount)
+      amount += index_amounts.get(index, 0)
+      windowed[name].append(
+        sum(
+          index_amounts.get(i, 0)
+          for i in range(index - half_window, index + window_hours - half_window)
+        )
+      )
+  return analytics.HourlySeries(hours, cumulative, windowed)
+
+
+class EntryColumnsTests(unittest.TestCase):
+  """Tests for the EntryColumns class."""
+
+  def setUp(self):
+    self.db = beerlogdb.BeerLogDB(":memory:")
+    self.db.known_tags_list = {
+      "0x0": {"name": "toto", "glass": 33},
+      "0x1": {"name": "toto", "glass": 45},
+      "0x2": {"name": "tutu", "glass": 50},
+    }
+    self.columns = analytics.EntryColumns(self.db)
+
+  def testRefresh(self):
+    """Tests loading the rows incrementally."""
+    self.assertTrue(self.columns.Refresh())
+    self.assertEqual(0, len(self.columns.ids))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 15, 0))
+    self.assertTrue(self.columns.Refresh())
+    self.assertFalse(self.columns.Refresh())
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 16, 0))
+    self.assertTrue(self.columns.Refresh())
+    self.assertEqual([1, 2, 3], self.columns.ids.tolist())
+    self.assertEqual([33, 50, 45], self.columns.amounts.tolist())
+    self.assertEqual(numpy.int16, self.columns.amounts.dtype)
+    self.assertEqual(
+      analytics._ToEpoch(datetime.datetime(2019, 1, 1, 16, 0)),  # pylint: disable=protected-access
+      self.columns.timestamps[-1],
+    )
+
+    # Removed rows are noticed.
+    self.db.CompactEntries(datetime.datetime(2019, 1, 2))
+    self.db.Entry.delete().where(self.db.Entry.amount == 50).execute()
+    self.assertTrue(self.columns.Refresh())
+    self.assertEqual([33, 45], self.columns.amounts.tolist())
+
+    # So are rows updated in place.
+    self.db.StartSession(started_at=datetime.datetime(2019, 1, 1, 15, 0))
+    self.assertTrue(self.columns.Refresh())
+    self.assertEqual([1, self.db.GetCurrentSession().id], self.columns.sessions.tolist())
+
+  def testGetHourlySeries(self):
+    """Tests that the series are the same as the ones computed with SQL."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 11, 10))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 13, 10))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 10))
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 14, 50))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 16, 0, 0, 1234))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 19, 0))
+
+    start = datetime.datetime(2019, 1, 1, 14, 0)
+    end = datetime.datetime(2019, 1, 1, 17, 0)
+    series = self.columns.GetHourlySeries(start, end)
+    self.assertEqual([33 + 33, 33 + 33 + 33 + 45, 144, 144], series.cumulative["toto"].tolist())
+    self.assertEqual(2, analytics.FindPeak(series.windowed["tutu"]))
+
+    # A session started in the middle of an hour only counts its own scans.
+    self.db.StartSession(started_at=datetime.datetime(2019, 1, 1, 14, 30))
+    session_ids = [None] + [session.id for session in self.db.GetSessions()]
+    for window_hours in [1, 2, 3]:
+      for session_id in session_ids:
+        expected = _GetHourlySeriesFromSQL(
+          self.db, start, end, window_hours=window_hours, session_id=session_id
+        )
+        series = self.columns.GetHourlySeries(
+          start, end, window_hours=window_hours, session_id=session_id
+        )
+        self.assertEqual(expected.hours, series.hours)
+        self.assertEqual(
+          expected.cumulative, {name: c.tolist() for name, c in series.cumulative.items()}
+        )
+        self.assertEqual(
+          expected.windowed, {name: w.tolist() for name, w in series.windowed.items()}
+        )
+
+    series = self.columns.GetHourlySeries(start, end, session_id=self.db.GetCurrentSession().id)
+    self.assertEqual([0, 45, 45, 45], series.cumulative["toto"].tolist())
+
+
+if __name__ == "__main__":
+  unittest.main()
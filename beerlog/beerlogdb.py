@@ -2,60 +2,874 @@
 
 from __future__ import print_function
 
+import bisect
+import collections
+import copy
 import datetime
+import heapq
+import itertools
 import json
+import time
 
 import peewee
 
+from beerlog import cache
 from beerlog import errors
 from beerlog import constants
 
 
-database_proxy = peewee.Proxy()
+# Bump this, and add a step to BeerLogDB._GetMigrations(), whenever the schema
+# changes. The version is stored in the SQLite 'user_version' pragma.
+SCHEMA_VERSION = 10
+
+# Triggers keeping the aggregate tables in sync with the Entry table. They are
+# dropped and re-created whenever the schema is created or migrated.
+# An UPDATE is handled as removing the old row, then adding the new one.
+_REMOVE_FROM_TOTALS_SQL = """
+  DELETE FROM charactertotals
+  WHERE session_id = OLD.session_id AND character_id = OLD.character_id AND scans <= OLD.scans;
+  UPDATE charactertotals SET
+    total = total - OLD.amount,
+    scans = scans - OLD.scans,
+    first = (
+      SELECT MIN(timestamp) FROM entry
+      WHERE character_id = OLD.character_id AND session_id = OLD.session_id),
+    last = (
+      SELECT MAX(timestamp) FROM entry
+      WHERE character_id = OLD.character_id AND session_id = OLD.session_id),
+    pic = (
+      SELECT pic FROM entry WHERE character_id = OLD.character_id AND session_id = OLD.session_id
+      ORDER BY timestamp DESC, id DESC LIMIT 1)
+  WHERE session_id = OLD.session_id AND character_id = OLD.character_id;
+"""
+_ADD_TO_TOTALS_SQL = """
+  INSERT INTO charactertotals (session_id, character_id, total, scans, first, last, pic)
+  VALUES (
+    NEW.session_id, NEW.character_id, NEW.amount, NEW.scans, NEW.timestamp, NEW.timestamp, NEW.pic)
+  ON CONFLICT (session_id, character_id) DO UPDATE SET
+    total = total + excluded.total,
+    scans = scans + excluded.scans,
+    first = MIN(first, excluded.first),
+    pic = CASE WHEN excluded.last >= last THEN excluded.pic ELSE pic END,
+    last = MAX(last, excluded.last);
+"""
+# Counts the Entry rows updated or deleted, for the copies of the table kept in
+# memory. Updating keg_id or drinking_day doesn't change them.
+_COUNT_REWRITE_SQL = """
+  INSERT INTO entryrevision (id, rewrites) VALUES (1, 1)
+  ON CONFLICT (id) DO UPDATE SET rewrites = rewrites + 1;
+"""
+ENTRY_TRIGGERS = {
+  "entry_aggregates_insert": "AFTER INSERT ON entry BEGIN {0:s} END".format(_ADD_TO_TOTALS_SQL),
+  "entry_aggregates_delete": "AFTER DELETE ON entry BEGIN {0:s} END".format(
+    _REMOVE_FROM_TOTALS_SQL
+  ),
+  "entry_aggregates_update": (
+    "AFTER UPDATE OF session_id, character_id, amount, timestamp, pic, scans ON entry "
+    "BEGIN {0:s} {1:s} END"
+  ).format(_REMOVE_FROM_TOTALS_SQL, _ADD_TO_TOTALS_SQL),
+  # New entries go to the last keg tapped before them. Setting keg_id then
+  # fires entry_keg_update, which counts the amount in the keg.
+  "entry_keg_insert": """AFTER INSERT ON entry BEGIN
+    UPDATE entry SET keg_id = (
+      SELECT id FROM keg WHERE tapped_at <= NEW.timestamp ORDER BY tapped_at DESC, id DESC LIMIT 1)
+    WHERE id = NEW.id AND NEW.keg_id IS NULL;
+    UPDATE keg SET consumed_cl = consumed_cl + NEW.amount WHERE id = NEW.keg_id;
+  END""",
+  "entry_keg_delete": """AFTER DELETE ON entry BEGIN
+    UPDATE keg SET consumed_cl = consumed_cl - OLD.amount WHERE id = OLD.keg_id;
+  END""",
+  "entry_keg_update": """AFTER UPDATE OF keg_id, amount ON entry BEGIN
+    UPDATE keg SET consumed_cl = consumed_cl - OLD.amount WHERE id = OLD.keg_id;
+    UPDATE keg SET consumed_cl = consumed_cl + NEW.amount WHERE id = NEW.keg_id;
+  END""",
+  "entry_revision_delete": "AFTER DELETE ON entry BEGIN {0:s} END".format(_COUNT_REWRITE_SQL),
+  "entry_revision_update": (
+    "AFTER UPDATE OF session_id, character_id, amount, timestamp, scans ON entry BEGIN {0:s} END"
+  ).format(_COUNT_REWRITE_SQL),
+}
+# Triggers from previous schema versions, to drop when migrating.
+_OBSOLETE_TRIGGERS = ["entry_totals_insert", "entry_totals_delete", "entry_totals_update"]
+
+DrinkingDay = collections.namedtuple(
+  "DrinkingDay", ["day", "first", "last", "total_cl", "scans", "active_hours"]
+)
+# The scans of one character: their sorted timestamps, and the amount drunk and
+# number of scans up to, and including, each of them.
+CumulativeTotals = collections.namedtuple("CumulativeTotals", ["timestamps", "totals", "scans"])
+ScoreBoardRow = collections.namedtuple(
+  "ScoreBoardRow", ["character_name", "total", "scans", "last"]
+)
+# The *Rows() read methods return these plain tuples, instead of peewee model
+# instances which are much slower to build.
+EntryRow = collections.namedtuple(
+  "EntryRow", ["id", "timestamp", "character_name", "amount", "scans", "pic"]
+)
+# The amount drunk by a character up to, and including, a scan.
+AmountPoint = collections.namedtuple("AmountPoint", ["timestamp", "total"])
+
+
+# SQLite settings for the long lived kiosk connection. WAL lets readers (ie: the
+# web server) query the database while a scan is being written.
+DEFAULT_PRAGMAS = {
+  "journal_mode": "wal",
+  "synchronous": "normal",
+  "cache_size": -8000,  # Negative values are in KiB
+  "mmap_size": 0,
+  "temp_store": "memory",
+}
+# Pragmas that need write access, and can't be set on read-only connections.
+_WRITER_ONLY_PRAGMAS = ["journal_mode"]
+
+
+def MakePragmas(synchronous=None, cache_size=None, mmap_size=None, temp_store=None):
+  """Builds the SQLite pragmas, overriding the defaults with the set arguments.
+
+  Args:
+    synchronous(str): one of "off", "normal", "full" or "extra".
+    cache_size(int): the page cache size, in pages, or KiB if negative.
+    mmap_size(int): the maximum number of bytes to memory-map.
+    temp_store(str): one of "default", "file" or "memory".
+  Returns:
+    dict: the pragmas.
+  """
+  pragmas = dict(DEFAULT_PRAGMAS)
+  overrides = {
+    "synchronous": synchronous,
+    "cache_size": cache_size,
+    "mmap_size": mmap_size,
+    "temp_store": temp_store,
+  }
+  pragmas.update({name: value for name, value in overrides.items() if value is not None})
+  return pragmas
 
 
 # pylint: disable=no-init
 class BeerModel(peewee.Model):
-  """Model for the database."""
+  """Model for the database.
+
+  These models aren't bound to a database: every BeerLogDB queries its own
+  subclasses of them, made by _BindModels().
+  """
 
   id = None
 
-  class Meta:
-    """Sets Metadata for the database."""
 
-    database = database_proxy
+class Keg(BeerModel):
+  """class for one keg that was tapped.
+
+  consumed_cl is maintained by the ENTRY_TRIGGERS, from the Entry rows
+  attributed to this keg.
+  """
+
+  tapped_at = peewee.DateTimeField(default=datetime.datetime.now, index=True)
+  size_cl = peewee.IntegerField()
+  loss_percent = peewee.FloatField()
+  consumed_cl = peewee.IntegerField(default=0)
+
+  def GetRemaining(self) -> float:
+    """Returns the estimated volume left in the keg, in cL, accounting for losses."""
+    return self.size_cl - self.consumed_cl * (1 + self.loss_percent / 100)
+
+
+class Character(BeerModel):
+  """class for one character, ie: someone who drinks.
+
+  Names are unique, and compared case-insensitively.
+  """
+
+  name = peewee.CharField(unique=True, collation="NOCASE")
+
+
+class CharacterTag(BeerModel):
+  """class for the NFC tag of a character.
+
+  This keeps the scans of a tag attributed to the same Character when its
+  name changes in the known tags file.
+  """
+
+  uid = peewee.CharField(primary_key=True)
+  character = peewee.ForeignKeyField(Character, backref="tags")
+
+
+class Session(BeerModel):
+  """class for one session, ie: a party.
+
+  Sessions split the scans by time: a scan belongs to the last session started
+  before it. Scans made before the first session belong to the first session.
+  """
+
+  name = peewee.CharField(null=True)
+  started_at = peewee.DateTimeField(default=datetime.datetime.now, index=True)
+
+  def GetDisplayName(self) -> str:
+    """Returns the name of the session, or its number if it has no name."""
+    return self.name or "#{0:d}".format(self.id)
 
 
 class Entry(BeerModel):
   """class for one Entry in the BeerLog database."""
 
-  character_name = peewee.CharField()
+  # Indexed by the (character, timestamp) index.
+  character = peewee.ForeignKeyField(Character, backref="entries", index=False)
   amount = peewee.IntegerField(default=constants.DEFAULT_GLASS_SIZE)
-  timestamp = peewee.DateTimeField(default=datetime.datetime.now)
+  timestamp = peewee.DateTimeField(default=datetime.datetime.now, index=True)
   pic = peewee.CharField(null=True)
+  keg = peewee.ForeignKeyField(Keg, null=True, backref="entries")
+  # Always set by BeerLogDB. Indexed by the (session, timestamp) index.
+  session = peewee.ForeignKeyField(Session, null=True, backref="entries", index=False)
+  # The number of scans this row stands for. More than 1 for the summary rows
+  # made by BeerLogDB.CompactEntries().
+  scans = peewee.IntegerField(default=1, constraints=[peewee.SQL("DEFAULT 1")])
+  # Always set by BeerLogDB, from the timestamp and BeerLogDB.cutoff_hour.
+  drinking_day = peewee.DateField(null=True, index=True)
+
+  class Meta:
+    """Sets the indexes for the Entry table."""
+
+    indexes = (
+      (("character", "timestamp"), False),
+      (("session", "timestamp"), False),
+    )
+
+  @property
+  def character_name(self) -> str:
+    """The name of the character. Select the Character too, to avoid a query."""
+    return self.character.name
+
+
+class CharacterTotals(BeerModel):
+  """Aggregated scans for one character during one session.
+
+  This table is maintained by the ENTRY_TRIGGERS, and should never be written
+  to directly.
+  """
+
+  # Indexed by the primary key.
+  session = peewee.ForeignKeyField(Session, index=False)
+  character = peewee.ForeignKeyField(Character)
+  total = peewee.IntegerField(default=0)
+  scans = peewee.IntegerField(default=0)
+  first = peewee.DateTimeField()
+  last = peewee.DateTimeField()
+  pic = peewee.CharField(null=True)
+
+  class Meta:
+    """Sets the primary key for the CharacterTotals table."""
+
+    primary_key = peewee.CompositeKey("session", "character")
+
+  @property
+  def character_name(self) -> str:
+    """The name of the character. Select the Character too, to avoid a query."""
+    return self.character.name
+
+
+class EntryRevision(BeerModel):
+  """The number of Entry rows updated or deleted so far.
+
+  This table has one row, maintained by the ENTRY_TRIGGERS. The copies of the
+  Entry table kept in memory only need to load the new rows while it doesn't
+  change.
+  """
+
+  rewrites = peewee.IntegerField(default=0)
+
+
+MODELS = [Keg, Character, CharacterTag, Session, Entry, CharacterTotals, EntryRevision]
+
+
+def _BindModels(database: peewee.Database) -> dict:
+  """Makes subclasses of the models, bound to a database.
+
+  The foreign keys of the subclasses point to the other subclasses, so that
+  related rows are also fetched from this database.
+
+  Args:
+    database(peewee.Database): the database.
+  Returns:
+    dict[str, type]: the bound models, by name.
+  """
+  # pylint: disable=protected-access
+  bound_models = {}
+  for model in MODELS:
+    meta = type("Meta", (), {"database": database, "table_name": model._meta.table_name})
+    attributes = {"__module__": __name__, "__doc__": model.__doc__, "Meta": meta}
+    for field in model._meta.refs:
+      foreign_key = copy.deepcopy(field)
+      foreign_key.rel_model = bound_models[field.rel_model.__name__]
+      foreign_key.rel_field = None
+      foreign_key.declared_backref = field.backref
+      attributes[field.name] = foreign_key
+    bound_models[model.__name__] = type(model.__name__, (model,), attributes)
+  return bound_models
+
+
+def _FloorHour(timestamp: datetime.datetime) -> datetime.datetime:
+  """Returns the start of the hour for a timestamp."""
+  return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class CumulativeTotalsIndex:
+  """The prefix sums of the scans of every character, kept in memory.
+
+  The entries added since the last refresh are appended to the series of their
+  character, or spliced in if they were scanned before its last entry. When
+  entries were updated or deleted, ie: by BeerLogDB.StartSession() or
+  BeerLogDB.CompactEntries(), everything is loaded again.
+  """
+
+  def __init__(self, database: "BeerLogDB"):
+    """Initializes a CumulativeTotalsIndex.
+
+    Args:
+      database(BeerLogDB): the database.
+    """
+    self._database = database
+    self._data_version = None
+    self._rewrites = None
+    self._Clear()
+
+  def _Clear(self):
+    """Drops all the loaded entries."""
+    self._series = {}
+    self._series_by_name = {}
+    self._last_id = 0
+
+  def _Extend(self, character_id: int, rows: list[tuple]):
+    """Adds entries to the series of a character.
+
+    Args:
+      character_id(int): the Character id.
+      rows(list[tuple]): the timestamp, amount and scans of the new entries,
+        sorted by timestamp, then by id.
+    """
+    series = self._series.setdefault(character_id, CumulativeTotals([], [], []))
+    index = bisect.bisect_right(series.timestamps, rows[0][0])
+    if index < len(series.timestamps):
+      # Late scans: merge them with the entries scanned after them. On equal
+      # timestamps, the older entries, which have smaller ids, come first.
+      tail = [
+        (
+          series.timestamps[i],
+          series.totals[i] - (series.totals[i - 1] if i else 0),
+          series.scans[i] - (series.scans[i - 1] if i else 0),
+        )
+        for i in range(index, len(series.timestamps))
+      ]
+      rows = list(heapq.merge(tail, rows, key=lambda row: row[0]))
+      del series.timestamps[index:]
+      del series.totals[index:]
+      del series.scans[index:]
+    total = series.totals[-1] if series.totals else 0
+    scans = series.scans[-1] if series.scans else 0
+    for timestamp, amount, scan_count in rows:
+      total += amount
+      scans += scan_count
+      series.timestamps.append(timestamp)
+      series.totals.append(total)
+      series.scans.append(scans)
+
+  def _Load(self, after_id: int) -> list[tuple]:
+    """Returns the entries added after an Entry id.
+
+    Args:
+      after_id(int): the last Entry id already loaded.
+    Returns:
+      list[tuple]: the id, Character id, timestamp, amount and scans of the
+        entries, sorted by character, then by timestamp and id.
+    """
+    entry = self._database.Entry
+    query = (
+      entry.select(entry.id, entry.character, entry.timestamp, entry.amount, entry.scans)
+      .where(entry.id > after_id)
+      .order_by(entry.id)
+    )
+    # Sorting here lets SQLite only read the new rows, by id.
+    return sorted(query.tuples().iterator(), key=lambda row: (row[1], row[2], row[0]))
+
+  def Refresh(self) -> bool:
+    """Loads the entries written since the last refresh.
+
+    Returns:
+      bool: whether the database changed since the last refresh.
+    """
+    version = self._database.GetDataVersion()
+    if version == self._data_version:
+      return False
+    self._data_version = version
+
+    rewrites = self._database.GetEntryRewrites()
+    if rewrites != self._rewrites:
+      self._Clear()
+      self._rewrites = rewrites
+    rows = self._Load(self._last_id)
+    for character_id, character_rows in itertools.groupby(rows, key=lambda row: row[1]):
+      character_rows = list(character_rows)
+      self._last_id = max(self._last_id, max(row[0] for row in character_rows))
+      self._Extend(character_id, [row[2:] for row in character_rows])
+
+    # Characters can be renamed, so this is always read again. It's small.
+    character = self._database.Character
+    names = dict(character.select(character.id, character.name).tuples())
+    self._series_by_name = {
+      names[character_id]: series for character_id, series in self._series.items()
+    }
+    return True
+
+  def GetCumulativeTotals(self) -> dict[str, CumulativeTotals]:
+    """Returns the prefix sums of the scans of every character.
+
+    The lists are updated in place by later refreshes, and shouldn't be
+    modified.
+
+    Returns:
+      dict[str, CumulativeTotals]: the prefix sums, per character name.
+    """
+    self.Refresh()
+    return self._series_by_name
 
 
 class BeerLogDB:
-  """Wrapper for the database."""
+  """Wrapper for the database.
+
+  Each instance has its own connection, and its own subclasses of the models,
+  bound to it: the Entry, Character, etc. attributes. Several databases can
+  then be open at the same time, ie: an archive next to the live one.
+  """
 
-  def __init__(self, database_path: str):
+  # How long, in seconds, to cache results that depend on the current time.
+  TIME_RELATIVE_TTL = 5.0
+  # Number of rows AddEntries() keeps in memory before inserting them.
+  BULK_INSERT_CHUNK_SIZE = 1000
+  # Number of rows IterEntries() fetches per query.
+  EXPORT_CHUNK_SIZE = 1000
+  # Approximate number of rows CompactEntries() processes per transaction.
+  COMPACT_CHUNK_SIZE = 1000
+
+  # How often, in seconds, to check for writes from other connections.
+  EXTERNAL_CHANGES_CHECK_INTERVAL = 1.0
+
+  def __init__(self, database_path: str, pragmas: dict | None = None, read_only: bool = False):
+    """Initializes a BeerLogDB.
+
+    Args:
+      database_path(str): the path to the SQLite file, or ":memory:".
+      pragmas(dict): the SQLite pragmas to set on the connection. Defaults to
+        DEFAULT_PRAGMAS.
+      read_only(bool): whether to open a read-only connection, for processes
+        reading a database that the kiosk writes to.
+    Raises:
+      errors.BeerLogError: if the database can't be used.
+    """
     self.database_path = database_path
-    sqlite_db = peewee.SqliteDatabase(self.database_path)
-    database_proxy.initialize(sqlite_db)
+    self.read_only = read_only
+    self.cutoff_hour = 6  # We don't expect a scan after 6am
+    if pragmas is None:
+      pragmas = DEFAULT_PRAGMAS
+    self.pragmas = pragmas
+    if read_only:
+      if database_path == ":memory:":
+        raise errors.BeerLogError("Can't open an in-memory database in read-only mode")
+      pragmas = {k: v for k, v in pragmas.items() if k not in _WRITER_ONLY_PRAGMAS}
+      sqlite_db = peewee.SqliteDatabase(
+        "file:{0:s}?mode=ro".format(database_path), uri=True, pragmas=pragmas
+      )
+    else:
+      sqlite_db = peewee.SqliteDatabase(self.database_path, pragmas=pragmas)
+    self.database = sqlite_db
+    bound_models = _BindModels(self.database)
+    self.models = [bound_models[model.__name__] for model in MODELS]
+    # pylint: disable=invalid-name
+    self.Keg = bound_models["Keg"]
+    self.Character = bound_models["Character"]
+    self.CharacterTag = bound_models["CharacterTag"]
+    self.Session = bound_models["Session"]
+    self.Entry = bound_models["Entry"]
+    self.CharacterTotals = bound_models["CharacterTotals"]
+    self.EntryRevision = bound_models["EntryRevision"]
+    # pylint: enable=invalid-name
+    self.Connect()
+
+    if read_only:
+      self._CheckSchemaVersion()
+    elif sqlite_db.table_exists(self.Entry._meta.table_name):  # pylint: disable=protected-access
+      self._Migrate()
+    else:
+      self._CreateSchema()
 
-    sqlite_db.create_tables([Entry], safe=True)
+    self._external_version = None
+    self._last_external_check = 0.0
+    self._external_change_notified = False
+    self.cache = cache.ReadCache(self.GetDataVersion)
+    self._cumulative_totals = CumulativeTotalsIndex(self)
 
     self.known_tags_list = {}
-    self.cutoff_hour = 6  # We don't expect a scan after 6am
+    # Maps a tag uid to its Character id, and the name it had in known_tags_list.
+    self._tag_characters = {}
     self.pertes_percent = 7
 
+  def GetDataVersion(self):
+    """Returns a value that changes whenever the database is written to.
+
+    The connection's total_changes counts the rows we wrote ourselves, while
+    the data_version pragma changes when other connections commit.
+
+    Returns:
+      tuple: the version.
+    """
+    connection = self.database.connection()
+    now = time.monotonic()
+    if (
+      self._external_change_notified
+      or now - self._last_external_check >= self.EXTERNAL_CHANGES_CHECK_INTERVAL
+    ):
+      self._external_change_notified = False
+      self._external_version = self.database.execute_sql("PRAGMA data_version").fetchone()[0]
+      self._last_external_check = now
+    return (id(connection), connection.total_changes, self._external_version)
+
+  def GetEntryRewrites(self) -> int:
+    """Returns how many Entry rows were updated or deleted so far.
+
+    Returns:
+      int: the count, which only ever grows.
+    """
+    query = self.EntryRevision.select(peewee.fn.MAX(self.EntryRevision.rewrites))
+    return query.scalar() or 0  # pylint: disable=no-value-for-parameter
+
+  def NotifyExternalChange(self):
+    """Tells that another connection committed, ie: the EntryWriter.
+
+    The next GetDataVersion() then checks for external changes right away. This
+    can be called from any thread.
+    """
+    self._external_change_notified = True
+
+  def GetSchemaVersion(self) -> int:
+    """Returns the schema version of the database."""
+    return self.database.execute_sql("PRAGMA user_version").fetchone()[0]
+
+  def _SetSchemaVersion(self, version: int):
+    """Stores the schema version of the database.
+
+    Args:
+      version(int): the new schema version.
+    """
+    self.database.execute_sql("PRAGMA user_version = {0:d}".format(version))
+
+  def _GetMigrations(self):
+    """Returns the ordered list of schema migrations.
+
+    The migration at index i brings the schema from version i to version i+1.
+
+    Returns:
+      list[callable]: the migration methods.
+    """
+    return [
+      self._MigrateAddEntryIndexes,
+      self._MigrateAddCharacterTotals,
+      self._MigrateAddHourlyTotals,
+      self._MigrateAddKegs,
+      self._MigrateAddCharacters,
+      self._MigrateAddSessions,
+      self._MigrateAddEntryScans,
+      self._MigrateAddDrinkingDays,
+      self._MigrateDropHourlyTotals,
+      self._MigrateAddEntryRevision,
+    ]
+
+  def _CreateSchema(self):
+    """Creates all tables and triggers in an empty database."""
+    with self.database.atomic():
+      self.database.create_tables(self.models)
+      self._CreateTriggers()
+      self._SetSchemaVersion(SCHEMA_VERSION)
+
+  def _CreateTriggers(self):
+    """(Re-)creates the triggers maintaining the aggregate tables."""
+    for name in _OBSOLETE_TRIGGERS:
+      self.database.execute_sql("DROP TRIGGER IF EXISTS {0:s}".format(name))
+    for name, body in ENTRY_TRIGGERS.items():
+      self.database.execute_sql("DROP TRIGGER IF EXISTS {0:s}".format(name))
+      self.database.execute_sql("CREATE TRIGGER {0:s} {1:s}".format(name, body))
+
+  def _CheckSchemaVersion(self):
+    """Checks that a database we can't migrate has the expected schema.
+
+    Raises:
+      errors.BeerLogError: if the schema version isn't SCHEMA_VERSION.
+    """
+    version = self.GetSchemaVersion()
+    if version != SCHEMA_VERSION:
+      raise errors.BeerLogError(
+        "Database schema version {0:d} is not the expected version {1:d}. Run the kiosk "
+        "once to upgrade it.".format(version, SCHEMA_VERSION)
+      )
+
+  def _Migrate(self):
+    """Upgrades the database schema to SCHEMA_VERSION.
+
+    Raises:
+      errors.BeerLogError: if the database was created by a newer version.
+    """
+    version = self.GetSchemaVersion()
+    migrations = self._GetMigrations()
+    if version > len(migrations):
+      raise errors.BeerLogError(
+        "Database schema version {0:d} is newer than supported version {1:d}".format(
+          version, SCHEMA_VERSION
+        )
+      )
+    if version == len(migrations):
+      return
+    for new_version, migration in enumerate(migrations[version:], start=version + 1):
+      with self.database.atomic():
+        migration()
+        self._SetSchemaVersion(new_version)
+    # Migrations only create the aggregate tables: the rebuild queries use the
+    # models, which match the latest schema only.
+    with self.database.atomic():
+      self.RebuildCharacterTotals()
+      self.RebuildKegConsumption()
+      self._CreateTriggers()
+
+  # Migrations use literal SQL, as the models describe the latest schema only.
+  def _MigrateAddEntryIndexes(self):
+    """Schema version 1: indexes Entry on timestamp and (character_name, timestamp)."""
+    self.database.execute_sql("CREATE INDEX IF NOT EXISTS entry_timestamp ON entry (timestamp)")
+    self.database.execute_sql(
+      "CREATE INDEX IF NOT EXISTS entry_character_name_timestamp "
+      "ON entry (character_name, timestamp)"
+    )
+
+  def _MigrateAddCharacterTotals(self):
+    """Schema version 2: adds the CharacterTotals table."""
+    self.database.execute_sql(
+      "CREATE TABLE IF NOT EXISTS charactertotals ("
+      "character_name VARCHAR(255) NOT NULL PRIMARY KEY, total INTEGER NOT NULL, "
+      "scans INTEGER NOT NULL, first DATETIME NOT NULL, last DATETIME NOT NULL, "
+      "pic VARCHAR(255))"
+    )
+
+  def _MigrateAddHourlyTotals(self):
+    """Schema version 3: adds the HourlyTotals table."""
+    self.database.execute_sql(
+      "CREATE TABLE IF NOT EXISTS hourlytotals ("
+      "hour DATETIME NOT NULL, character_name VARCHAR(255) NOT NULL, "
+      "total INTEGER NOT NULL, scans INTEGER NOT NULL, PRIMARY KEY (hour, character_name))"
+    )
+
+  def _MigrateAddKegs(self):
+    """Schema version 4: adds the Keg table, and the Entry.keg_id column."""
+    self.database.execute_sql(
+      "CREATE TABLE IF NOT EXISTS keg (id INTEGER NOT NULL PRIMARY KEY, "
+      "tapped_at DATETIME NOT NULL, size_cl INTEGER NOT NULL, loss_percent REAL NOT NULL, "
+      "consumed_cl INTEGER NOT NULL)"
+    )
+    self.database.execute_sql("CREATE INDEX IF NOT EXISTS keg_tapped_at ON keg (tapped_at)")
+    self.database.execute_sql("ALTER TABLE entry ADD COLUMN keg_id INTEGER REFERENCES keg (id)")
+    self.database.execute_sql("CREATE INDEX IF NOT EXISTS entry_keg_id ON entry (keg_id)")
+
+  def _MigrateAddCharacters(self):
+    """Schema version 5: adds the Character table, and replaces the character
+    names in other tables with a foreign key.
+
+    Names differing only by their case are merged, keeping the most recent one.
+    """
+    self.database.execute_sql(
+      "CREATE TABLE character (id INTEGER NOT NULL PRIMARY KEY, "
+      "name VARCHAR(255) NOT NULL COLLATE NOCASE)"
+    )
+    self.database.execute_sql("CREATE UNIQUE INDEX character_name ON character (name)")
+    # Keep the spelling of the latest scan, and number characters by their first scan.
+    self.database.execute_sql(
+      "INSERT INTO character (name) SELECT name FROM ("
+      "SELECT character_name AS name, "
+      "ROW_NUMBER() OVER (PARTITION BY character_name COLLATE NOCASE "
+      "ORDER BY timestamp DESC, id DESC) AS recent, "
+      "MIN(id) OVER (PARTITION BY character_name COLLATE NOCASE) AS first_id "
+      "FROM entry) WHERE recent = 1 ORDER BY first_id"
+    )
+    self.database.execute_sql(
+      "CREATE TABLE charactertag (uid VARCHAR(255) NOT NULL PRIMARY KEY, "
+      "character_id INTEGER NOT NULL REFERENCES character (id))"
+    )
+    self.database.execute_sql(
+      "CREATE INDEX charactertag_character_id ON charactertag (character_id)"
+    )
+
+    # SQLite can't change a column, so the table is copied.
+    self.database.execute_sql(
+      "CREATE TABLE entry_new (id INTEGER NOT NULL PRIMARY KEY, "
+      "character_id INTEGER NOT NULL REFERENCES character (id), amount INTEGER NOT NULL, "
+      "timestamp DATETIME NOT NULL, pic VARCHAR(255), keg_id INTEGER REFERENCES keg (id))"
+    )
+    self.database.execute_sql(
+      "INSERT INTO entry_new (id, character_id, amount, timestamp, pic, keg_id) "
+      "SELECT entry.id, character.id, amount, timestamp, pic, keg_id "
+      "FROM entry JOIN character ON character.name = entry.character_name"
+    )
+    self.database.execute_sql("DROP TABLE entry")
+    self.database.execute_sql("ALTER TABLE entry_new RENAME TO entry")
+    self.database.execute_sql("CREATE INDEX entry_timestamp ON entry (timestamp)")
+    self.database.execute_sql("CREATE INDEX entry_keg_id ON entry (keg_id)")
+    self.database.execute_sql(
+      "CREATE INDEX entry_character_id_timestamp ON entry (character_id, timestamp)"
+    )
+
+    self.database.execute_sql("DROP TABLE charactertotals")
+    self.database.execute_sql(
+      "CREATE TABLE charactertotals ("
+      "character_id INTEGER NOT NULL PRIMARY KEY REFERENCES character (id), "
+      "total INTEGER NOT NULL, scans INTEGER NOT NULL, first DATETIME NOT NULL, "
+      "last DATETIME NOT NULL, pic VARCHAR(255))"
+    )
+    self.database.execute_sql("DROP TABLE hourlytotals")
+    self.database.execute_sql(
+      "CREATE TABLE hourlytotals (hour DATETIME NOT NULL, "
+      "character_id INTEGER NOT NULL REFERENCES character (id), total INTEGER NOT NULL, "
+      "scans INTEGER NOT NULL, PRIMARY KEY (hour, character_id))"
+    )
+
+  def _MigrateAddSessions(self):
+    """Schema version 6: adds the Session table, and the Entry.session_id column.
+
+    Existing scans all go to a first session.
+    """
+    self.database.execute_sql(
+      "CREATE TABLE session (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(255), "
+      "started_at DATETIME NOT NULL)"
+    )
+    self.database.execute_sql("CREATE INDEX session_started_at ON session (started_at)")
+    self.database.execute_sql(
+      "INSERT INTO session (started_at) SELECT MIN(timestamp) FROM entry HAVING COUNT(*) > 0"
+    )
+    self.database.execute_sql(
+      "ALTER TABLE entry ADD COLUMN session_id INTEGER REFERENCES session (id)"
+    )
+    self.database.execute_sql("UPDATE entry SET session_id = (SELECT MIN(id) FROM session)")
+    self.database.execute_sql(
+      "CREATE INDEX entry_session_id_timestamp ON entry (session_id, timestamp)"
+    )
+    self.database.execute_sql("DROP TABLE charactertotals")
+    self.database.execute_sql(
+      "CREATE TABLE charactertotals (session_id INTEGER NOT NULL REFERENCES session (id), "
+      "character_id INTEGER NOT NULL REFERENCES character (id), "
+      "total INTEGER NOT NULL, scans INTEGER NOT NULL, first DATETIME NOT NULL, "
+      "last DATETIME NOT NULL, pic VARCHAR(255), PRIMARY KEY (session_id, character_id))"
+    )
+    self.database.execute_sql(
+      "CREATE INDEX charactertotals_character_id ON charactertotals (character_id)"
+    )
+
+  def _MigrateAddEntryScans(self):
+    """Schema version 7: adds the Entry.scans column."""
+    self.database.execute_sql("ALTER TABLE entry ADD COLUMN scans INTEGER NOT NULL DEFAULT 1")
+
+  def _MigrateAddDrinkingDays(self):
+    """Schema version 8: adds the Entry.drinking_day column."""
+    self.database.execute_sql("ALTER TABLE entry ADD COLUMN drinking_day DATE")
+    self.database.execute_sql("CREATE INDEX entry_drinking_day ON entry (drinking_day)")
+    self.database.execute_sql(
+      "UPDATE entry SET drinking_day = date(timestamp, ?)", (self._GetCutoffModifier(),)
+    )
+
+  def _MigrateDropHourlyTotals(self):
+    """Schema version 9: drops the HourlyTotals table, as the charts are computed
+    from the Entry rows by analytics.EntryColumns."""
+    # The triggers still update the table, until they're created again.
+    for name in ENTRY_TRIGGERS:
+      self.database.execute_sql("DROP TRIGGER IF EXISTS {0:s}".format(name))
+    self.database.execute_sql("DROP TABLE IF EXISTS hourlytotals")
+
+  def _MigrateAddEntryRevision(self):
+    """Schema version 10: adds the EntryRevision table."""
+    self.database.execute_sql(
+      "CREATE TABLE entryrevision (id INTEGER NOT NULL PRIMARY KEY, rewrites INTEGER NOT NULL)"
+    )
+
+  def RebuildCharacterTotals(self):
+    """Recomputes the CharacterTotals table from all the Entry rows."""
+    with self.database.atomic():
+      self.CharacterTotals.delete().execute()  # pylint: disable=no-value-for-parameter
+      latest = self.Entry.alias()
+      latest_pic = (
+        latest.select(latest.pic)
+        .where(latest.session == self.Entry.session, latest.character == self.Entry.character)
+        .order_by(latest.timestamp.desc(), latest.id.desc())
+        .limit(1)
+      )
+      query = self.Entry.select(
+        self.Entry.session,
+        self.Entry.character,
+        peewee.fn.SUM(self.Entry.amount),
+        peewee.fn.SUM(self.Entry.scans),
+        peewee.fn.MIN(self.Entry.timestamp),
+        peewee.fn.MAX(self.Entry.timestamp),
+        latest_pic,
+      ).group_by(self.Entry.session, self.Entry.character)
+      self.CharacterTotals.insert_from(
+        query,
+        [
+          self.CharacterTotals.session,
+          self.CharacterTotals.character,
+          self.CharacterTotals.total,
+          self.CharacterTotals.scans,
+          self.CharacterTotals.first,
+          self.CharacterTotals.last,
+          self.CharacterTotals.pic,
+        ],
+      ).execute()
+
+  def RebuildKegConsumption(self):
+    """Recomputes the consumed amount of every keg from the Entry rows."""
+    consumed = self.Entry.select(peewee.fn.COALESCE(peewee.fn.SUM(self.Entry.amount), 0)).where(
+      self.Entry.keg == self.Keg.id
+    )
+    self.Keg.update(consumed_cl=consumed).execute()  # pylint: disable=no-value-for-parameter
+
+  def RebuildDrinkingDays(self):
+    """Recomputes the drinking day of every Entry, ie: after changing cutoff_hour."""
+    self.Entry.update(
+      drinking_day=peewee.fn.date(self.Entry.timestamp, self._GetCutoffModifier())
+    ).execute()  # pylint: disable=no-value-for-parameter
+
+  def RebuildAggregates(self):
+    """Recomputes all the tables and columns derived from the Entry table."""
+    self.RebuildCharacterTotals()
+    self.RebuildKegConsumption()
+    self.RebuildDrinkingDays()
+    self.cache.Invalidate()
+
+  def _GetCutoffModifier(self) -> str:
+    """Returns the SQLite date modifier turning a timestamp into its drinking day."""
+    return "-{0:d} hours".format(self.cutoff_hour)
+
+  def GetDrinkingDay(self, timestamp: datetime.datetime) -> datetime.date:
+    """Returns the drinking day of a point in time.
+
+    A drinking day starts at cutoff_hour, and ends just before cutoff_hour the
+    next day.
+
+    Args:
+      timestamp(datetime.datetime): the point in time.
+    Returns:
+      datetime.date: the drinking day.
+    """
+    return (timestamp - datetime.timedelta(hours=self.cutoff_hour)).date()
+
   def Connect(self):
-    """Connects to the database."""
-    database_proxy.connect()
+    """Connects to the database, if not already connected.
+
+    The connection is long lived, and should only be closed with Close() when
+    we're done with the database.
+    """
+    self.database.connect(reuse_if_open=True)
 
   def Close(self):
     """Closes the database."""
-    database_proxy.close()
+    self.database.close()
 
   def GetHexFromName(self, name):
     """Returns the hex id for a specific realname.
@@ -72,6 +886,67 @@ class BeerLogDB:
           return hexid
     return None
 
+  def GetCharacter(self, name: str) -> Character | None:
+    """Returns a Character from its name, ignoring case.
+
+    Args:
+      name(str): the name of the character.
+    Returns:
+      Character: the character, or None if it doesn't exist.
+    """
+    return self.Character.get_or_none(self.Character.name == name)
+
+  def _GetCharacterIdFromName(self, name: str) -> int:
+    """Returns the id of a Character, creating it if needed.
+
+    Args:
+      name(str): the name of the character.
+    Returns:
+      int: the id of the character.
+    """
+    character = self.GetCharacter(name)
+    if not character:
+      character = self.Character.create(name=name)
+    return character.id
+
+  def _GetCharacterIdFromHexID(self, uid: str, name: str | None = None) -> int:
+    """Returns the id of the Character owning a tag.
+
+    The first time a tag is seen, it's attributed to the Character with its
+    name, which is created if needed. Later on, if the name of the tag changed
+    in known_tags_list, the Character is renamed.
+
+    Args:
+      uid(str): the uid in form 0x0580000000050002
+      name(str): the name of the tag. Defaults to its name in known_tags_list.
+    Returns:
+      int: the id of the character.
+    Raises:
+      errors.BeerLogError: if the uid can't be found.
+    """
+    name = name or self.GetNameFromHexID(uid)
+    cached = self._tag_characters.get(uid)
+    if cached and cached[1] == name:
+      return cached[0]
+
+    with self.database.atomic():
+      tag = self.CharacterTag.get_or_none(self.CharacterTag.uid == uid)
+      if not tag:
+        character_id = self._GetCharacterIdFromName(name)
+        self.CharacterTag.create(uid=uid, character=character_id)
+      else:
+        character_id = tag.character_id
+        other = self.GetCharacter(name)
+        if other is None or other.id == character_id:
+          self.Character.update(name=name).where(self.Character.id == character_id).execute()
+        else:
+          # Someone else already has this name: the tag is theirs now.
+          character_id = other.id
+          tag.character = character_id
+          tag.save()
+    self._tag_characters[uid] = (character_id, name)
+    return character_id
+
   def AddNameEntry(self, character_name, pic=None, time=None):
     character_hexid = self.GetHexFromName(character_name)
     if not character_hexid:
@@ -89,32 +964,424 @@ class BeerLogDB:
     Returns:
       Entry: the Entry that was stored in the database.
     """
-    amount = self.GetGlassFromHexID(character_hexid)
-    character_name = self.GetNameFromHexID(character_hexid)
-    if time:
-      entry = Entry.create(character_name=character_name, amount=amount, timestamp=time, pic=pic)
-    else:
-      entry = Entry.create(
-        character_name=character_name, amount=amount, timestamp=datetime.datetime.now(), pic=pic
-      )
+    return self.AddTagEntry(
+      character_hexid,
+      self.GetNameFromHexID(character_hexid),
+      self.GetGlassFromHexID(character_hexid),
+      pic=pic,
+      time=time,
+    )
+
+  def AddTagEntry(self, character_hexid, name, amount, pic=None, time=None):
+    """Inserts an entry for a tag which was already looked up in
+    known_tags_list, ie: by the EntryWriter, which has its own BeerLogDB.
+
+    Args:
+      character_hexid(str): the hexid of the character in the tag.
+      name(str): the name of the tag.
+      amount(int): the glass size of the tag.
+      pic(str): the path to a picture.
+      time(datetime): the optional time to set when adding the Entry.
+
+    Returns:
+      Entry: the Entry that was stored in the database.
+    """
+    character_id = self._GetCharacterIdFromHexID(character_hexid, name=name)
+    timestamp = time or datetime.datetime.now()
+    entry = self.Entry.create(
+      character=character_id,
+      amount=amount,
+      timestamp=timestamp,
+      pic=pic,
+      session=self._GetSessionIdAt(timestamp),
+      drinking_day=self.GetDrinkingDay(timestamp),
+    )
+    self.cache.Invalidate()
     return entry
 
+  def AddTagEntries(self, scans, before_commit=None):
+    """Inserts entries for tags which were already looked up, in one
+    transaction.
+
+    Args:
+      scans(list[tuple]): the hexid, name, amount and time of each scan.
+      before_commit(callable): the optional function to call once the entries
+        are inserted, right before committing.
+    Raises:
+      Exception: if the transaction failed. No entry is inserted then.
+    """
+    # Characters created during the transaction are gone if it's rolled back.
+    tag_characters = dict(self._tag_characters)
+    try:
+      with self.database.atomic():
+        for character_hexid, name, amount, time in scans:
+          self.AddTagEntry(character_hexid, name, amount, time=time)
+        if before_commit:
+          before_commit()
+    except Exception:
+      self._tag_characters = tag_characters
+      raise
+
+  def _MakeEntryRow(self, scan, tags):
+    """Converts a scan to the values of an Entry row.
+
+    Args:
+      scan(dict): the scan, as described in AddEntries().
+      tags(dict): a cache of (character_id, amount) per tag uid, or per
+        ("name", lowercase name).
+    Returns:
+      tuple: the character_id, amount, timestamp, pic and scans.
+    Raises:
+      errors.BeerLogError: if the scan is invalid.
+    """
+    uid = scan.get("uid")
+    if uid:
+      if uid not in tags:
+        tags[uid] = (self._GetCharacterIdFromHexID(uid), self.GetGlassFromHexID(uid))
+      character_id, amount = tags[uid]
+    else:
+      character_name = scan.get("character_name")
+      amount = scan.get("amount")
+      if not character_name or amount is None:
+        raise errors.BeerLogError("A scan needs a uid, or a character_name and an amount")
+      key = ("name", character_name.lower())
+      if key not in tags:
+        tags[key] = (self._GetCharacterIdFromName(character_name), None)
+      character_id = tags[key][0]
+    timestamp = scan.get("timestamp")
+    if isinstance(timestamp, str):
+      try:
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+      except ValueError as e:
+        raise errors.BeerLogError("Invalid timestamp {0:s}: {1!s}".format(timestamp, e))
+    if not isinstance(timestamp, datetime.datetime):
+      raise errors.BeerLogError("A scan needs a timestamp")
+    if timestamp.tzinfo is not None:
+      # Stored like the scans of the kiosk, in naive local time.
+      timestamp = timestamp.astimezone().replace(tzinfo=None)
+    scans = int(scan.get("scans", 1))
+    if scans < 1:
+      raise errors.BeerLogError("Invalid number of scans {0:d}".format(scans))
+    return (character_id, int(amount), str(timestamp), scan.get("pic"), scans)
+
+  def AddEntries(self, scans) -> int:
+    """Inserts many entries in the database, in one transaction.
+
+    This is much faster than calling AddEntry() for every scan: tags are
+    resolved once, rows are inserted in chunks with a prepared statement, and
+    the aggregate tables are rebuilt once at the end instead of being updated
+    by the triggers for every row.
+
+    Args:
+      scans(iterable[dict]): the scans. Each of them has a 'timestamp'
+        (datetime or ISO string), and either a tag 'uid', or a 'character_name'
+        and an 'amount'. The 'pic' field is optional, and so is 'scans', the
+        number of scans a compacted entry stands for, which defaults to 1.
+    Returns:
+      int: the number of inserted entries.
+    Raises:
+      errors.BeerLogError: if a scan is invalid. No entry is inserted then.
+    """
+    tags = {}
+    count = 0
+    insert_sql = (
+      "INSERT INTO entry (character_id, amount, timestamp, pic, scans) VALUES (?, ?, ?, ?, ?)"
+    )
+    # Characters created during the import are gone if it's rolled back.
+    tag_characters = dict(self._tag_characters)
+    try:
+      with self.database.atomic():
+        last_id = self.Entry.select(peewee.fn.MAX(self.Entry.id)).scalar() or 0
+        for name in ENTRY_TRIGGERS:
+          self.database.execute_sql("DROP TRIGGER IF EXISTS {0:s}".format(name))
+        cursor = self.database.cursor()
+        chunk = []
+        for scan in scans:
+          try:
+            chunk.append(self._MakeEntryRow(scan, tags))
+          except (errors.BeerLogError, ValueError) as e:
+            raise errors.BeerLogError("Invalid scan #{0:d} {1!s}: {2!s}".format(count + 1, scan, e))
+          count += 1
+          if len(chunk) >= self.BULK_INSERT_CHUNK_SIZE:
+            cursor.executemany(insert_sql, chunk)
+            chunk = []
+        if chunk:
+          cursor.executemany(insert_sql, chunk)
+
+        if count and not self.Session.select().exists():
+          first = self.Entry.select(peewee.fn.MIN(self.Entry.timestamp)).where(
+            self.Entry.id > last_id
+          )
+          self.Session.create(started_at=first.scalar())
+        # Attribute the new entries to their keg, like the entry_keg_insert trigger
+        # does, to their session, like _GetSessionIdAt() does, and to their day.
+        keg = (
+          self.Keg.select(self.Keg.id)
+          .where(self.Keg.tapped_at <= self.Entry.timestamp)
+          .order_by(self.Keg.tapped_at.desc(), self.Keg.id.desc())
+          .limit(1)
+        )
+        session = (
+          self.Session.select(self.Session.id)
+          .where(self.Session.started_at <= self.Entry.timestamp)
+          .order_by(self.Session.started_at.desc(), self.Session.id.desc())
+          .limit(1)
+        )
+        first_session = (
+          self.Session.select(self.Session.id)
+          .order_by(self.Session.started_at.asc(), self.Session.id.asc())
+          .limit(1)
+        )
+        self.Entry.update(
+          keg=keg,
+          session=peewee.fn.COALESCE(session, first_session),
+          drinking_day=peewee.fn.date(self.Entry.timestamp, self._GetCutoffModifier()),
+        ).where(self.Entry.id > last_id).execute()
+
+        self.RebuildCharacterTotals()
+        self.RebuildKegConsumption()
+        self._CreateTriggers()
+    except Exception:
+      self._tag_characters = tag_characters
+      raise
+    self.cache.Invalidate()
+    return count
+
   def GetAllData(self):
     """Returns all the data in the database.
 
+    Use IterEntries() to go through all the entries without loading them all
+    in memory.
+
     Returns:
       list[Entry]: a list of all the Entry in the database.
     """
-    return list(Entry.select().order_by(Entry.timestamp.asc()).execute())
+    return list(self.Entry.select().order_by(self.Entry.timestamp.asc()).execute())
+
+  def _SelectEntryRows(self) -> peewee.Select:
+    """Returns a query for the columns of EntryRow."""
+    return (
+      self.Entry.select(
+        self.Entry.id,
+        self.Entry.timestamp,
+        self.Character.name,
+        self.Entry.amount,
+        self.Entry.scans,
+        self.Entry.pic,
+      )
+      .join(self.Character)
+      .tuples()
+    )
+
+  def GetAllEntryRows(self) -> list[EntryRow]:
+    """Returns all the data in the database, as rows.
+
+    This is the same as GetAllData(), without building the Entry models.
+
+    Returns:
+      list[EntryRow]: all the entries, in chronological order.
+    """
+    query = self._SelectEntryRows().order_by(self.Entry.timestamp.asc())
+    return list(map(EntryRow._make, query))
+
+  def IterEntries(self, chunk_size: int | None = None):
+    """Iterates over all the entries, in chronological order.
+
+    Entries are fetched in chunks, each with its own short query, so that
+    memory use doesn't depend on the size of the table, and writers aren't
+    kept waiting by a long read.
+
+    Args:
+      chunk_size(int): the number of entries per query. Defaults to
+        EXPORT_CHUNK_SIZE.
+    Yields:
+      tuple: the timestamp, character_name, amount, pic and scans of an entry.
+    """
+    chunk_size = chunk_size or self.EXPORT_CHUNK_SIZE
+    last = None
+    while True:
+      query = (
+        self.Entry.select(
+          self.Entry.id,
+          self.Entry.timestamp,
+          self.Character.name,
+          self.Entry.amount,
+          self.Entry.pic,
+          self.Entry.scans,
+        )
+        .join(self.Character)
+        .order_by(self.Entry.timestamp.asc(), self.Entry.id.asc())
+      )
+      if last:
+        query = query.where(peewee.Tuple(self.Entry.timestamp, self.Entry.id) > last)
+      rows = list(query.limit(chunk_size).tuples().iterator())
+      for row in rows:
+        yield row[1:]
+      if len(rows) < chunk_size:
+        return
+      last = (rows[-1][1], rows[-1][0])
+
+  def CompactEntries(self, older_than: datetime.datetime, chunk_size: int | None = None) -> int:
+    """Collapses old scans into one summary Entry per character and hour.
+
+    The summary rows keep the amount and number of scans they replace, so the
+    scoreboard, the totals and the kegs are unchanged. Only the time of each
+    scan is lost: a summary row has the timestamp, and pic, of the last scan it
+    replaces.
+
+    Whole hours are compacted, about chunk_size rows per transaction, so that
+    the kiosk can keep on recording scans in between.
+
+    Args:
+      older_than(datetime.datetime): scans made before the start of this hour
+        are compacted.
+      chunk_size(int): the approximate number of rows to process per
+        transaction. Defaults to COMPACT_CHUNK_SIZE.
+    Returns:
+      int: the number of removed Entry rows.
+    """
+    chunk_size = chunk_size or self.COMPACT_CHUNK_SIZE
+    end = _FloorHour(older_than)
+    removed = 0
+    start = (
+      self.Entry.select(peewee.fn.MIN(self.Entry.timestamp))
+      .where(self.Entry.timestamp < end)
+      .scalar()
+    )
+    while start is not None:
+      start = _FloorHour(self.Entry.timestamp.python_value(start))
+      chunk_end = (
+        self.Entry.select(self.Entry.timestamp)
+        .where(self.Entry.timestamp >= start)
+        .order_by(self.Entry.timestamp.asc())
+        .offset(chunk_size)
+        .limit(1)
+        .scalar()
+      )
+      if chunk_end is None:
+        chunk_end = end
+      else:
+        chunk_end = _FloorHour(self.Entry.timestamp.python_value(chunk_end))
+        chunk_end = min(end, max(chunk_end, start + datetime.timedelta(hours=1)))
+      removed += self._CompactHours(start, chunk_end)
+      start = (
+        self.Entry.select(peewee.fn.MIN(self.Entry.timestamp))
+        .where(self.Entry.timestamp >= chunk_end, self.Entry.timestamp < end)
+        .scalar()
+      )
+    self.cache.Invalidate()
+    return removed
+
+  def _CompactHours(self, start: datetime.datetime, end: datetime.datetime) -> int:
+    """Collapses the scans made between two hours, in one transaction.
+
+    Args:
+      start(datetime.datetime): the first hour to compact.
+      end(datetime.datetime): the hour after the last one to compact.
+    Returns:
+      int: the number of removed Entry rows.
+    """
+    hour = peewee.fn.strftime("%Y-%m-%d %H:00:00", self.Entry.timestamp)
+    with self.database.atomic():
+      # The totals don't change, so the triggers would only slow things down.
+      for name in ENTRY_TRIGGERS:
+        self.database.execute_sql("DROP TRIGGER IF EXISTS {0:s}".format(name))
+      last_id = self.Entry.select(peewee.fn.MAX(self.Entry.id)).scalar() or 0
+      # With a single MAX() aggregate, SQLite takes the pic from the last scan.
+      # All the scans of an hour have the same drinking day.
+      summaries = (
+        self.Entry.select(
+          self.Entry.session,
+          self.Entry.character,
+          self.Entry.keg,
+          peewee.fn.SUM(self.Entry.amount),
+          peewee.fn.SUM(self.Entry.scans),
+          peewee.fn.MAX(self.Entry.timestamp),
+          self.Entry.pic,
+          self.Entry.drinking_day,
+        )
+        .where(self.Entry.timestamp >= start, self.Entry.timestamp < end)
+        .group_by(self.Entry.session, self.Entry.character, self.Entry.keg, hour)
+        .having(peewee.fn.COUNT(self.Entry.id) > 1)
+      )
+      self.Entry.insert_from(
+        summaries,
+        [
+          self.Entry.session,
+          self.Entry.character,
+          self.Entry.keg,
+          self.Entry.amount,
+          self.Entry.scans,
+          self.Entry.timestamp,
+          self.Entry.pic,
+          self.Entry.drinking_day,
+        ],
+      ).execute()
+      # Rows before any keg have a NULL keg_id, which IN doesn't match.
+      group = peewee.Tuple(
+        self.Entry.session, self.Entry.character, peewee.fn.IFNULL(self.Entry.keg, 0), hour
+      )
+      summary = self.Entry.alias()
+      summary_groups = summary.select(
+        summary.session,
+        summary.character,
+        peewee.fn.IFNULL(summary.keg, 0),
+        peewee.fn.strftime("%Y-%m-%d %H:00:00", summary.timestamp),
+      ).where(summary.id > last_id)
+      removed = (
+        self.Entry.delete()
+        .where(
+          self.Entry.id <= last_id,
+          self.Entry.timestamp >= start,
+          self.Entry.timestamp < end,
+          group.in_(summary_groups),
+        )
+        .execute()
+      )
+      # Without the triggers, the removed rows are counted here.
+      if removed:
+        self.database.execute_sql(_COUNT_REWRITE_SQL)
+      # The first scans of the compacted hours are gone.
+      first = self.Entry.select(peewee.fn.MIN(self.Entry.timestamp)).where(
+        self.Entry.session == self.CharacterTotals.session,
+        self.Entry.character == self.CharacterTotals.character,
+      )
+      self.CharacterTotals.update(first=first).where(
+        self.CharacterTotals.first >= start, self.CharacterTotals.first < end
+      ).execute()
+      self._CreateTriggers()
+    return removed
+
+  @cache.Cached()
+  def GetAllCharacterNames(self, all_time: bool = False) -> list[str]:
+    """Gets all active characters.
+
+    Args:
+      all_time(bool): whether to consider all the sessions, or only the
+        current one.
+    Returns:
+      list[str]: the character names.
+    """
+    entries = self.Entry.select().where(self.Entry.character == self.Character.id)
+    session_id = self._GetScopeSessionId(all_time)
+    if session_id is not None:
+      entries = entries.where(self.Entry.session == session_id)
+    query = self.Character.select(self.Character.name).where(peewee.fn.EXISTS(entries))
+    return [name for (name,) in query.order_by(self.Character.id).tuples()]
 
-  def GetAllCharacterNames(self) -> list[str]:
-    """Gets all active characters."""
-    query = Entry.select(Entry.character_name).distinct()
-    return [entry.character_name for entry in query.execute()]
+  @cache.Cached()
+  def GetEntriesCount(self, all_time: bool = False):
+    """Returns the number of scans, including the ones in compacted entries.
 
-  def GetEntriesCount(self):
-    """Returns the number of entries."""
-    count = Entry.select().count()  # pylint: disable=no-value-for-parameter
+    Args:
+      all_time(bool): whether to count the scans of all the sessions, or only
+        the current one.
+    """
+    query = self.Entry.select(peewee.fn.SUM(self.Entry.scans))
+    session_id = self._GetScopeSessionId(all_time)
+    if session_id is not None:
+      query = query.where(self.Entry.session == session_id)
+    count = query.scalar() or 0  # pylint: disable=no-value-for-parameter
     return count
 
   def GetEntryById(self, entry_id):
@@ -127,7 +1394,12 @@ class BeerLogDB:
       Entry: the corresponding Entry, or None if it wasn't found.
     """
     try:
-      entry = Entry.get(Entry.id == entry_id)
+      entry = (
+        self.Entry.select(self.Entry, self.Character)
+        .join(self.Character)
+        .where(self.Entry.id == entry_id)
+        .get()
+      )
     except peewee.DoesNotExist as _:
       return None
     return entry
@@ -138,43 +1410,108 @@ class BeerLogDB:
     Returns:
       int: the total number of Entry lines in the database.
     """
-    return Entry.select().count(None)
+    return self.Entry.select().count(None)
 
-  def GetTotalDailyAverageConsumption(self):
+  def GetTotalDailyAverageConsumption(self, all_time: bool = False):
     """Returns the average consumption per day.
 
+    Args:
+      all_time(bool): whether to consider all the sessions, or only the
+        current one.
     Returns:
       float: the averageconsumption per day, in cL.
     """
-    total_cl = self.GetTotalAmount()
-    earliest_timestamp = self.GetEarliestTimestamp()
+    total_cl = self.GetTotalAmount(all_time=all_time)
+    earliest_timestamp = self.GetEarliestTimestamp(all_time=all_time)
     if not earliest_timestamp:
       return 0.0
-    days = (self.GetLatestTimestamp() - earliest_timestamp).total_seconds() / 86400.0
+    latest_timestamp = self.GetLatestTimestamp(all_time=all_time)
+    days = (latest_timestamp - earliest_timestamp).total_seconds() / 86400.0
     if days <= 2:
       raise errors.BeerLogError("Not enough data to compute a reliable daily average consumption")
     return total_cl / days
 
-  def GetScoreBoard(self):
-    """Returns a query with the scoreboard.
+  @cache.Cached()
+  def GetScoreBoard(self, all_time: bool = False):
+    """Returns the scoreboard.
 
+    Args:
+      all_time(bool): whether to sum up all the sessions, or only show the
+        current one.
     Returns:
-      peewee.ModelSelect: the query.
+      list[CharacterTotals]: the scoreboard rows, best drinker first.
     """
-    query = (
-      Entry.select(
-        Entry,
-        peewee.fn.SUM(Entry.amount).alias("total"),
-        peewee.fn.MAX(Entry.timestamp).alias("last"),
+    session_id = self._GetScopeSessionId(all_time)
+    if session_id is not None:
+      query = (
+        self.CharacterTotals.select(self.CharacterTotals, self.Character)
+        .join(self.Character)
+        .where(self.CharacterTotals.session == session_id)
+        .order_by(self.CharacterTotals.total.desc(), self.CharacterTotals.last.asc())
       )
-      .group_by(Entry.character_name)
-      .order_by(
-        peewee.SQL("total").desc(),
-        (peewee.fn.MAX(Entry.timestamp)).asc(),
+      return list(query)
+
+    latest = self.CharacterTotals.alias()
+    pic = (
+      latest.select(latest.pic)
+      .where(latest.character == self.CharacterTotals.character)
+      .order_by(latest.last.desc())
+      .limit(1)
+    )
+    total = peewee.fn.SUM(self.CharacterTotals.total)
+    last = peewee.fn.MAX(self.CharacterTotals.last)
+    query = (
+      self.CharacterTotals.select(
+        self.CharacterTotals.character,
+        total.alias("total"),
+        peewee.fn.SUM(self.CharacterTotals.scans).alias("scans"),
+        peewee.fn.MIN(self.CharacterTotals.first).alias("first"),
+        last.alias("last"),
+        pic.alias("pic"),
+        self.Character,
       )
+      .join(self.Character)
+      .group_by(self.CharacterTotals.character)
+      .order_by(total.desc(), last.asc())
     )
-    return query
+    return list(query)
 
+  @cache.Cached()
+  def GetScoreBoardRows(self, all_time: bool = False) -> list[ScoreBoardRow]:
+    """Returns the scoreboard, as rows.
+
+    This is the same as GetScoreBoard(), without building the CharacterTotals
+    and Character models.
+
+    Args:
+      all_time(bool): whether to sum up all the sessions, or only show the
+        current one.
+    Returns:
+      list[ScoreBoardRow]: the scoreboard rows, best drinker first.
+    """
+    total = self.CharacterTotals.total
+    scans = self.CharacterTotals.scans
+    last = self.CharacterTotals.last
+    session_id = self._GetScopeSessionId(all_time)
+    if session_id is None:
+      total = peewee.fn.SUM(total)
+      scans = peewee.fn.SUM(scans)
+      last = peewee.fn.MAX(last)
+    query = (
+      self.CharacterTotals.select(self.Character.name, total, scans, last)
+      .join(self.Character)
+      .order_by(total.desc(), last.asc())
+    )
+    if session_id is None:
+      query = query.group_by(self.CharacterTotals.character)
+    else:
+      query = query.where(self.CharacterTotals.session == session_id)
+    return [
+      ScoreBoardRow(name, total, scans, self.CharacterTotals.last.python_value(last))
+      for name, total, scans, last in query.tuples()
+    ]
+
+  @cache.Cached()
   def GetGlassFromName(self, name):
     """Returns the corresponding glass from a uid
 
@@ -185,15 +1522,68 @@ class BeerLogDB:
     """
 
     entry = (
-      Entry.select(Entry.amount)
-      .where(Entry.character_name == name)
-      .order_by(Entry.timestamp.desc())
+      self.Entry.select(self.Entry.amount)
+      .join(self.Character)
+      .where(self.Character.name == name)
+      .order_by(self.Entry.timestamp.desc())
       .first()
     )
     if not entry:
       return constants.DEFAULT_GLASS_SIZE
     return entry.amount
 
+  def GetCumulativeTotals(self) -> dict[str, CumulativeTotals]:
+    """Returns the prefix sums of the scans of every character.
+
+    These are kept in memory, and only the new entries are read from the
+    database. The lists shouldn't be modified.
+
+    Returns:
+      dict[str, CumulativeTotals]: the prefix sums, per character name.
+    """
+    return self._cumulative_totals.GetCumulativeTotals()
+
+  def GetCumulativeTotalsFromName(self, name: str) -> CumulativeTotals:
+    """Returns the prefix sums of the scans of a character.
+
+    Args:
+      name(str): the name of the character.
+    Returns:
+      CumulativeTotals: the prefix sums, which are empty if the character never
+        scanned anything.
+    """
+    return self.GetCumulativeTotals().get(name, CumulativeTotals([], [], []))
+
+  def GetScoreBoardAt(
+    self, timestamp: datetime.datetime, since: datetime.datetime | None = None
+  ) -> list[ScoreBoardRow]:
+    """Returns the scoreboard as it was at some point in time.
+
+    Args:
+      timestamp(datetime): the point in time. Scans made at this exact time
+        are counted.
+      since(datetime): the optional start of the scoreboard, ie: the first scan
+        of the night. Scans made before it aren't counted. Defaults to counting
+        every scan.
+    Returns:
+      list[ScoreBoardRow]: the scoreboard rows, best drinker first.
+    """
+    rows = []
+    for name, cumulative in self.GetCumulativeTotals().items():
+      index = bisect.bisect_right(cumulative.timestamps, timestamp)
+      start = bisect.bisect_left(cumulative.timestamps, since) if since else 0
+      if index > start:
+        rows.append(
+          ScoreBoardRow(
+            name,
+            cumulative.totals[index - 1] - (cumulative.totals[start - 1] if start else 0),
+            cumulative.scans[index - 1] - (cumulative.scans[start - 1] if start else 0),
+            cumulative.timestamps[index - 1],
+          )
+        )
+    rows.sort(key=lambda row: (-row.total, row.last))
+    return rows
+
   def GetGlassFromHexID(self, uid):
     """Returns the corresponding glass from a uid
 
@@ -208,7 +1598,8 @@ class BeerLogDB:
     if not tag_object:
       raise errors.BeerLogError("Unknown character for tag {0:s}".format(uid))
 
-    return tag_object.get("glass", constants.DEFAULT_GLASS_SIZE)
+    # known_tags.json can have the glass size as a string.
+    return int(tag_object.get("glass", constants.DEFAULT_GLASS_SIZE))
 
   def LoadTagsDB(self, known_tags_path):
     """Loads the external known tags list.
@@ -230,7 +1621,6 @@ class BeerLogDB:
 
   def GetNameFromHexID(self, uid):
     """Returns the corresponding name from a uid
-    Entry.where()
 
     Args:
       uid(str): the uid in form 0x0580000000050002
@@ -244,11 +1634,21 @@ class BeerLogDB:
       raise errors.BeerLogError("Unknown character for tag {0:s}".format(uid))
     return tag_object.get("realname") or tag_object.get("name")
 
-  def GetEarliestTimestamp(self):
-    """Returns the earliest timestamp."""
-    query = Entry.select(peewee.fn.MIN(Entry.timestamp))
+  @cache.Cached()
+  def GetEarliestTimestamp(self, all_time: bool = False):
+    """Returns the earliest timestamp.
+
+    Args:
+      all_time(bool): whether to consider all the sessions, or only the
+        current one.
+    """
+    query = self.Entry.select(peewee.fn.MIN(self.Entry.timestamp))
+    session_id = self._GetScopeSessionId(all_time)
+    if session_id is not None:
+      query = query.where(self.Entry.session == session_id)
     return query.scalar()  # pylint: disable=no-value-for-parameter
 
+  @cache.Cached()
   def GetEarliestEntry(self, after: datetime.datetime | None = None) -> Entry | None:
     """Returns the earliest Entry.
 
@@ -258,23 +1658,10 @@ class BeerLogDB:
     Returns:
       Entry: the first entry.
     """
+    query = self.Entry.select(self.Entry, self.Character).join(self.Character)
     if after:
-      query = (
-        Entry.select(Entry)
-        .where(Entry.timestamp >= after)
-        .group_by(Entry.timestamp)
-        .order_by(Entry.timestamp.asc())
-      )
-    else:
-      query = (
-        Entry.select(Entry)
-        .group_by(Entry.timestamp)
-        .having(Entry.timestamp == peewee.fn.MIN(Entry.timestamp))
-      )
-    try:
-      return query.get()
-    except Exception:  # pylint: disable=broad-except
-      return None
+      query = query.where(self.Entry.timestamp >= after)
+    return query.order_by(self.Entry.timestamp.asc(), self.Entry.id.asc()).first()
 
   def GetLatestEntry(self, before: datetime.datetime | None = None) -> Entry | None:
     """Returns the latest Entry.
@@ -283,31 +1670,34 @@ class BeerLogDB:
       before(datetime.datetime): an optional timestamp from which to start
         searching.
     Returns:
-      Entry: the first entry.
+      Entry: the last entry.
     """
+    query = self.Entry.select(self.Entry, self.Character).join(self.Character)
     if before:
-      query = (
-        Entry.select(Entry)
-        .where(Entry.timestamp <= before)
-        .group_by(Entry.timestamp)
-        .order_by(Entry.timestamp.desc())
-      )
-    else:
-      query = (
-        Entry.select(Entry)
-        .group_by(Entry.timestamp)
-        .having(Entry.timestamp == peewee.fn.MAX(Entry.timestamp))
-      )
-    try:
-      return query.get()
-    except Exception:  # pylint: disable=broad-except
-      return None
+      query = query.where(self.Entry.timestamp <= before)
+    return query.order_by(self.Entry.timestamp.desc(), self.Entry.id.desc()).first()
+
+  @cache.Cached()
+  def GetLatestTimestamp(self, name=None, all_time: bool = False):
+    """Returns the timestamp of the last scan.
 
-  def GetLatestTimestamp(self, name=None):
-    """Returns the timestamp of the last scan."""
-    query = Entry.select(peewee.fn.MAX(Entry.timestamp))
+    Args:
+      name(str): the optional name of a character.
+      all_time(bool): whether to consider all the sessions, or only the
+        current one.
+    """
+    session_id = self._GetScopeSessionId(all_time)
     if name:
-      query = query.where(Entry.character_name == name)
+      query = self.CharacterTotals.select(peewee.fn.MAX(self.CharacterTotals.last)).join(
+        self.Character
+      )
+      query = query.where(self.Character.name == name)
+      if session_id is not None:
+        query = query.where(self.CharacterTotals.session == session_id)
+      return self.CharacterTotals.last.python_value(query.scalar())
+    query = self.Entry.select(peewee.fn.MAX(self.Entry.timestamp))
+    if session_id is not None:
+      query = query.where(self.Entry.session == session_id)
     return query.scalar()  # pylint: disable=no-value-for-parameter
 
   def GetAmountFromHexID(self, hexid, at=None):
@@ -322,41 +1712,55 @@ class BeerLogDB:
     character_name = self.GetNameFromHexID(hexid)
     return self.GetAmountFromName(character_name, at=at)
 
-  def GetAmountFromName(self, name, at=None):
+  @cache.Cached()
+  def GetAmountFromName(self, name, at=None, all_time: bool = False):
     """Returns the amount of beer drunk for a character.
 
     Args:
       name(str): the name of a character.
       at(datetime.datetime): optional maximum date to count scans.
+      all_time(bool): whether to count the scans of all the sessions, or only
+        the current one.
     Returns:
       int: the amount of beer.
     """
-    amount_cl = 0
-    if at:
-      query = Entry.select(peewee.fn.SUM(Entry.amount)).where(
-        Entry.character_name == name, Entry.timestamp <= at
+    session_id = self._GetScopeSessionId(all_time)
+    if not at:
+      query = self.CharacterTotals.select(peewee.fn.SUM(self.CharacterTotals.total)).join(
+        self.Character
       )
-    else:
-      query = Entry.select(peewee.fn.SUM(Entry.amount)).where(Entry.character_name == name)
-    amount = query.scalar()
-    if amount:
-      amount_cl = amount
-    return amount_cl
+      query = query.where(self.Character.name == name)
+      if session_id is not None:
+        query = query.where(self.CharacterTotals.session == session_id)
+      return query.scalar() or 0
+    query = (
+      self.Entry.select(peewee.fn.SUM(self.Entry.amount))
+      .join(self.Character)
+      .where(self.Character.name == name, self.Entry.timestamp <= at)
+    )
+    if session_id is not None:
+      query = query.where(self.Entry.session == session_id)
+    return query.scalar() or 0
 
-  def GetTotalAmount(self, since=None):
+  @cache.Cached(ttl=TIME_RELATIVE_TTL)
+  def GetTotalAmount(self, since=None, all_time: bool = False):
     """Returns the total of beer drunk, in cL.
 
     Args:
       since(datetime.datetime): since when.
+      all_time(bool): whether to count the scans of all the sessions, or only
+        the current one.
 
     Returns:
       int: the total amount, in cL.
 
     """
+    query = self.Entry.select(peewee.fn.SUM(self.Entry.amount))
     if since:
-      query = Entry.select(peewee.fn.SUM(Entry.amount)).where(Entry.timestamp >= since)
-    else:
-      query = Entry.select(peewee.fn.SUM(Entry.amount))
+      query = query.where(self.Entry.timestamp >= since)
+    session_id = self._GetScopeSessionId(all_time)
+    if session_id is not None:
+      query = query.where(self.Entry.session == session_id)
     return query.scalar() or 0  # pylint: disable=no-value-for-parameter
 
   def GetDataFromName(self, name):
@@ -373,59 +1777,372 @@ class BeerLogDB:
     Returns:
       peewee.ModelSelect: the query.
     """
-    query = Entry.select(
-      Entry.timestamp, peewee.fn.SUM(Entry.amount).over(order_by=[Entry.timestamp]).alias("sum")
-    ).where(Entry.character_name == name)
+    query = (
+      self.Entry.select(
+        self.Entry.timestamp,
+        peewee.fn.SUM(self.Entry.amount).over(order_by=[self.Entry.timestamp]).alias("sum"),
+      )
+      .join(self.Character)
+      .where(self.Character.name == name)
+    )
     return query.execute()
 
-  def GetAverageTotalHourlyConsumption(self):
-    """Returns the average total hourly consumption.
+  def GetDataRowsFromName(self, name: str) -> list[AmountPoint]:
+    """Returns the accumulated amount for a character name, as rows.
+
+    This is the same as GetDataFromName(), without building the Entry models.
 
+    Args:
+      name(str): the name to search for.
     Returns:
-      list[dict]: a list of dict with keys "time" and "average_consumed_l".
+      list[AmountPoint]: the total after each scan, in chronological order.
     """
-    first_scan = self.GetEarliestTimestamp()
-    first_day = first_scan.replace(hour=0, minute=0, second=0, microsecond=0)
-    last_scan = self.GetLatestTimestamp()
-    days = (last_scan.date() - first_scan.date()).days + 1
-    averages = []
-    for day in range(days):
-      first_scan_day = self.GetEarliestEntry(
-        after=first_day + datetime.timedelta(days=day) + datetime.timedelta(hours=self.cutoff_hour)
+    query = (
+      self.Entry.select(
+        self.Entry.timestamp,
+        peewee.fn.SUM(self.Entry.amount).over(order_by=[self.Entry.timestamp]),
       )
-      if first_scan_day is None:
-        continue
-      first_scan_day = first_scan_day.timestamp
-      last_scan_day = self.GetLatestEntry(
-        before=first_day
-        + datetime.timedelta(days=day + 1)
-        + datetime.timedelta(hours=self.cutoff_hour)
+      .join(self.Character)
+      .where(self.Character.name == name)
+      .order_by(self.Entry.timestamp.asc())
+      .tuples()
+    )
+    return list(map(AmountPoint._make, query))
+
+  def TapKeg(
+    self,
+    size_cl: int,
+    loss_percent: float | None = None,
+    tapped_at: datetime.datetime | None = None,
+  ) -> Keg:
+    """Records that a new keg was tapped.
+
+    Scans made after tapped_at, until the next keg was tapped, are attributed
+    to the new keg.
+
+    Args:
+      size_cl(int): the size of the keg, in cL.
+      loss_percent(float): the expected losses, in percent. Defaults to
+        pertes_percent.
+      tapped_at(datetime.datetime): when the keg was tapped. Defaults to now.
+    Returns:
+      Keg: the new keg.
+    Raises:
+      errors.BeerLogError: if the size is invalid.
+    """
+    if size_cl <= 0:
+      raise errors.BeerLogError("Invalid keg size: {0!s} cL".format(size_cl))
+    if loss_percent is None:
+      loss_percent = self.pertes_percent
+    tapped_at = tapped_at or datetime.datetime.now()
+    with self.database.atomic():
+      keg = self.Keg.create(size_cl=size_cl, loss_percent=loss_percent, tapped_at=tapped_at)
+      next_keg = (
+        self.Keg.select()
+        .where(self.Keg.tapped_at > tapped_at)
+        .order_by(self.Keg.tapped_at.asc(), self.Keg.id.asc())
+        .first()
+      )
+      query = self.Entry.update(keg=keg).where(self.Entry.timestamp >= tapped_at)
+      if next_keg:
+        query = query.where(self.Entry.timestamp < next_keg.tapped_at)
+      query.execute()
+    self.cache.Invalidate()
+    return keg
+
+  @cache.Cached()
+  def GetActiveKeg(self) -> Keg | None:
+    """Returns the keg that was tapped last, or None."""
+    return self.Keg.select().order_by(self.Keg.tapped_at.desc(), self.Keg.id.desc()).first()
+
+  def GetKegs(self) -> list[Keg]:
+    """Returns all the kegs, the most recently tapped first."""
+    return list(self.Keg.select().order_by(self.Keg.tapped_at.desc(), self.Keg.id.desc()))
+
+  def _GetSessionIdAt(self, timestamp: datetime.datetime) -> int:
+    """Returns the id of the session a scan belongs to, creating the first one if needed.
+
+    Args:
+      timestamp(datetime.datetime): the time of the scan.
+    Returns:
+      int: the session id.
+    """
+    session = (
+      self.Session.select(self.Session.id)
+      .where(self.Session.started_at <= timestamp)
+      .order_by(self.Session.started_at.desc(), self.Session.id.desc())
+      .first()
+    )
+    if not session:
+      session = (
+        self.Session.select(self.Session.id)
+        .order_by(self.Session.started_at.asc(), self.Session.id.asc())
+        .first()
+      )
+    if not session:
+      session = self.Session.create(started_at=timestamp)
+    return session.id
+
+  def StartSession(
+    self, name: str | None = None, started_at: datetime.datetime | None = None
+  ) -> Session:
+    """Starts a new session.
+
+    Scans made after started_at, until the next session started, are moved to
+    the new session.
+
+    Args:
+      name(str): the optional name of the session.
+      started_at(datetime.datetime): when the session started. Defaults to now.
+    Returns:
+      Session: the new session.
+    """
+    started_at = started_at or datetime.datetime.now()
+    with self.database.atomic():
+      is_first = not self.Session.select().where(self.Session.started_at <= started_at).exists()
+      session = self.Session.create(name=name, started_at=started_at)
+      next_session = (
+        self.Session.select()
+        .where(self.Session.started_at > started_at)
+        .order_by(self.Session.started_at.asc(), self.Session.id.asc())
+        .first()
+      )
+      query = self.Entry.update(session=session)
+      if not is_first:
+        query = query.where(self.Entry.timestamp >= started_at)
+      if next_session:
+        query = query.where(self.Entry.timestamp < next_session.started_at)
+      query.execute()
+    self.cache.Invalidate()
+    return session
+
+  @cache.Cached()
+  def GetCurrentSession(self) -> Session | None:
+    """Returns the session that was started last, or None."""
+    return (
+      self.Session.select().order_by(self.Session.started_at.desc(), self.Session.id.desc()).first()
+    )
+
+  def GetSessions(self) -> list[Session]:
+    """Returns all the sessions, the most recently started first."""
+    return list(
+      self.Session.select().order_by(self.Session.started_at.desc(), self.Session.id.desc())
+    )
+
+  def _GetScopeSessionId(self, all_time: bool) -> int | None:
+    """Returns the id of the session to restrict queries to.
+
+    Args:
+      all_time(bool): whether to query all the sessions.
+    Returns:
+      int: the id of the current session, or None to query all the sessions.
+    """
+    if all_time:
+      return None
+    session = self.GetCurrentSession()
+    return session.id if session else None
+
+  def GetDrinkingDays(
+    self,
+    start: datetime.date | None = None,
+    end: datetime.datetime | None = None,
+    session_id: int | None = None,
+  ) -> list[DrinkingDay]:
+    """Returns statistics for each drinking day, in one query.
+
+    A drinking day starts at cutoff_hour, and ends at cutoff_hour the next day
+    (both included): a scan made exactly at cutoff_hour counts in both days.
+    Days without any scan are skipped.
+
+    Args:
+      start(datetime.date): the optional first day to consider. Defaults to the
+        day of the first scan.
+      end(datetime.datetime): the optional time after which to ignore scans.
+        Defaults to the last scan.
+      session_id(int): the optional id of the session to only count the scans
+        of. A session can start in the middle of a drinking day.
+    Returns:
+      list[DrinkingDay]: the days, in chronological order.
+    """
+    conditions = []
+    params = []
+    if session_id is not None:
+      conditions.append("session_id = ?")
+      params.append(session_id)
+    if start:
+      conditions.append("drinking_day >= ?")
+      params.append(start.isoformat())
+    if end:
+      conditions.append("drinking_day <= ? AND timestamp <= ?")
+      params.extend([self.GetDrinkingDay(end).isoformat(), str(end)])
+    params.append("+1 day")
+    params.append("+{0:d} hours".format(self.cutoff_hour))
+    boundary_conditions = []
+    if end:
+      boundary_conditions.append("AND boundary.timestamp <= ?")
+      params.append(str(end))
+    if session_id is not None:
+      boundary_conditions.append("AND boundary.session_id = ?")
+      params.append(session_id)
+    # The days are read from the drinking_day index, then the scans made at the
+    # end of each day are looked up in the timestamp index.
+    cursor = self.database.execute_sql(
+      """
+      SELECT days.day, days.first, MAX(days.last, IFNULL(MAX(boundary.timestamp), days.last)),
+        days.total_cl + IFNULL(SUM(boundary.amount), 0),
+        days.scans + IFNULL(SUM(boundary.scans), 0)
+      FROM (
+        SELECT drinking_day AS day, MIN(timestamp) AS first, MAX(timestamp) AS last,
+          SUM(amount) AS total_cl, SUM(scans) AS scans
+        FROM entry {0:s}
+        GROUP BY drinking_day
+      ) AS days
+      LEFT JOIN entry AS boundary
+        ON boundary.timestamp = datetime(days.day, ?, ?) {1:s}
+      GROUP BY days.day
+      ORDER BY days.day
+      """.format(
+        "WHERE " + " AND ".join(conditions) if conditions else "", " ".join(boundary_conditions)
+      ),
+      params,
+    )
+    drinking_days = []
+    for day, first, last, total_cl, scans in cursor.fetchall():
+      first = self.Entry.timestamp.python_value(first)
+      last = self.Entry.timestamp.python_value(last)
+      drinking_days.append(
+        DrinkingDay(
+          day=datetime.date.fromisoformat(day),
+          first=first,
+          last=last,
+          total_cl=total_cl,
+          scans=scans,
+          active_hours=(last - first).total_seconds() / 3600,
+        )
       )
-      if last_scan_day is None:
-        continue
-      last_scan_day = last_scan_day.timestamp
-      amount = 0
-      for entry in self.GetEntriesInWindow(start=first_scan_day, end=last_scan_day).execute():  # pyright: ignore[reportArgumentType]
-        amount += entry.amount
-      drinking_hours = (last_scan_day - first_scan_day).total_seconds() / 3600
-      if drinking_hours <= 0:
-        continue
-      averages.append(amount / drinking_hours)
+    return drinking_days
 
+  @cache.Cached()
+  def GetDayTotals(
+    self, first_day: datetime.date | None = None, last_day: datetime.date | None = None
+  ) -> dict[datetime.date, int]:
+    """Returns the amount drunk during each drinking day.
+
+    Unlike GetDrinkingDays(), every scan counts in a single day: the one from
+    its drinking_day column.
+
+    Args:
+      first_day(datetime.date): the optional first day to consider.
+      last_day(datetime.date): the optional last day to consider.
+    Returns:
+      dict[datetime.date, int]: the amount drunk, in cL, for each day with
+        scans, in chronological order.
+    """
+    query = (
+      self.Entry.select(self.Entry.drinking_day, peewee.fn.SUM(self.Entry.amount))
+      .group_by(self.Entry.drinking_day)
+      .order_by(self.Entry.drinking_day)
+    )
+    if first_day:
+      query = query.where(self.Entry.drinking_day >= first_day)
+    if last_day:
+      query = query.where(self.Entry.drinking_day <= last_day)
+    return dict(query.tuples())
+
+  def GetEntriesForDay(self, day: datetime.date) -> peewee.Select:
+    """Returns the entries of a drinking day.
+
+    Args:
+      day(datetime.date): the drinking day.
+    Returns:
+      peewee.Select: the entries, in chronological order.
+    """
+    return (
+      self.Entry.select(self.Entry, self.Character)
+      .join(self.Character)
+      .where(self.Entry.drinking_day == day)
+      .order_by(self.Entry.timestamp.asc(), self.Entry.id.asc())
+    )
+
+  @cache.Cached(ttl=TIME_RELATIVE_TTL)
+  def GetTonightScoreBoard(self, now: datetime.datetime | None = None) -> list[ScoreBoardRow]:
+    """Returns the scoreboard of the current drinking day.
+
+    Args:
+      now(datetime.datetime): the optional current time. Defaults to now.
+    Returns:
+      list[ScoreBoardRow]: the scoreboard rows, best drinker first.
+    """
+    day = self.GetDrinkingDay(now or datetime.datetime.now())
+    total = peewee.fn.SUM(self.Entry.amount)
+    last = peewee.fn.MAX(self.Entry.timestamp)
+    query = (
+      self.Entry.select(self.Character.name, total, peewee.fn.SUM(self.Entry.scans), last)
+      .join(self.Character)
+      .where(self.Entry.drinking_day == day)
+      .group_by(self.Entry.character)
+      .order_by(total.desc(), last.asc())
+    )
+    return [
+      ScoreBoardRow(name, total, scans, self.Entry.timestamp.python_value(last))
+      for name, total, scans, last in query.tuples()
+    ]
+
+  def GetAverageTotalHourlyConsumption(self, all_time: bool = False):
+    """Returns the average total hourly consumption.
+
+    This is the average, over all the drinking days, of the amount drunk
+    divided by the time between the first and last scan of the day.
+
+    Args:
+      all_time(bool): whether to consider the scans of all the sessions, or
+        only the ones of the current session.
+    Returns:
+      float: the average consumption, in cL per hour.
+    """
+    session_id = self._GetScopeSessionId(all_time)
+    averages = [
+      day.total_cl / day.active_hours
+      for day in self.GetDrinkingDays(session_id=session_id)
+      if day.active_hours > 0
+    ]
     return round(sum(averages) / len(averages), 2) if averages else 0.0
 
-  def MakeKegPrediction(self, keg_size_cl, now: datetime.datetime | None = None):
-    if keg_size_cl <= 100 and now is not None:
+  def MakeKegPrediction(
+    self, keg_size_cl=None, now: datetime.datetime | None = None, all_time: bool = False
+  ):
+    """Predicts when the current keg will be empty.
+
+    Args:
+      keg_size_cl(float): the size of the kegs, in cL. If None, uses the volume
+        left in the active Keg. Otherwise, assumes all the kegs had this size.
+      now(datetime.datetime): the time of the prediction. Defaults to now.
+      all_time(bool): whether to base the averages on all the sessions, or
+        only on the current one.
+    Returns:
+      dict: the prediction.
+    Raises:
+      errors.BeerLogError: if we can't make a prediction.
+    """
+    keg = None
+    if keg_size_cl is None:
+      keg = self.GetActiveKeg()
+      if not keg:
+        raise errors.BeerLogError("No keg was tapped, please provide a keg size.")
+      keg_size_cl = keg.size_cl
+    elif keg_size_cl <= 100 and now is not None:
       raise errors.BeerLogError(
         f"A keg size of {keg_size_cl} cL is too small for a prediction. Please provide a valid keg size in cL."
       )
     now = datetime.datetime.now() if now is None else now
-    today_start = now.replace(hour=self.cutoff_hour, minute=0, second=0, microsecond=0)
+    today = self.GetDrinkingDay(now)
+    today_start = datetime.datetime.combine(today, datetime.time(self.cutoff_hour))
     elapsed_seconds = max(1, (now - today_start).total_seconds())
 
-    total_today_cl = 0
-    for entry in self.GetEntriesInWindow(start=today_start, end=now).execute():
-      total_today_cl += entry.amount
+    session_id = self._GetScopeSessionId(all_time)
+    total_today_cl = sum(
+      day.total_cl for day in self.GetDrinkingDays(start=today, end=now, session_id=session_id)
+    )
 
     if total_today_cl == 0:
       raise errors.BeerLogError(
@@ -433,14 +2150,20 @@ class BeerLogDB:
           today_start, now
         )
       )
-    total_cl = self.GetTotalAmount() * (1 + self.pertes_percent / 100)
-    first_scan = self.GetEarliestTimestamp()
+    pertes_percent = keg.loss_percent if keg else self.pertes_percent
+    total_cl = self.GetTotalAmount(all_time=all_time) * (1 + pertes_percent / 100)
+    first_scan = self.GetEarliestTimestamp(all_time=all_time) or now
     days_of_data = max(1, (now.date() - first_scan.date()).days + 1)
     avg_daily_cl = total_cl / days_of_data
 
-    average_hourly_cl = self.GetAverageTotalHourlyConsumption()
+    average_hourly_cl = self.GetAverageTotalHourlyConsumption(all_time=all_time)
 
-    amount_left_cl = keg_size_cl - (total_cl % keg_size_cl)
+    if keg:
+      total_cl = keg.consumed_cl * (1 + pertes_percent / 100)
+      amount_left_cl = keg.GetRemaining()
+    else:
+      # Without a Keg, assume all kegs had the same size.
+      amount_left_cl = keg_size_cl - (total_cl % keg_size_cl)
 
     if average_hourly_cl <= 0:
       empty_time = None
@@ -458,7 +2181,7 @@ class BeerLogDB:
       should_open_new_keg = True
 
     return {
-      "pertes_percent": self.pertes_percent,
+      "pertes_percent": pertes_percent,
       "keg_size_cl": keg_size_cl,
       "current_time": now.isoformat(),
       "today_consumed_cl": total_today_cl,
@@ -479,8 +2202,33 @@ class BeerLogDB:
       start(datetime): the start of the time window.
       end(datetime): the end of the time window.
     """
-    query = Entry.select(Entry).where(Entry.timestamp >= start, Entry.timestamp <= end)
+    query = (
+      self.Entry.select(self.Entry, self.Character)
+      .join(self.Character)
+      .where(self.Entry.timestamp >= start, self.Entry.timestamp <= end)
+    )
     return query
 
+  def GetEntryRowsInWindow(
+    self, start: datetime.datetime, end: datetime.datetime
+  ) -> list[EntryRow]:
+    """Returns the entries scanned in a specific time window, as rows.
+
+    This is the same as GetEntriesInWindow(), without building the Entry and
+    Character models.
+
+    Args:
+      start(datetime): the start of the time window.
+      end(datetime): the end of the time window.
+    Returns:
+      list[EntryRow]: the entries, in chronological order.
+    """
+    query = (
+      self._SelectEntryRows()
+      .where(self.Entry.timestamp >= start, self.Entry.timestamp <= end)
+      .order_by(self.Entry.timestamp.asc(), self.Entry.id.asc())
+    )
+    return list(map(EntryRow._make, query))
+
 
 # vim: tabstop=2 shiftwidth=2 expandtab
@@ -3,13 +3,17 @@
 from __future__ import unicode_literals
 
 import datetime
+import io
 import json
 import os
 import tempfile
 import unittest
 
+import peewee
+
 from beerlog import beerlogdb
 from beerlog import errors
+from beerlog import serialization
 
 # pylint: disable=protected-access
 
@@ -39,6 +43,109 @@ class BeerLogDBTests(unittest.TestCase):
     self.db.AddEntry("0x0")
     self.assertEqual(self.db.CountAll(), 2)
 
+  def testMigrateLegacyDatabase(self):
+    """Tests that opening a database without indexes upgrades its schema."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+      db_path = os.path.join(temp_dir, "legacy.sqlite")
+      legacy_db = peewee.SqliteDatabase(db_path)
+      legacy_db.execute_sql(
+        "CREATE TABLE entry (id INTEGER PRIMARY KEY, character_name VARCHAR(255) NOT NULL, "
+        "amount INTEGER NOT NULL, timestamp DATETIME NOT NULL, pic VARCHAR(255))"
+      )
+      legacy_db.execute_sql(
+        "INSERT INTO entry (character_name, amount, timestamp) VALUES "
+        "('toto', 33, '2019-01-01 14:00:00'), ('tutu', 50, '2019-01-01 15:00:00'), "
+        "('Toto', 45, '2019-01-01 16:00:00')"
+      )
+      legacy_db.close()
+
+      db = beerlogdb.BeerLogDB(db_path)
+      self.assertEqual(beerlogdb.SCHEMA_VERSION, db.GetSchemaVersion())
+      index_names = [index.name for index in db.database.get_indexes("entry")]
+      self.assertIn("entry_timestamp", index_names)
+      self.assertIn("entry_character_id_timestamp", index_names)
+      # Names differing by their case are merged, and the latest one is kept.
+      self.assertEqual(["Toto", "tutu"], db.GetAllCharacterNames())
+      self.assertEqual(33 + 45, db.GetAmountFromName("toto"))
+      self.assertEqual(
+        [("Toto", 78, 2), ("tutu", 50, 1)],
+        [(t.character_name, t.total, t.scans) for t in db.GetScoreBoard()],
+      )
+      # Legacy scans all go to a first session.
+      self.assertEqual(
+        [datetime.datetime(2019, 1, 1, 14, 0)], [s.started_at for s in db.GetSessions()]
+      )
+      self.assertEqual(3, db.GetEntriesCount())
+      self.assertEqual({datetime.date(2019, 1, 1): 33 + 50 + 45}, db.GetDayTotals())
+      db.known_tags_list = self.db.known_tags_list
+      db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 17, 0))
+      self.assertEqual(33 + 45 + 33, db.GetAmountFromName("toto"))
+
+      # The migrated schema is the same as a new one.
+      def GetSchema(database):
+        return {
+          table: (
+            [(c.name, c.data_type, c.null, c.primary_key) for c in database.get_columns(table)],
+            sorted((i.name, tuple(i.columns), i.unique) for i in database.get_indexes(table)),
+            sorted((f.column, f.dest_table) for f in database.get_foreign_keys(table)),
+          )
+          for table in database.get_tables()
+        }
+
+      migrated_schema = GetSchema(db.database)
+      self.assertNotIn("hourlytotals", migrated_schema)
+      self.assertEqual(GetSchema(beerlogdb.BeerLogDB(":memory:").database), migrated_schema)
+
+      # Re-opening an up-to-date database is a no-op.
+      db = beerlogdb.BeerLogDB(db_path)
+      self.assertEqual(beerlogdb.SCHEMA_VERSION, db.GetSchemaVersion())
+      db.Close()
+
+  def testConnectionModes(self):
+    """Tests the WAL writer connection, and the read-only connections."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+      db_path = os.path.join(temp_dir, "beerlog.sqlite")
+
+      with self.assertRaises(errors.BeerLogError):
+        beerlogdb.BeerLogDB(":memory:", read_only=True)
+
+      pragmas = beerlogdb.MakePragmas(synchronous="full", cache_size=-1000)
+      db = beerlogdb.BeerLogDB(db_path, pragmas=pragmas)
+      db.known_tags_list = self.db.known_tags_list
+      db.AddEntry("0x0", "pic1", time=datetime.datetime(2019, 1, 1, 14, 0, 0))
+      connection = db.database
+      self.assertEqual("wal", connection.execute_sql("PRAGMA journal_mode").fetchone()[0])
+      self.assertEqual(2, connection.execute_sql("PRAGMA synchronous").fetchone()[0])
+      self.assertEqual(-1000, connection.execute_sql("PRAGMA cache_size").fetchone()[0])
+      # Re-connecting keeps the existing connection.
+      db.Connect()
+      db.Close()
+
+      db = beerlogdb.BeerLogDB(db_path, read_only=True)
+      db.known_tags_list = self.db.known_tags_list
+      self.assertEqual(1, db.GetEntriesCount())
+      with self.assertRaises(peewee.OperationalError):
+        db.AddEntry("0x0", "pic1", time=datetime.datetime(2019, 1, 1, 15, 0, 0))
+      db.Close()
+
+  def testSeveralDatabases(self):
+    """Tests that databases open at the same time don't share their data."""
+    other_db = beerlogdb.BeerLogDB(":memory:")
+    other_db.known_tags_list = self.db.known_tags_list
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 0))
+    other_db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 15, 0))
+    other_db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 16, 0))
+
+    self.assertEqual(["toto"], self.db.GetAllCharacterNames())
+    self.assertEqual(["tutu"], other_db.GetAllCharacterNames())
+    self.assertEqual(1, self.db.GetEntriesCount())
+    self.assertEqual(2, other_db.GetEntriesCount())
+    # Related rows are fetched from the same database.
+    self.assertEqual("tutu", other_db.GetEntryById(1).character.name)
+    self.assertEqual("toto", self.db.GetEntryById(1).character.name)
+    self.assertIsInstance(other_db.GetEntryById(1), beerlogdb.Entry)
+    other_db.Close()
+
   def testGetNameFromHexID(self):
     """Tests the CharacterFromHexID() method."""
     result = self.db.GetNameFromHexID("0x0")
@@ -47,6 +154,33 @@ class BeerLogDBTests(unittest.TestCase):
     result = self.db.GetNameFromHexID("0x1")
     self.assertEqual(result, "toto")
 
+  def testCharacters(self):
+    """Tests that characters follow their tags, and are matched ignoring case."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 15, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 16, 0))
+    self.assertEqual(["toto", "tutu"], self.db.GetAllCharacterNames())
+    self.assertEqual(33 + 45, self.db.GetAmountFromName("TOTO"))
+    self.assertEqual(
+      self.db.GetCharacter("toto"), self.db.GetEntryById(2).character, "0x1 should be toto's"
+    )
+
+    # Renaming someone keeps their history.
+    self.db.known_tags_list["0x0"]["realname"] = "Toto the Great"
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 17, 0))
+    self.assertEqual(["Toto the Great", "tutu"], self.db.GetAllCharacterNames())
+    self.assertEqual(33 + 45 + 33, self.db.GetAmountFromName("toto the great"))
+    self.assertEqual(0, self.db.GetAmountFromName("toto"))
+    self.assertEqual("Toto the Great", self.db.GetEntryById(1).character_name)
+
+    # Giving a tag the name of someone else gives it to them.
+    self.db.known_tags_list["0x3"]["name"] = "TUTU"
+    self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 1, 18, 0))
+    self.assertEqual(
+      [("Toto the Great", 111), ("tutu", 90)],
+      [(t.character_name, t.total) for t in self.db.GetScoreBoard()],
+    )
+
   def testGetScoreBoard(self):
     """Tests the GetScoreBoard method."""
     self.db.AddEntry("0x0")
@@ -69,6 +203,168 @@ class BeerLogDBTests(unittest.TestCase):
     results = [(t.character_name, t.total, t.pic) for t in self.db.GetScoreBoard()]
     self.assertEqual(expected, results, "Error in testGetScoreBoard")
 
+  def testGetScoreBoardAt(self):
+    """Tests the GetScoreBoardAt() method."""
+    self.assertEqual([], self.db.GetScoreBoardAt(datetime.datetime(2019, 1, 1, 14, 0)))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 15, 0))
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 16, 0))
+    self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 1, 13, 0))
+
+    self.assertEqual(
+      [("tata", 40, 1, datetime.datetime(2019, 1, 1, 13, 0))],
+      self.db.GetScoreBoardAt(datetime.datetime(2019, 1, 1, 13, 59)),
+    )
+    self.assertEqual(
+      ["tutu", "tata", "toto"],
+      [row.character_name for row in self.db.GetScoreBoardAt(datetime.datetime(2019, 1, 1, 15))],
+    )
+    self.assertEqual(
+      [
+        beerlogdb.ScoreBoardRow("toto", 78, 2, datetime.datetime(2019, 1, 1, 16, 0)),
+        beerlogdb.ScoreBoardRow("tutu", 50, 1, datetime.datetime(2019, 1, 1, 15, 0)),
+        beerlogdb.ScoreBoardRow("tata", 40, 1, datetime.datetime(2019, 1, 1, 13, 0)),
+      ],
+      self.db.GetScoreBoardAt(datetime.datetime(2019, 1, 2)),
+    )
+    self.assertEqual(
+      [(t.character_name, t.total) for t in self.db.GetScoreBoard()],
+      [(t.character_name, t.total) for t in self.db.GetScoreBoardAt(datetime.datetime(2019, 1, 2))],
+    )
+
+    # The prefix sums follow new scans.
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 14, 30))
+    self.assertEqual(
+      [("tutu", 100), ("toto", 78), ("tata", 40)],
+      [(t.character_name, t.total) for t in self.db.GetScoreBoardAt(datetime.datetime(2019, 1, 2))],
+    )
+
+    # Scans made before the start of the scoreboard aren't counted.
+    self.assertEqual(
+      [
+        beerlogdb.ScoreBoardRow("tutu", 100, 2, datetime.datetime(2019, 1, 1, 15, 0)),
+        beerlogdb.ScoreBoardRow("toto", 45, 1, datetime.datetime(2019, 1, 1, 16, 0)),
+      ],
+      self.db.GetScoreBoardAt(
+        datetime.datetime(2019, 1, 2), since=datetime.datetime(2019, 1, 1, 14, 30)
+      ),
+    )
+
+  def testGetCumulativeTotals(self):
+    """Tests that the prefix sums are extended with new scans."""
+    self.assertEqual([], self.db.GetCumulativeTotalsFromName("toto").totals)
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 15, 0))
+    toto = self.db.GetCumulativeTotalsFromName("toto")
+    self.assertEqual([datetime.datetime(2019, 1, 1, 14, 0)], toto.timestamps)
+
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 16, 0))
+    self.assertEqual([33, 78], self.db.GetCumulativeTotalsFromName("toto").totals)
+    # The same lists were extended.
+    self.assertIs(toto, self.db.GetCumulativeTotalsFromName("toto"))
+
+    # Late scans are spliced in, after the scans made at the same time.
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 12, 0))
+    self.assertEqual(
+      beerlogdb.CumulativeTotals(
+        [
+          datetime.datetime(2019, 1, 1, 12, 0),
+          datetime.datetime(2019, 1, 1, 14, 0),
+          datetime.datetime(2019, 1, 1, 14, 0),
+          datetime.datetime(2019, 1, 1, 16, 0),
+        ],
+        [33, 66, 111, 156],
+        [1, 2, 3, 4],
+      ),
+      self.db.GetCumulativeTotalsFromName("toto"),
+    )
+    self.assertEqual(
+      [(e.timestamp, e.sum) for e in self.db.GetDataFromName("toto")][-1],
+      (toto.timestamps[-1], toto.totals[-1]),
+    )
+
+    # Renamed characters keep their series.
+    self.db.known_tags_list["0x2"]["realname"] = "Tutu the Great"
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 17, 0))
+    self.assertEqual([50, 100], self.db.GetCumulativeTotalsFromName("Tutu the Great").totals)
+    self.assertNotIn("tutu", self.db.GetCumulativeTotals())
+
+    # Compacted entries are loaded again.
+    self.db.CompactEntries(datetime.datetime(2019, 1, 2))
+    toto = self.db.GetCumulativeTotalsFromName("toto")
+    self.assertEqual([33, 111, 156], toto.totals)
+    self.assertEqual([1, 3, 4], toto.scans)
+
+    # So are rewritten entries, even if their number didn't change.
+    rewrites = self.db.GetEntryRewrites()
+    self.db.StartSession(started_at=datetime.datetime(2019, 1, 1, 15, 0))
+    self.assertGreater(self.db.GetEntryRewrites(), rewrites)
+    self.db.Entry.update(amount=50).where(
+      self.db.Entry.timestamp == datetime.datetime(2019, 1, 1, 16, 0)
+    ).execute()
+    self.assertEqual([33, 111, 161], self.db.GetCumulativeTotalsFromName("toto").totals)
+
+  def testCharacterTotalsTriggers(self):
+    """Tests that CharacterTotals follows inserts, updates and deletes."""
+    self.db.AddEntry("0x0", pic="first", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x1", pic="second", time=datetime.datetime(2019, 1, 1, 16, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 15, 0))
+    # Backdated scans don't change the last scan.
+    self.db.AddEntry("0x0", pic="backdated", time=datetime.datetime(2019, 1, 1, 10, 0))
+
+    toto = self.db.CharacterTotals.get(character=self.db.GetCharacter("toto"))
+    self.assertEqual(33 + 45 + 33, toto.total)
+    self.assertEqual(3, toto.scans)
+    self.assertEqual(datetime.datetime(2019, 1, 1, 10, 0), toto.first)
+    self.assertEqual(datetime.datetime(2019, 1, 1, 16, 0), toto.last)
+    self.assertEqual("second", toto.pic)
+    self.assertEqual(datetime.datetime(2019, 1, 1, 16, 0), self.db.GetLatestTimestamp("toto"))
+
+    self.db.Entry.delete().where(self.db.Entry.pic == "second").execute()
+    toto = self.db.CharacterTotals.get(character=self.db.GetCharacter("toto"))
+    self.assertEqual(33 + 33, toto.total)
+    self.assertEqual(datetime.datetime(2019, 1, 1, 14, 0), toto.last)
+    self.assertEqual("first", toto.pic)
+
+    # Moving a scan to someone else updates both characters.
+    self.db.Entry.update(character=self.db.GetCharacter("tutu"), amount=50).where(
+      self.db.Entry.pic == "first"
+    ).execute()
+    self.assertEqual(33, self.db.GetAmountFromName("toto"))
+    self.assertEqual(100, self.db.GetAmountFromName("tutu"))
+    self.assertEqual(2, self.db.CharacterTotals.get(character=self.db.GetCharacter("tutu")).scans)
+
+    self.db.Entry.delete().where(self.db.Entry.character == self.db.GetCharacter("toto")).execute()
+    self.assertIsNone(self.db.CharacterTotals.get_or_none(character=self.db.GetCharacter("toto")))
+    self.assertEqual(0, self.db.GetAmountFromName("toto"))
+    self.assertIsNone(self.db.GetLatestTimestamp("toto"))
+
+    expected = [
+      (t.character_name, t.total, t.scans, t.first, t.last, t.pic) for t in self.db.GetScoreBoard()
+    ]
+    self.db.RebuildCharacterTotals()
+    results = [
+      (t.character_name, t.total, t.scans, t.first, t.last, t.pic) for t in self.db.GetScoreBoard()
+    ]
+    self.assertEqual(expected, results)
+
+  def testReadCache(self):
+    """Tests that cached reads follow writes."""
+    self.db.AddEntry("0x0")
+    self.assertEqual(33, self.db.GetAmountFromName("toto"))
+    self.assertEqual(33, self.db.GetAmountFromName("toto"))
+    self.assertEqual(1, self.db.cache.hits)
+
+    self.db.AddEntry("0x0")
+    self.assertEqual(66, self.db.GetAmountFromName("toto"))
+    self.assertEqual(2, self.db.GetEntriesCount())
+
+    # Writes that don't go through BeerLogDB are also noticed.
+    self.db.Entry.delete().execute()
+    self.assertEqual(0, self.db.GetAmountFromName("toto"))
+    self.assertEqual([], self.db.GetScoreBoard())
+
   def testGetCharacters(self):
     """Test tags name/hexid operations."""
     self.db.AddEntry("0x0", "pic2")
@@ -106,6 +402,11 @@ class BeerLogDBTests(unittest.TestCase):
     self.assertEqual(
       expected_entry, self.db.GetEarliestEntry(after=datetime.datetime(2019, 1, 1, 16, 30))
     )
+    self.assertEqual(self.db.GetEntryById(5), self.db.GetLatestEntry())
+    self.assertEqual(
+      self.db.GetEntryById(3), self.db.GetLatestEntry(before=datetime.datetime(2019, 1, 1, 16, 0))
+    )
+    self.assertIsNone(self.db.GetLatestEntry(before=datetime.datetime(2018, 1, 1)))
 
     # 3 scans: 2 with 33 & 1 with 45
     self.assertEqual(2 * 33 + 1 * 45, self.db.GetAmountFromHexID("0x0"))
@@ -153,6 +454,50 @@ class BeerLogDBTests(unittest.TestCase):
       total += entry.amount
     self.assertEqual(40, total)
 
+  def testReadRows(self):
+    """Tests that the *Rows() methods return the same data as the models."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 10, 10))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 11, 10))
+    self.db.StartSession(started_at=datetime.datetime(2019, 1, 2))
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 2, 12, 10))
+    self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 2, 13, 10))
+
+    for all_time in [False, True]:
+      self.assertEqual(
+        [(t.character_name, t.total, t.scans, t.last) for t in self.db.GetScoreBoard(all_time)],
+        self.db.GetScoreBoardRows(all_time),
+      )
+    self.assertEqual(
+      [("toto", 33 + 45, 2, datetime.datetime(2019, 1, 2, 12, 10))],
+      self.db.GetScoreBoardRows(all_time=True)[:1],
+    )
+
+    self.assertEqual(
+      [
+        (e.id, e.timestamp, e.character_name, e.amount, e.scans, e.pic)
+        for e in self.db.GetAllData()
+      ],
+      self.db.GetAllEntryRows(),
+    )
+
+    start = datetime.datetime(2019, 1, 1, 11, 0)
+    end = datetime.datetime(2019, 1, 2, 13, 0)
+    rows = self.db.GetEntryRowsInWindow(start, end)
+    self.assertEqual(
+      [
+        (e.id, e.timestamp, e.character_name, e.amount)
+        for e in self.db.GetEntriesInWindow(start, end)
+      ],
+      [(e.id, e.timestamp, e.character_name, e.amount) for e in rows],
+    )
+    self.assertEqual(["tutu", "toto"], [e.character_name for e in rows])
+
+    self.assertEqual(
+      [(e.timestamp, e.sum) for e in self.db.GetDataFromName("toto")],
+      self.db.GetDataRowsFromName("toto"),
+    )
+    self.assertEqual(33 + 45, self.db.GetDataRowsFromName("toto")[-1].total)
+
   def testLoadTags(self):
     """Test loading the name/hexid json file."""
 
@@ -179,6 +524,395 @@ class BeerLogDBTests(unittest.TestCase):
       self.assertEqual(self.db.GetNameFromHexID("0x0"), "Kikoo")
       self.assertEqual(self.db.GetNameFromHexID("0x2"), "realname")
 
+  def testGetDrinkingDays(self):
+    """Tests the GetDrinkingDays() method."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 20, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 8, 2, 30))  # Still on the 7th
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 8, 18, 0))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 10, 21, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 10, 22, 0))
+
+    days = self.db.GetDrinkingDays()
+    self.assertEqual(
+      [
+        beerlogdb.DrinkingDay(
+          datetime.date(2019, 1, 7),
+          datetime.datetime(2019, 1, 7, 20, 0),
+          datetime.datetime(2019, 1, 8, 2, 30),
+          33 + 50,
+          2,
+          6.5,
+        ),
+        beerlogdb.DrinkingDay(
+          datetime.date(2019, 1, 8),
+          datetime.datetime(2019, 1, 8, 18, 0),
+          datetime.datetime(2019, 1, 8, 18, 0),
+          33,
+          1,
+          0.0,
+        ),
+        beerlogdb.DrinkingDay(
+          datetime.date(2019, 1, 10),
+          datetime.datetime(2019, 1, 10, 21, 0),
+          datetime.datetime(2019, 1, 10, 22, 0),
+          33 + 50,
+          2,
+          1.0,
+        ),
+      ],
+      days,
+    )
+
+    days = self.db.GetDrinkingDays(
+      start=datetime.date(2019, 1, 8), end=datetime.datetime(2019, 1, 10, 21, 30)
+    )
+    self.assertEqual([datetime.date(2019, 1, 8), datetime.date(2019, 1, 10)], [d.day for d in days])
+    self.assertEqual(33, days[1].total_cl)
+
+    # Days with a single scan are ignored
+    self.assertEqual(round((83 / 6.5 + 83) / 2, 2), self.db.GetAverageTotalHourlyConsumption())
+
+  def testDrinkingDays(self):
+    """Tests the drinking_day column, and the queries using it."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 20, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 8, 2, 30))
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 8, 6, 0))
+    self.db.AddEntries(
+      [
+        {"uid": "0x2", "timestamp": "2019-01-08 05:59:59"},
+        {"uid": "0x0", "timestamp": "2019-01-10 21:00:00"},
+        {"uid": "0x0", "timestamp": "2019-01-10 21:30:00"},
+      ]
+    )
+    self.assertEqual(datetime.date(2019, 1, 7), self.db.GetEntryById(4).drinking_day)
+    self.assertEqual(
+      {
+        datetime.date(2019, 1, 7): 33 + 50 + 50,
+        datetime.date(2019, 1, 8): 45,
+        datetime.date(2019, 1, 10): 33 + 33,
+      },
+      self.db.GetDayTotals(),
+    )
+    self.assertEqual(
+      {datetime.date(2019, 1, 8): 45},
+      self.db.GetDayTotals(first_day=datetime.date(2019, 1, 8), last_day=datetime.date(2019, 1, 9)),
+    )
+    self.assertEqual(
+      [1, 2, 4], [entry.id for entry in self.db.GetEntriesForDay(datetime.date(2019, 1, 7))]
+    )
+    self.assertEqual(
+      [
+        ("tutu", 100, 2, datetime.datetime(2019, 1, 8, 5, 59, 59)),
+        ("toto", 33, 1, datetime.datetime(2019, 1, 7, 20, 0)),
+      ],
+      self.db.GetTonightScoreBoard(now=datetime.datetime(2019, 1, 8, 3, 0)),
+    )
+    self.assertEqual([], self.db.GetTonightScoreBoard(now=datetime.datetime(2019, 1, 10, 3, 0)))
+
+    # Compacted rows keep their day.
+    self.db.CompactEntries(datetime.datetime(2019, 1, 11))
+    self.assertEqual(
+      [datetime.date(2019, 1, 10)],
+      [entry.drinking_day for entry in self.db.GetEntriesForDay(datetime.date(2019, 1, 10))],
+    )
+
+    self.db.cutoff_hour = 0
+    self.db.RebuildDrinkingDays()
+    self.assertEqual(
+      [datetime.date(2019, 1, 7), datetime.date(2019, 1, 8), datetime.date(2019, 1, 10)],
+      [day.day for day in self.db.GetDrinkingDays()],
+    )
+    self.assertEqual(50 + 45 + 50, self.db.GetDayTotals()[datetime.date(2019, 1, 8)])
+
+  def testAddEntries(self):
+    """Tests the AddEntries() method."""
+    keg = self.db.TapKeg(2000, tapped_at=datetime.datetime(2019, 1, 1, 15))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 13, 0))
+    self.db.BULK_INSERT_CHUNK_SIZE = 2
+    count = self.db.AddEntries(
+      [
+        {"uid": "0x0", "timestamp": "2019-01-01 14:00:00"},
+        {"uid": "0x0", "timestamp": datetime.datetime(2019, 1, 1, 16, 0)},
+        {"uid": "0x1", "timestamp": "2019-01-01T16:30:00", "pic": "pic1"},
+        {"character_name": "tata", "amount": "25", "timestamp": "2019-01-01 17:00:00"},
+      ]
+    )
+    self.assertEqual(4, count)
+    self.assertEqual(5, self.db.GetEntriesCount())
+    self.assertEqual(
+      [("toto", 111, 3), ("tutu", 50, 1), ("tata", 25, 1)],
+      [(t.character_name, t.total, t.scans) for t in self.db.GetScoreBoard()],
+    )
+    self.assertEqual(33 + 45 + 25, self.db.Keg.get_by_id(keg.id).consumed_cl)
+
+    # Triggers are back after the import
+    self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 1, 18, 0))
+    self.assertEqual(65, self.db.GetAmountFromName("tata"))
+
+    # An invalid scan doesn't import anything
+    with self.assertRaises(errors.BeerLogError):
+      self.db.AddEntries(
+        [
+          {"uid": "0x0", "timestamp": "2019-01-02 14:00:00"},
+          {"uid": "0xUnknown", "timestamp": "2019-01-02 14:00:00"},
+        ]
+      )
+    with self.assertRaises(errors.BeerLogError):
+      self.db.AddEntries([{"uid": "0x0", "timestamp": "yesterday"}])
+    self.assertEqual(6, self.db.GetEntriesCount())
+    self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 1, 19, 0))
+    self.assertEqual(105, self.db.GetAmountFromName("tata"))
+
+  def testAddEntriesTimeZone(self):
+    """Tests that imported timestamps with a time zone are stored in local time."""
+    paris_time = datetime.datetime(
+      2019, 1, 1, 23, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=1))
+    )
+    self.db.AddEntries(
+      [
+        {"uid": "0x0", "timestamp": paris_time.isoformat()},
+        {"uid": "0x2", "timestamp": "2019-01-01 20:00:00"},
+      ]
+    )
+    local_time = paris_time.astimezone().replace(tzinfo=None)
+    self.assertEqual(
+      sorted([local_time, datetime.datetime(2019, 1, 1, 20, 0)]),
+      [entry[0] for entry in self.db.IterEntries()],
+    )
+
+  def testIterEntries(self):
+    """Tests the IterEntries() method."""
+    self.assertEqual([], list(self.db.IterEntries()))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 15, 0))
+    self.db.AddEntry("0x2", "pic1", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 1, 15, 0))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 16, 0))
+    expected = [
+      (datetime.datetime(2019, 1, 1, 14, 0), "tutu", 50, "pic1", 1),
+      (datetime.datetime(2019, 1, 1, 15, 0), "toto", 33, None, 1),
+      (datetime.datetime(2019, 1, 1, 15, 0), "tata", 40, None, 1),
+      (datetime.datetime(2019, 1, 1, 16, 0), "toto", 33, None, 1),
+    ]
+    self.assertEqual(expected, list(self.db.IterEntries()))
+    for chunk_size in [1, 2, 4]:
+      self.assertEqual(expected, list(self.db.IterEntries(chunk_size=chunk_size)))
+
+  def testKegs(self):
+    """Tests tapping kegs, and tracking their remaining volume."""
+    self.assertIsNone(self.db.GetActiveKeg())
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 10, 0))  # Before any keg
+
+    first_keg = self.db.TapKeg(2000, loss_percent=10, tapped_at=datetime.datetime(2019, 1, 7, 12))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 13, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 7, 14, 0))
+    self.assertEqual(first_keg, self.db.GetActiveKeg())
+    self.assertEqual(33 + 50, self.db.GetActiveKeg().consumed_cl)
+    self.assertAlmostEqual(2000 - 83 * 1.1, self.db.GetActiveKeg().GetRemaining())
+
+    second_keg = self.db.TapKeg(3000, tapped_at=datetime.datetime(2019, 1, 8, 12))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 8, 13, 0))
+    # A late scan for the first keg
+    entry = self.db.AddEntry("0x3", time=datetime.datetime(2019, 1, 7, 23, 0))
+    self.assertEqual(first_keg.id, self.db.GetEntryById(entry.id).keg_id)
+    kegs = self.db.GetKegs()
+    self.assertEqual([second_keg.id, first_keg.id], [k.id for k in kegs])
+    self.assertEqual([50, 33 + 50 + 40], [k.consumed_cl for k in kegs])
+    self.assertEqual(self.db.pertes_percent, kegs[0].loss_percent)
+
+    # Tapping a keg in the past takes over the later scans of the previous keg.
+    middle_keg = self.db.TapKeg(1000, tapped_at=datetime.datetime(2019, 1, 7, 13, 30))
+    self.assertEqual([50, 50 + 40, 33], [k.consumed_cl for k in self.db.GetKegs()])
+    self.assertEqual(middle_keg.id, self.db.GetEntryById(3).keg_id)
+
+    self.db.Entry.delete().where(self.db.Entry.id == 3).execute()
+    self.assertEqual(40, self.db.Keg.get_by_id(middle_keg.id).consumed_cl)
+
+    expected = [k.consumed_cl for k in self.db.GetKegs()]
+    self.db.Keg.update(consumed_cl=0).execute()
+    self.db.RebuildAggregates()
+    self.assertEqual(expected, [k.consumed_cl for k in self.db.GetKegs()])
+
+    with self.assertRaises(errors.BeerLogError):
+      self.db.TapKeg(0)
+
+  def testSessions(self):
+    """Tests splitting the scans into sessions."""
+    self.assertIsNone(self.db.GetCurrentSession())
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 20, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 7, 21, 0))
+    first_session = self.db.GetCurrentSession()
+    self.assertEqual(datetime.datetime(2019, 1, 7, 20, 0), first_session.started_at)
+
+    second_session = self.db.StartSession(
+      name="party", started_at=datetime.datetime(2019, 1, 14, 18, 0)
+    )
+    self.assertEqual("party", second_session.GetDisplayName())
+    self.assertEqual(second_session, self.db.GetCurrentSession())
+    self.assertEqual([], self.db.GetScoreBoard())
+    self.assertEqual(0, self.db.GetTotalAmount())
+    self.assertEqual(33 + 50, self.db.GetTotalAmount(all_time=True))
+
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 14, 19, 0))
+    self.assertEqual(["toto"], self.db.GetAllCharacterNames())
+    self.assertEqual(["toto", "tutu"], self.db.GetAllCharacterNames(all_time=True))
+    self.assertEqual(33, self.db.GetAmountFromName("toto"))
+    self.assertEqual(33 + 33, self.db.GetAmountFromName("toto", all_time=True))
+    self.assertEqual(1, self.db.GetEntriesCount())
+    self.assertEqual(3, self.db.GetEntriesCount(all_time=True))
+    self.assertEqual(datetime.datetime(2019, 1, 14, 19, 0), self.db.GetEarliestTimestamp())
+    self.assertEqual(
+      datetime.datetime(2019, 1, 7, 20, 0), self.db.GetEarliestTimestamp(all_time=True)
+    )
+    self.assertEqual(
+      [("toto", 33, 1)], [(t.character_name, t.total, t.scans) for t in self.db.GetScoreBoard()]
+    )
+    self.assertEqual(
+      [
+        ("toto", 66, 2, datetime.datetime(2019, 1, 14, 19, 0)),
+        ("tutu", 50, 1, datetime.datetime(2019, 1, 7, 21, 0)),
+      ],
+      [(t.character_name, t.total, t.scans, t.last) for t in self.db.GetScoreBoard(all_time=True)],
+    )
+
+    # A late scan for the first session
+    entry = self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 7, 23, 0))
+    self.assertEqual(first_session.id, self.db.GetEntryById(entry.id).session_id)
+
+    # Starting a session in the past takes over the later scans of the previous session.
+    middle_session = self.db.StartSession(started_at=datetime.datetime(2019, 1, 7, 22, 0))
+    self.assertEqual(second_session, self.db.GetCurrentSession())
+    self.assertEqual(middle_session.id, self.db.GetEntryById(entry.id).session_id)
+    self.assertEqual(
+      [second_session.id, middle_session.id, first_session.id],
+      [session.id for session in self.db.GetSessions()],
+    )
+    # Bulk imported scans also go to their session.
+    self.db.AddEntries([{"uid": "0x3", "timestamp": "2019-01-07 22:30:00"}])
+    self.assertEqual(2, middle_session.entries.count())
+
+    expected = [(t.character_name, t.total, t.scans) for t in self.db.GetScoreBoard(all_time=True)]
+    self.db.RebuildAggregates()
+    self.assertEqual(
+      expected, [(t.character_name, t.total, t.scans) for t in self.db.GetScoreBoard(all_time=True)]
+    )
+
+  def testCompactEntries(self):
+    """Tests collapsing old scans into summary rows."""
+    self.db.AddEntry("0x0", pic="first", time=datetime.datetime(2019, 1, 7, 20, 5))
+    self.db.AddEntry("0x1", pic="second", time=datetime.datetime(2019, 1, 7, 20, 30))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 7, 20, 40))
+    self.db.TapKeg(2000, tapped_at=datetime.datetime(2019, 1, 7, 20, 45))
+    # Scans for different kegs are kept apart.
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 20, 50))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 21, 10))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 22, 10))
+    self.db.AddEntry("0x0", pic="last", time=datetime.datetime(2019, 1, 7, 22, 20))
+
+    def GetState():
+      return (
+        [(t.character_name, t.total, t.scans, t.last, t.pic) for t in self.db.GetScoreBoard()],
+        self.db.GetTotalAmount(),
+        self.db.GetAmountFromName("toto"),
+        self.db.GetEntriesCount(),
+        [k.consumed_cl for k in self.db.GetKegs()],
+        [(day.day, day.total_cl, day.scans) for day in self.db.GetDrinkingDays()],
+      )
+
+    expected = GetState()
+    # Only whole hours are compacted.
+    older_than = datetime.datetime(2019, 1, 7, 22, 15)
+    self.assertEqual(2, self.db.CompactEntries(older_than, chunk_size=2))
+    self.assertEqual(6, self.db.CountAll())
+    self.assertEqual(expected, GetState())
+    summary = self.db.GetLatestEntry(before=datetime.datetime(2019, 1, 7, 20, 35))
+    self.assertEqual(
+      (33 + 45, 2, datetime.datetime(2019, 1, 7, 20, 30), "second"),
+      (summary.amount, summary.scans, summary.timestamp, summary.pic),
+    )
+    # The time of the first scan is lost.
+    toto = self.db.CharacterTotals.get(character=self.db.GetCharacter("toto"))
+    self.assertEqual(datetime.datetime(2019, 1, 7, 20, 30), toto.first)
+
+    self.assertEqual(0, self.db.CompactEntries(older_than))
+    self.db.RebuildAggregates()
+    self.assertEqual(expected, GetState())
+
+  def testExportCompactedEntries(self):
+    """Tests that compacted entries keep their number of scans once exported,
+    and imported back."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 20, 5))
+    self.db.AddEntry("0x1", time=datetime.datetime(2019, 1, 7, 20, 30))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 7, 20, 40))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 22, 10))
+    self.db.CompactEntries(datetime.datetime(2019, 1, 7, 22, 0))
+
+    for file_format in serialization.FORMATS:
+      output_file = io.StringIO()
+      serialization.WriteEntries(output_file, self.db.IterEntries(), file_format)
+      output_file.seek(0)
+      imported_db = beerlogdb.BeerLogDB(":memory:")
+      self.assertEqual(
+        3, imported_db.AddEntries(serialization.ReadEntries(output_file, file_format))
+      )
+      self.assertEqual(list(self.db.IterEntries()), list(imported_db.IterEntries()))
+      self.assertEqual(
+        [("toto", 111, 3), ("tutu", 50, 1)],
+        [(t.character_name, t.total, t.scans) for t in imported_db.GetScoreBoard()],
+      )
+
+    for scans in [-1, 0, "0", ""]:
+      with self.assertRaises(errors.BeerLogError):
+        self.db.AddEntries(
+          [{"character_name": "toto", "amount": 0, "timestamp": "2019-01-08 14:00", "scans": scans}]
+        )
+
+  def testKegPredictionSessions(self):
+    """Tests that the predictions only use the scans of the current session,
+    even when it started during a drinking day."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 7, 20, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 7, 22, 0))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 10, 18, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 10, 20, 0))
+    session = self.db.StartSession(started_at=datetime.datetime(2019, 1, 10, 21, 0))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 10, 21, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 10, 23, 0))
+
+    self.assertEqual(
+      [(datetime.date(2019, 1, 10), 33 + 50, 2)],
+      [
+        (day.day, day.total_cl, day.scans) for day in self.db.GetDrinkingDays(session_id=session.id)
+      ],
+    )
+    self.assertEqual((33 + 50) / 2, self.db.GetAverageTotalHourlyConsumption())
+    self.assertEqual(
+      round(((33 + 50) / 2 + (33 + 50) * 2 / 5) / 2, 2),
+      self.db.GetAverageTotalHourlyConsumption(all_time=True),
+    )
+
+    now = datetime.datetime(2019, 1, 10, 23, 30)
+    result = self.db.MakeKegPrediction(keg_size_cl=3000, now=now)
+    self.assertEqual(33 + 50, result["today_consumed_cl"])
+    self.assertEqual((33 + 50) / 2, result["average_hourly_cl"])
+    result = self.db.MakeKegPrediction(keg_size_cl=3000, now=now, all_time=True)
+    self.assertEqual((33 + 50) * 2, result["today_consumed_cl"])
+
+  def testMakeKegPredictionWithKeg(self):
+    """Tests the MakeKegPrediction() method with a tapped keg."""
+    with self.assertRaises(errors.BeerLogError):
+      self.db.MakeKegPrediction(now=datetime.datetime(2019, 1, 10, 20, 0))
+
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 9, 10, 0))
+    self.db.TapKeg(1000, loss_percent=10, tapped_at=datetime.datetime(2019, 1, 10, 9, 0))
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 10, 10, 0))
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 10, 12, 0))
+
+    result = self.db.MakeKegPrediction(now=datetime.datetime(2019, 1, 10, 20, 0))
+    self.assertEqual(1000, result["keg_size_cl"])
+    self.assertEqual(10, result["pertes_percent"])
+    self.assertEqual(33 + 50, result["today_consumed_cl"])
+    self.assertAlmostEqual((33 + 50) * 1.1, result["total_consumed_cl"])
+    self.assertEqual(round(1000 - 83 * 1.1), result["estimated_left_cl"])
+
   def testMakeKegPredictionBasic(self):
     """Tests the MakeKegPrediction() method with moderate consumption."""
     # Add entries over 4 days with consistent consumption
@@ -108,7 +108,19 @@ class BaseNFC:
 
   def _Nop(self):
     """Do nothing."""
-    while True:
+    self.ReadTags()
+
+  def ReadTags(self, terminate=None):
+    """Reads tags, and pushes their events, until terminate() returns True.
+
+    This blocks. It runs in self.process, or in an executor of the asyncio
+    runtime.
+
+    Args:
+      terminate(callable): returns whether to stop. Defaults to never.
+    """
+    terminate = terminate or (lambda: False)
+    while not terminate():
       time.sleep(0.1)
 
 
@@ -142,11 +154,28 @@ class BeerNFC(BaseNFC):
     self.process = multiprocessing.Process(target=self._DoNFC, args=(self.path,), daemon=True)
 
   def _DoNFC(self, path):
-    """TODO"""
+    """Reads tags forever, in self.process.
+
+    Args:
+      path(str): the path to the NFC reader.
+    """
+    self.path = path
+    self.ReadTags()
+
+  def ReadTags(self, terminate=None):
+    """Reads tags from the NFC reader until terminate() returns True.
+
+    Args:
+      terminate(callable): returns whether to stop. Defaults to never.
+    Raises:
+      errors.BeerLogError: if the NFC reader can't be opened.
+    """
+    path = self.path
+    terminate = terminate or (lambda: False)
     try:
       with nfc.ContactlessFrontend(path) as clf:
-        while True:
-          success = clf.connect(rdwr={"on-connect": self.ReadTag})
+        while not terminate():
+          success = clf.connect(rdwr={"on-connect": self.ReadTag}, terminate=terminate)
 
           if not success:
             logging.debug("Could not read NFC tag, or we timedout")
@@ -0,0 +1,150 @@
+"""In-memory cache for the read methods of BeerLogDB."""
+
+import collections
+import datetime
+import functools
+import time
+
+
+class ReadCache:
+  """Caches results of read queries, until the underlying data changes.
+
+  Attributes:
+    data_version(int): a counter that increases every time the data changes.
+    hits(int): the number of results served from the cache.
+    misses(int): the number of results that had to be computed.
+  """
+
+  # How often to drop the expired results, in seconds. Time relative queries
+  # make a new key every TTL, so a long running reader would keep piling them
+  # up, as long as the data doesn't change.
+  SWEEP_INTERVAL = 60.0
+
+  def __init__(self, version_getter, clock=time.monotonic):
+    """Initializes a ReadCache.
+
+    Args:
+      version_getter(callable): returns a value that changes whenever the data
+        changes. It is called before every lookup, so it needs to be cheap.
+      clock(callable): returns the current time, in seconds, for TTL expiry.
+    """
+    self._version_getter = version_getter
+    self._clock = clock
+    self._last_version = None
+    self._entries = {}
+    self._next_sweep = clock() + self.SWEEP_INTERVAL
+    self._method_stats = collections.defaultdict(lambda: [0, 0])
+
+    self.data_version = 0
+    self.hits = 0
+    self.misses = 0
+
+  def Invalidate(self):
+    """Drops all cached results, and bumps the data version."""
+    self.data_version += 1
+    self._entries.clear()
+
+  def _CheckVersion(self):
+    """Invalidates the cache if the data changed since the last lookup."""
+    version = self._version_getter()
+    if version != self._last_version:
+      self._last_version = version
+      self.Invalidate()
+
+  def Get(self, key, compute, ttl=None):
+    """Returns a cached result, computing it if necessary.
+
+    Args:
+      key(tuple): the cache key, which first item is the method name.
+      compute(callable): called to compute the result on a cache miss.
+      ttl(float): optional number of seconds after which the result expires,
+        even if the data didn't change.
+    Returns:
+      object: the result.
+    """
+    self._CheckVersion()
+    now = self._clock()
+    if now >= self._next_sweep:
+      self._Sweep(now)
+    cached = self._entries.get(key)
+    if cached is not None:
+      expiry, value = cached
+      if expiry is None or now < expiry:
+        self.hits += 1
+        self._method_stats[key[0]][0] += 1
+        return value
+      self._entries.pop(key, None)
+    self.misses += 1
+    self._method_stats[key[0]][1] += 1
+    value = compute()
+    self._entries[key] = (now + ttl if ttl else None, value)
+    return value
+
+  def _Sweep(self, now):
+    """Drops the expired results.
+
+    Args:
+      now(float): the current time, in seconds.
+    """
+    self._next_sweep = now + self.SWEEP_INTERVAL
+    for key, (expiry, _) in list(self._entries.items()):
+      if expiry is not None and now >= expiry:
+        self._entries.pop(key, None)
+
+  def GetStats(self):
+    """Returns the cache statistics.
+
+    Returns:
+      dict: the statistics.
+    """
+    return {
+      "data_version": self.data_version,
+      "entries": len(self._entries),
+      "hits": self.hits,
+      "misses": self.misses,
+      "methods": {name: {"hits": h, "misses": m} for name, (h, m) in self._method_stats.items()},
+    }
+
+
+def _MakeKeyPart(value, ttl):
+  """Makes a method argument usable in a cache key.
+
+  Datetimes are rounded down to the TTL, so that queries relative to the
+  current time (ie: 'since one hour ago') share the same cache entry.
+
+  Args:
+    value(object): the argument.
+    ttl(float): the TTL of the cached method, or None.
+  Returns:
+    object: a hashable value.
+  """
+  if ttl and isinstance(value, datetime.datetime):
+    return int(value.timestamp() // ttl)
+  if isinstance(value, list):
+    return tuple(value)
+  return value
+
+
+def Cached(ttl=None):
+  """Decorator caching the results of a method in its object's 'cache' attribute.
+
+  Args:
+    ttl(float): optional expiry, in seconds, for queries relative to the
+      current time.
+  Returns:
+    callable: the decorator.
+  """
+
+  def Decorator(method):
+    @functools.wraps(method)
+    def Wrapper(self, *args, **kwargs):
+      key = (
+        method.__name__,
+        tuple(_MakeKeyPart(arg, ttl) for arg in args),
+        tuple(sorted((k, _MakeKeyPart(v, ttl)) for k, v in kwargs.items())),
+      )
+      return self.cache.Get(key, lambda: method(self, *args, **kwargs), ttl=ttl)
+
+    return Wrapper
+
+  return Decorator
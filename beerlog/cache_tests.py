@@ -0,0 +1,89 @@
+"""Tests for the cache module"""
+
+import datetime
+import unittest
+
+from beerlog import cache
+
+
+class FakeDB:
+  """Fake object with cached methods."""
+
+  def __init__(self):
+    self.version = 0
+    self.now = 0.0
+    self.calls = 0
+    self.cache = cache.ReadCache(lambda: self.version, clock=lambda: self.now)
+
+  @cache.Cached()
+  def GetValue(self, value):
+    """Returns its argument."""
+    self.calls += 1
+    return value
+
+  @cache.Cached(ttl=10)
+  def GetSince(self, since):
+    """Returns its argument."""
+    self.calls += 1
+    return since
+
+
+class ReadCacheTests(unittest.TestCase):
+  """Tests for the ReadCache class."""
+
+  def testVersionInvalidation(self):
+    """Tests that results are kept until the data version changes."""
+    db = FakeDB()
+    self.assertEqual(1, db.GetValue(1))
+    self.assertEqual(1, db.GetValue(1))
+    self.assertEqual(2, db.GetValue(value=2))
+    self.assertEqual(2, db.calls)
+    self.assertEqual(1, db.cache.hits)
+    self.assertEqual(2, db.cache.misses)
+    data_version = db.cache.data_version
+
+    db.version += 1
+    self.assertEqual(1, db.GetValue(1))
+    self.assertEqual(3, db.calls)
+    self.assertEqual(data_version + 1, db.cache.data_version)
+
+    db.cache.Invalidate()
+    self.assertEqual(1, db.GetValue(1))
+    self.assertEqual(4, db.calls)
+    self.assertEqual({"hits": 1, "misses": 4}, db.cache.GetStats()["methods"]["GetValue"])
+
+  def testTTL(self):
+    """Tests that time relative results share an entry, and expire."""
+    db = FakeDB()
+    now = datetime.datetime(2019, 1, 1, 14, 0, 0)
+    self.assertEqual(now, db.GetSince(now))
+    # Within the same 10s bucket, we get the first result back.
+    self.assertEqual(now, db.GetSince(now + datetime.timedelta(seconds=5)))
+    self.assertEqual(1, db.calls)
+
+    db.now += 10
+    later = now + datetime.timedelta(seconds=5)
+    self.assertEqual(later, db.GetSince(later))
+    self.assertEqual(2, db.calls)
+
+  def testSweep(self):
+    """Tests that expired results don't pile up while the data doesn't change."""
+    db = FakeDB()
+    now = datetime.datetime(2019, 1, 1, 14, 0, 0)
+    db.GetValue(1)
+    for _ in range(100):
+      db.now += 10
+      now += datetime.timedelta(seconds=10)
+      db.GetSince(now)
+    self.assertLessEqual(db.cache.GetStats()["entries"], 1 + db.cache.SWEEP_INTERVAL / 10 + 1)
+    # Results that don't expire are kept.
+    db.GetValue(1)
+    self.assertEqual(101, db.calls)
+
+    db.now += 10
+    db.GetSince(now)
+    self.assertEqual(102, db.calls)
+
+
+if __name__ == "__main__":
+  unittest.main()
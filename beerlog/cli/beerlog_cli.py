@@ -1,6 +1,7 @@
 """BeerLog main script"""
 
 import argparse
+import contextlib
 import datetime
 from collections import defaultdict
 import logging
@@ -8,7 +9,6 @@ import multiprocessing
 import os
 import queue
 import sys
-from threading import Timer
 import time
 import traceback
 
@@ -16,6 +16,12 @@ from beerlog import beerlogdb
 from beerlog.bnfc import base as nfc_base
 from beerlog import constants
 from beerlog import events
+from beerlog import instrumentation
+from beerlog import recording
+from beerlog import runtime
+from beerlog import scheduler
+from beerlog import serialization
+from beerlog import writer
 from beerlog.gui import display
 
 
@@ -24,32 +30,62 @@ class BeerLog:
 
   Attributes:
     nfc_reader(bnfc.base): the BeerNFC object.
+    scheduler(scheduler.Scheduler): the delayed events.
   """
 
+  # How often, in seconds, to log the database cache statistics in debug mode.
+  CACHE_STATS_INTERVAL = 60
+
+  # How long, in seconds, the scan and error screens stay up.
+  ESCAPE_DELAY = 2
+
   def __init__(self):
     self.nfc_reader: nfc_base.BaseNFC | None = None
-    self.ui: display.LumaDisplay
-    self.db: beerlogdb.BeerLogDB
+    self.ui: display.LumaDisplay | None = None
+    self.db: beerlogdb.BeerLogDB | None = None
+    self.writer: writer.EntryWriter | None = None
+    self.profiler: instrumentation.Profiler | None = None
+    self._command: str | None = None
+    self._command_args: argparse.Namespace
     self._database_path: str
+    self._database_pragmas: dict | None = None
     self._events_queue: multiprocessing.Queue = multiprocessing.Queue()
     self._disable_nfc = False
     self._known_tags_path: str = "known_tags.json"
     self._last_scanned_names = defaultdict(lambda: datetime.datetime(2023, 1, 1))
     self._should_beep = True
-
-    self._timers = []
-
-  def InitNFC(self, path=None):
+    self._debug = False
+    self._profile_dump_path: str | None = None
+    self._last_cache_stats = time.monotonic()
+    self._runtime_name = "threads"
+    self._async_runtime: runtime.AsyncRuntime | None = None
+    self._record_events_path: str | None = None
+    self._replay_events_path: str | None = None
+    self._replay_speed = 1.0
+    self._recorder: recording.EventRecorder | None = None
+    # Closes the files opened for the whole run, ie: the recording.
+    self._exit_stack = contextlib.ExitStack()
+    self._replayer: recording.EventReplayer | None = None
+    self._running = True
+    self._headless = False
+    self._frames_dir: str | None = None
+
+    self.scheduler = scheduler.Scheduler()
+
+  def InitNFC(self, path=None, start_process=True):
     """Initializes the NFC reader.
 
     Args:
       path(str): the option path to the device.
+      start_process(bool): whether to read the tags in the reader's process.
+        The asyncio runtime reads them in an executor instead.
     """
     if not self._disable_nfc:
       self.nfc_reader = nfc_base.BeerNFC(
         events_queue=self._events_queue, should_beep=self._should_beep, path=path
       )
-      self.nfc_reader.process.start()
+      if start_process:
+        self.nfc_reader.process.start()
       logging.debug("Started NFC {0!s}".format(self.nfc_reader))
 
   def ParseArguments(self):
@@ -64,6 +100,59 @@ class BeerLog:
       help="Disable beeping of the NFC reader",
     )
     parser.add_argument("-d", "--debug", dest="debug", action="store_true", help="Debug mode")
+    parser.add_argument(
+      "--profile_dump",
+      dest="profile_dump",
+      default=None,
+      help=(
+        "profiles the queries, and periodically writes the statistics as JSON to this file. "
+        "Debug mode also profiles, and logs a summary"
+      ),
+    )
+    parser.add_argument(
+      "--runtime",
+      dest="runtime",
+      choices=["threads", "asyncio"],
+      default="threads",
+      help=(
+        "how to run the kiosk: a polling loop with threads and processes, or an asyncio "
+        "event loop (default: threads)"
+      ),
+    )
+    parser.add_argument(
+      "--headless",
+      dest="headless",
+      action="store_true",
+      help="draws the display in memory, without a screen or buttons (ie: for benchmarks)",
+    )
+    parser.add_argument(
+      "--frames_dir",
+      dest="frames_dir",
+      default=None,
+      help="saves every frame of the headless display to this directory, as PNG files",
+    )
+    parser.add_argument(
+      "--record-events",
+      dest="record_events",
+      default=None,
+      help="appends every event to this JSON Lines file, to replay it later",
+    )
+    parser.add_argument(
+      "--replay-events",
+      dest="replay_events",
+      default=None,
+      help=(
+        "replays the events recorded in this JSON Lines file instead of reading the NFC reader, "
+        "then exits and reports the frame and query times"
+      ),
+    )
+    parser.add_argument(
+      "--speed",
+      dest="replay_speed",
+      type=float,
+      default=1.0,
+      help="how many times faster than the recording to replay the events (default: 1)",
+    )
     parser.add_argument(
       "--database",
       dest="database",
@@ -84,13 +173,123 @@ class BeerLog:
       action="store_true",
       help="Disables the NFC reader (useful in emulator mode)",
     )
+    parser.add_argument(
+      "--sqlite_synchronous",
+      dest="sqlite_synchronous",
+      choices=["off", "normal", "full", "extra"],
+      default=None,
+      help="the SQLite synchronous pragma (default: normal)",
+    )
+    parser.add_argument(
+      "--sqlite_cache_size",
+      dest="sqlite_cache_size",
+      type=int,
+      default=None,
+      help="the SQLite cache_size pragma, in pages, or in KiB if negative (default: -8000)",
+    )
+    parser.add_argument(
+      "--sqlite_mmap_size",
+      dest="sqlite_mmap_size",
+      type=int,
+      default=None,
+      help="the SQLite mmap_size pragma, in bytes (default: 0)",
+    )
+    parser.add_argument(
+      "--sqlite_temp_store",
+      dest="sqlite_temp_store",
+      choices=["default", "file", "memory"],
+      default=None,
+      help="the SQLite temp_store pragma (default: memory)",
+    )
 
-    args = parser.parse_args()
+    subparsers = parser.add_subparsers(
+      dest="command", help="Maintenance commands. Runs the kiosk if none is given."
+    )
+    subparsers.add_parser(
+      "rebuild", help="Recomputes the aggregate tables (ie: scoreboard) from all scans"
+    )
+    tap_parser = subparsers.add_parser("tap", help="Records that a new keg was tapped")
+    tap_parser.add_argument(
+      "--size", dest="keg_size", type=float, required=True, help="the size of the keg, in L"
+    )
+    tap_parser.add_argument(
+      "--loss",
+      dest="keg_loss",
+      type=float,
+      default=None,
+      help="the expected losses, in percent",
+    )
+    session_parser = subparsers.add_parser(
+      "session",
+      help="Starts a new session (ie: a party). The scoreboard only shows the current session",
+    )
+    session_parser.add_argument(
+      "--name", dest="session_name", default=None, help="the name of the session"
+    )
+    compact_parser = subparsers.add_parser(
+      "compact",
+      help="Collapses old scans into one row per character and hour, keeping all the totals",
+    )
+    compact_parser.add_argument(
+      "--older-than",
+      dest="older_than_days",
+      type=float,
+      required=True,
+      help="compacts the scans older than this number of days",
+    )
+    import_parser = subparsers.add_parser(
+      "import", help="Imports scans from a CSV or JSON Lines file"
+    )
+    import_parser.add_argument("import_path", help="the file to import scans from")
+    import_parser.add_argument(
+      "--format",
+      dest="import_format",
+      choices=serialization.FORMATS,
+      default=None,
+      help="the format of the file. Guessed from its extension if not set",
+    )
+    export_parser = subparsers.add_parser(
+      "export", help="Exports all scans to a CSV or JSON Lines file"
+    )
+    export_parser.add_argument(
+      "export_path", nargs="?", default="-", help="the file to export scans to (default: stdout)"
+    )
+    export_parser.add_argument(
+      "--format",
+      dest="export_format",
+      choices=serialization.FORMATS,
+      default=None,
+      help="the format of the file. Guessed from its extension if not set, CSV for stdout",
+    )
 
+    args = parser.parse_args()
+    if args.replay_events and args.runtime != "threads":
+      parser.error("--replay-events needs the threads runtime")
+    if args.replay_speed <= 0:
+      parser.error("--speed needs to be positive")
+    if args.frames_dir and not args.headless:
+      parser.error("--frames_dir needs --headless")
+
+    self._command = args.command
+    self._command_args = args
     self._database_path = args.database
+    self._database_pragmas = beerlogdb.MakePragmas(
+      synchronous=args.sqlite_synchronous,
+      cache_size=args.sqlite_cache_size,
+      mmap_size=args.sqlite_mmap_size,
+      temp_store=args.sqlite_temp_store,
+    )
     self._known_tags_path = args.known_tags
     self._should_beep = args.should_beep
-    self._disable_nfc = args.disable_nfc
+    self._disable_nfc = args.disable_nfc or bool(args.replay_events)
+    self._debug = args.debug
+    self._profile_dump_path = args.profile_dump
+    self._runtime_name = args.runtime
+    self._record_events_path = args.record_events
+    self._replay_events_path = args.replay_events
+    self._replay_speed = args.replay_speed
+    self._headless = args.headless
+    self._frames_dir = args.frames_dir
 
     if args.debug:
       logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -99,84 +298,296 @@ class BeerLog:
 
   def InitDB(self):
     """Initializes the BeerLogDB object."""
-    self.db = beerlogdb.BeerLogDB(self._database_path)
+    self.db = beerlogdb.BeerLogDB(self._database_path, pragmas=self._database_pragmas)
     self.db.LoadTagsDB(self._known_tags_path)
+    if self._debug or self._profile_dump_path or self._replayer:
+      self.profiler = instrumentation.Profiler(dump_path=self._profile_dump_path)
+      self.profiler.InstrumentDatabase(self.db.database)
+      self.profiler.InstrumentObject(self.db, "BeerLogDB")
+    # The writer thread needs its own connection, to a database on disk.
+    if self._database_path != ":memory:":
+      self.writer = writer.EntryWriter(
+        self.db, error_callback=lambda message: self.PushEvent(events.ErrorEvent(message))
+      )
+      if self.profiler:
+        self.profiler.InstrumentObject(self.writer, "EntryWriter")
+      self.writer.Start()
+
+  def RunCommand(self):
+    """Runs a maintenance command instead of the kiosk."""
+    self.db = beerlogdb.BeerLogDB(self._database_path, pragmas=self._database_pragmas)
+    if self._command == "rebuild":
+      self.db.RebuildAggregates()
+      logging.info(
+        "Rebuilt aggregates for {0:d} entries".format(self.db.GetEntriesCount(all_time=True))
+      )
+    elif self._command == "tap":
+      keg = self.db.TapKeg(
+        round(self._command_args.keg_size * 100), loss_percent=self._command_args.keg_loss
+      )
+      logging.info("Tapped a {0:d} cL keg at {1!s}".format(keg.size_cl, keg.tapped_at))
+    elif self._command == "session":
+      session = self.db.StartSession(name=self._command_args.session_name)
+      logging.info(
+        "Started session {0:s} at {1!s}".format(session.GetDisplayName(), session.started_at)
+      )
+    elif self._command == "compact":
+      older_than = datetime.datetime.now() - datetime.timedelta(
+        days=self._command_args.older_than_days
+      )
+      start = time.monotonic()
+      removed = self.db.CompactEntries(older_than)
+      logging.info(
+        "Compacted scans older than {0!s}, removed {1:d} rows in {2:.1f}s".format(
+          older_than, removed, time.monotonic() - start
+        )
+      )
+    elif self._command == "import":
+      self._ImportEntries()
+    elif self._command == "export":
+      self._ExportEntries()
+
+  def _ImportEntries(self):
+    """Imports scans from the file given in the command line arguments."""
+    # Tags are only required to import scans with a tag uid.
+    if os.path.isfile(self._known_tags_path):
+      self.db.LoadTagsDB(self._known_tags_path)
+    path = self._command_args.import_path
+    file_format = self._command_args.import_format or serialization.GuessFormat(path)
+    start = time.monotonic()
+    with open(path, "r", newline="") as input_file:
+      count = self.db.AddEntries(serialization.ReadEntries(input_file, file_format))
+    logging.info(
+      "Imported {0:d} scans from {1:s} in {2:.1f}s".format(count, path, time.monotonic() - start)
+    )
+
+  def _ExportEntries(self):
+    """Exports all the scans to the file given in the command line arguments."""
+    path = self._command_args.export_path
+    file_format = self._command_args.export_format
+    if path == "-":
+      # Logs also go to stdout, so stay quiet.
+      serialization.WriteEntries(sys.stdout, self.db.IterEntries(), file_format or "csv")
+      return
+    file_format = file_format or serialization.GuessFormat(path)
+    with open(path, "w", newline="") as output_file:
+      count = serialization.WriteEntries(output_file, self.db.IterEntries(), file_format)
+    logging.info("Exported {0:d} scans to {1:s}".format(count, path))
 
   def Main(self):
     """Runs the script."""
     try:
       self.ParseArguments()
+      if self._command:
+        self.RunCommand()
+        return
+      self.InitRecording()
+      if self._runtime_name == "asyncio":
+        runtime.AsyncRuntime(self, nfc_path="usb").Run()
+        return
       self.InitDB()
       self.InitNFC(path="usb")
       self.InitUI()
+      if self._replayer:
+        self._replayer.Start()
       self.Loop()
     except Exception as e:  # pylint: disable=broad-except
       logging.error(e)
       print("An error occurred: {0!s}".format(e))
       print(traceback.format_exc())
     finally:
-      self.Terminate()
+      try:
+        self.Terminate()
+      finally:
+        self._exit_stack.close()
+
+  def InitRecording(self):
+    """Opens the files to record the events to, or to replay them from."""
+    if self._record_events_path:
+      self._recorder = self._exit_stack.enter_context(
+        recording.EventRecorder(self._record_events_path)
+      )
+    if self._replay_events_path:
+      with open(self._replay_events_path, "r", encoding="utf-8") as input_file:
+        recorded_events = list(recording.ReadEvents(input_file))
+      self._replayer = recording.EventReplayer(
+        recorded_events,
+        self._events_queue.put,
+        speed=self._replay_speed,
+        done_callback=self.Stop,
+      )
+
+  def Stop(self):
+    """Stops the kiosk, once the queued events are handled."""
+    self.PushEvent(events.UIEvent(constants.EVENTTYPES.QUIT))
 
   def Terminate(self):
     """End all processes & threads."""
-    # TODO: make sure DB is saved
+    if self._replayer:
+      self._replayer.Stop()
     self.ResetTimers()
     if self.nfc_reader:
       if self.nfc_reader.process.is_alive():
         self.nfc_reader.process.kill()
     if self.ui:
       self.ui.Terminate()
+    if self.writer:
+      self.writer.Stop()
+    if self.profiler:
+      self.profiler.Report()
+      if self._replayer and not self._debug:
+        # Measuring these is the point of a replay.
+        logging.info("Profile summary:\n{0:s}".format(self.profiler.FormatSummary()))
+    if self.db:
+      self.db.Close()
 
   def InitUI(self):
     """Initialises the user interface."""
     # Only GUI for now
-    self.ui = display.LumaDisplay(events_queue=self._events_queue, database=self.db)
+    self.ui = display.LumaDisplay(
+      events_queue=self._events_queue,
+      database=self.db,
+      writer=self.writer,
+      headless=self._headless,
+      frames_dir=self._frames_dir,
+    )
     self.ui.Setup()
     self.ui.Update()
 
+  def SetAsyncRuntime(self, async_runtime: runtime.AsyncRuntime):
+    """Runs the kiosk in an asyncio runtime, which delivers the events and timers.
+
+    This needs to be called before initializing the NFC reader and the UI.
+
+    Args:
+      async_runtime(runtime.AsyncRuntime): the runtime.
+    """
+    self._async_runtime = async_runtime
+    self._events_queue = async_runtime.events_queue
+
   def PushEvent(self, event):
-    """Adds an Event object in the events queue.
+    """Adds an Event object, generated by the kiosk, in the events queue.
 
     Args:
       event(events.BaseEvent): the event to push.
     """
+    event.internal = True
     self._events_queue.put(event)
 
-  def AddDelayedEvent(self, event, timeout):
+  def AddDelayedEvent(self, event, timeout, key=None):
     """Adds an Event object in the events queue after a delay.
 
     Args:
       event(events.BaseEvent): the event to push.
       timeout(int): the number of seconds after which the event will be pushed.
+      key(str): the key of the delayed event. A pending event with the same key
+        is replaced.
+    Returns:
+      object: the key of the delayed event, to cancel it.
     """
-    t = Timer(timeout, self.PushEvent, args=(event,))
-    t.start()
-    self._timers.append(t)
+    if self._replayer:
+      timeout = self._replayer.clock.GetRealDelay(timeout)
+    return self.scheduler.Schedule(timeout, self.PushEvent, event, key=key)
 
   def ResetTimers(self):
     """Reset all timers set for timed events, cancelling the BaseEvent delivery
     to the events queue."""
-    for timer in self._timers:
-      timer.cancel()
+    self.scheduler.CancelAll()
+
+  def GetNextDeadline(self) -> float:
+    """Returns when the loop needs to wake up, if no event comes in.
+
+    Returns:
+      float: the deadline, as a time.monotonic() value.
+    """
+    deadline = self.ui.GetNextDeadline()
+    timer_deadline = self.scheduler.GetNextDeadline()
+    if timer_deadline is not None:
+      deadline = min(deadline, timer_deadline)
+    return deadline
+
+  def RunTimers(self):
+    """Pushes the delayed events that are due."""
+    self.scheduler.RunDue()
 
   def Loop(self):
     """Main program loop.
 
-    Looks for any new event in the main progrem Queue and processes them.
+    Waits for new events in the main program Queue and processes them. The
+    display is only redrawn when it's dirty, so the loop sleeps until the next
+    event, the next delayed event, or until the display needs to check for
+    changes.
     """
-    while True:
+    while self._running:
+      self.RunTimers()
+      timeout = max(0.0, self.GetNextDeadline() - time.monotonic())
       try:
-        event = self._events_queue.get(timeout=1)
-        try:
-          self._HandleEvent(event)
-        except Exception as e:  # pylint: disable=broad-except
-          logging.error(e)
-          err_event = events.ErrorEvent("{0!s}".format(e))
-          self.PushEvent(err_event)
+        event = self._events_queue.get(timeout=timeout)
+        # Handles all the queued events before drawing.
+        while True:
+          self.ProcessEvent(event)
+          event = self._events_queue.get_nowait()
       except queue.Empty:
         pass
-      time.sleep(0.05)
-      self.ui.Update()
+      self.Render()
+
+  def Render(self):
+    """Redraws the display if it's dirty, and runs the periodic reports."""
+    if self.ui.NeedsUpdate():
+      with self._Profile("frame"):
+        self.ui.Update()
+    if self._debug:
+      self._LogCacheStats()
+    if self.profiler:
+      self.profiler.MaybeReport()
+
+  def ProcessEvent(self, event):
+    """Handles an Event, and reports any error as an ErrorEvent.
+
+    Args:
+      event(BaseEvent): the event to handle.
+    """
+    if self._recorder:
+      self._recorder.Record(event)
+    try:
+      with self._Profile("event.{0:s}".format(constants.EVENTTYPES[event.type])):
+        self._HandleEvent(event)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.error(e)
+      err_event = events.ErrorEvent("{0!s}".format(e))
+      self.PushEvent(err_event)
+
+  def _Profile(self, operation):
+    """Measures an operation, if profiling is enabled.
+
+    Args:
+      operation(str): the name of the operation.
+    Returns:
+      contextlib.AbstractContextManager: the context to run the operation in.
+    """
+    if self.profiler:
+      return self.profiler.Operation(operation)
+    return contextlib.nullcontext()
+
+  def _GetEventTime(self, event) -> datetime.datetime:
+    """Returns the time to record for an event.
+
+    Args:
+      event(BaseEvent): the event being handled.
+    Returns:
+      datetime.datetime: the current time, or the recorded time of the event
+        when replaying, as handling the events can lag behind a fast replay.
+    """
+    if self._replayer:
+      return event.timestamp
+    return datetime.datetime.now()
+
+  def _LogCacheStats(self):
+    """Logs the database cache statistics, every CACHE_STATS_INTERVAL seconds."""
+    now = time.monotonic()
+    if now - self._last_cache_stats >= self.CACHE_STATS_INTERVAL:
+      self._last_cache_stats = now
+      logging.debug("DB cache stats: {0!s}".format(self.db.cache.GetStats()))
 
   def _HandleEvent(self, event):
     """Does something with an Event.
@@ -196,19 +607,22 @@ class BeerLog:
       name = self.db.GetNameFromHexID(event.uid)
       delta = constants.SCAN_RATE_LIMIT * 2
       if name in self._last_scanned_names:
-        now = datetime.datetime.now()
+        now = self._GetEventTime(event)
         delta = now - self._last_scanned_names.get(
           name, datetime.datetime(now.year, now.month, now.day)
         )
         delta = delta.total_seconds()
-      self._last_scanned_names[name] = datetime.datetime.now()
+      self._last_scanned_names[name] = self._GetEventTime(event)
 
       if delta < constants.SCAN_RATE_LIMIT:
         too_soon = True
       else:
-        self.db.AddEntry(event.uid)
+        # Queued scans show up on the display before they're written.
+        (self.writer or self.db).AddEntry(event.uid, time=self._GetEventTime(event))
       self.ui.machine.scan(who=name, too_soon=too_soon)
-      self.AddDelayedEvent(events.UIEvent(constants.EVENTTYPES.ESCAPE), 2)
+      self.AddDelayedEvent(
+        events.UIEvent(constants.EVENTTYPES.ESCAPE), self.ESCAPE_DELAY, key="escape-after-scan"
+      )
     elif event.type == constants.EVENTTYPES.KEYUP:
       self.ui.machine.up()
     elif event.type == constants.EVENTTYPES.KEYDOWN:
@@ -228,26 +642,32 @@ class BeerLog:
       name = self.ui._current_character_name
       delta = constants.SCAN_RATE_LIMIT * 2
       if name in self._last_scanned_names:
-        now = datetime.datetime.now()
+        now = self._GetEventTime(event)
         delta = now - self._last_scanned_names.get(
           name, datetime.datetime(now.year, now.month, now.day)
         )
         delta = delta.total_seconds()
-      self._last_scanned_names[name] = datetime.datetime.now()
+      self._last_scanned_names[name] = self._GetEventTime(event)
 
       if delta < constants.SCAN_RATE_LIMIT:
         too_soon = True
       else:
-        self.db.AddNameEntry(name)
+        (self.writer or self.db).AddNameEntry(name, time=self._GetEventTime(event))
       self.ui.machine.scan(who=name, too_soon=too_soon)
-      self.AddDelayedEvent(events.UIEvent(constants.EVENTTYPES.ESCAPE), 2)
+      self.AddDelayedEvent(
+        events.UIEvent(constants.EVENTTYPES.ESCAPE), self.ESCAPE_DELAY, key="escape-after-scan"
+      )
     elif event.type == constants.EVENTTYPES.ERROR:
       self.ui.machine.error(error=str(event))
-      self.AddDelayedEvent(events.UIEvent(constants.EVENTTYPES.ESCAPE), 2)
+      self.AddDelayedEvent(
+        events.UIEvent(constants.EVENTTYPES.ESCAPE), self.ESCAPE_DELAY, key="escape-after-error"
+      )
     elif event.type == constants.EVENTTYPES.NOEVENT:
-      self.ui.Update()
-
-    self.db.Close()
+      self.ui.MarkDirty()
+    elif event.type == constants.EVENTTYPES.QUIT:
+      self._running = False
+      if self._async_runtime:
+        self._async_runtime.Stop()
 
 
 def Main():
@@ -23,6 +23,7 @@ EVENTTYPES = Enum(
     "NFCSCANNED",
     "ESCAPE",
     "ERROR",
+    "QUIT",
   ]
 )
 
@@ -11,11 +11,14 @@ class BaseEvent:
   Attributes:
     timestamp(datetime.datetime): the time when the event was generated.
     type(str): a type for this event.
+    internal(bool): whether the kiosk generated the event itself (ie: a
+      delayed event), rather than the NFC reader or the buttons.
   """
 
   def __init__(self, event_type):
     self.timestamp = datetime.now()
     self.type = event_type
+    self.internal = False
 
   def __str__(self):
     return self.type
@@ -2,13 +2,18 @@
 
 from multiprocessing import Queue
 
+from luma.core.device import dummy
 from luma.oled.device import sh1106
 from luma.emulator.device import pygame
 
 
 class BaseGUI:
   """Base class for a GUI object. To be implemented by each class for each
-  hardware displays."""
+  hardware displays.
+
+  Attributes:
+    throttle_animations(bool): whether animations play at their frame rate.
+  """
 
   def __init__(self, queue: Queue):
     """Initializes a BaseGUI object.
@@ -17,9 +22,10 @@ class BaseGUI:
       queue(Queue): the shared events queue.
     """
     self.queue: Queue = queue
-    self._device: sh1106 | pygame
+    self.throttle_animations = True
+    self._device: sh1106 | pygame | dummy
 
-  def GetDevice(self) -> sh1106 | pygame:
+  def GetDevice(self) -> sh1106 | pygame | dummy:
     """Returns the underlying luma device (for drawing)."""
     return self._device
 
@@ -22,6 +22,7 @@ from beerlog import beerlogdb
 from beerlog.gui import base as gui_base
 from beerlog.gui import achievements
 from beerlog.beerlogdb import BeerLogDB
+from beerlog.writer import EntryWriter
 from beerlog import errors
 from beerlog import system
 from beerlog import utils
@@ -102,19 +103,103 @@ class Scroller:
       self.index -= 1
 
 
+class Replay:
+  """Implements a clock stepping through the scans of a night.
+
+  Attributes:
+    start(datetime.datetime): the time of the first scan of the night.
+    end(datetime.datetime): the time of the last scan of the night.
+    current(datetime.datetime): the replayed time.
+  """
+
+  # How much replayed time passes at each step.
+  STEP = datetime.timedelta(minutes=15)
+  # How often, in seconds, to step forward automatically.
+  STEP_INTERVAL = 1.0
+
+  def __init__(self):
+    self.start = None
+    self.end = None
+    self.current = None
+    self._last_step = 0.0
+
+  def Start(self, start: datetime.datetime, end: datetime.datetime):
+    """Starts replaying a time window.
+
+    Args:
+      start(datetime.datetime): the start of the replay.
+      end(datetime.datetime): the end of the replay.
+    """
+    self.start = start
+    self.end = end
+    self.current = start
+    self._last_step = time.monotonic()
+
+  def Forward(self, unused_event):
+    """Steps forward. This is called by the transitioning state machine."""
+    if self.current is not None:
+      self.current = min(self.current + self.STEP, self.end)
+      self._last_step = time.monotonic()
+
+  def Backward(self, unused_event):
+    """Steps backward. This is called by the transitioning state machine."""
+    if self.current is not None:
+      self.current = max(self.current - self.STEP, self.start)
+      self._last_step = time.monotonic()
+
+  def GetNextStepTime(self) -> float:
+    """Returns when Tick() will next step forward, as a time.monotonic() value."""
+    return self._last_step + self.STEP_INTERVAL
+
+  def Tick(self):
+    """Steps forward if STEP_INTERVAL passed since the last step."""
+    if time.monotonic() - self._last_step >= self.STEP_INTERVAL:
+      self.Forward(None)
+
+
 class LumaDisplay:
   """Class managing the display."""
 
-  STATES = ["SPLASH", "SCORE", "STATS", "SCANNED", "ERROR", "MENUGLOBAL", "GRAPH"]
+  STATES = ["SPLASH", "SCORE", "STATS", "SCANNED", "ERROR", "MENUGLOBAL", "GRAPH", "REPLAY"]
 
   DEFAULT_SPLASH_PIC = "assets/pics/splash_small.png"
 
-  def __init__(self, events_queue: Queue, database: BeerLogDB):
+  # How often, in seconds, to redraw the screens showing the time to the second.
+  CLOCK_TICK_INTERVAL = 1.0
+  # How often, in seconds, to redraw the scoreboard once its scans are shown
+  # without the seconds.
+  SLOW_CLOCK_TICK_INTERVAL = 60.0
+  # Scans older than this are shown on the scoreboard without the seconds, see
+  # utils.GetShortLastBeer().
+  SECONDS_SCAN_AGE = datetime.timedelta(minutes=10)
+  # Scans older than this are shown on the scoreboard in days, and the clock
+  # doesn't need to tick for them.
+  RECENT_SCAN_AGE = datetime.timedelta(days=1)
+  # How often, in seconds, to check for changes made by other processes (ie: the
+  # compact or import commands) when scans go through an EntryWriter. The scans
+  # of the kiosk make the screen dirty on their own then.
+  SLOW_DATA_CHECK_INTERVAL = 60.0
+
+  def __init__(
+    self,
+    events_queue: Queue,
+    database: BeerLogDB,
+    writer: EntryWriter | None = None,
+    headless: bool = False,
+    frames_dir: str | None = None,
+  ):
     """Initializes a Display backed by luma.
 
+    Args:
+      headless(bool): whether to draw in memory, instead of on a screen.
+      frames_dir(str): the directory to save every frame of the headless
+        display to, as PNG files.
+
     Attributes:
       _events_queue(Queue): the shared queue for events.
       _database(beerlog.BeerlogDB): the application database.
+      _live_scores(EntryWriter|BeerLogDB): where to read the scores from. The
+        writer, if any, also counts the scans it didn't write yet.
       gui_object(beerlog.gui.base.BaseGUI):
         the GUI object (ie: Oled hat, Emulator, etc).
       luma_device(luma.core.device.device): The luma_device inside the
@@ -125,13 +210,20 @@ class LumaDisplay:
     """
     self._events_queue: Queue = events_queue
     self._database: BeerLogDB = database
+    self._live_scores: EntryWriter | BeerLogDB = writer or database
+    self._data_check_interval = (
+      self.SLOW_DATA_CHECK_INTERVAL if writer else database.EXTERNAL_CHANGES_CHECK_INTERVAL
+    )
     if not self._events_queue:
       raise errors.BeerLogError("Display needs an events_queue")
     if not self._database:
       raise errors.BeerLogError("Display needs a DB object")
 
+    self._headless = headless
+    self._frames_dir = frames_dir
+
     # This is the object for different implementations
-    self.gui_object: gui_base.BaseGUI
+    self.gui_object: gui_base.BaseGUI | None = None
     # This is a pointer to the luma_device, which draws stuff
     self.luma_device: sh1106 | luma_emulator
     self.machine: transitions.Machine
@@ -156,6 +248,13 @@ class LumaDisplay:
 
     self._scoreboard = Scroller()
     self._global_menu = Scroller()
+    self._replay = Replay()
+
+    # The screen is only redrawn when it's dirty.
+    self._dirty = True
+    self._last_draw = 0.0
+    self._data_version = None
+    self._last_data_check = 0.0
 
   def _LoadFont(self, font_name: str, font_size=10) -> ImageFont.ImageFont | ImageFont.FreeTypeFont:
     """Loads a font from a path.
@@ -175,14 +274,23 @@ class LumaDisplay:
 
   def _InitStateMachine(self):
     """Initializes the internal state machine."""
-    self.machine = transitions.Machine(states=list(self.STATES), initial="SPLASH", send_event=True)
+    self.machine = transitions.Machine(
+      states=list(self.STATES),
+      initial="SPLASH",
+      send_event=True,
+      after_state_change="MarkDirty",
+    )
 
     # Used to set our attributes from the Machine object
     self.machine.SetEnv = self._SetEnv  # pyright: ignore [reportAttributeAccessIssue]
+    self.machine.MarkDirty = self.MarkDirty  # pyright: ignore [reportAttributeAccessIssue]
     self.machine.IncrementScoreIndex = self._scoreboard.IncrementIndex  # pyright: ignore [reportAttributeAccessIssue]
     self.machine.DecrementScoreIndex = self._scoreboard.DecrementIndex  # pyright: ignore [reportAttributeAccessIssue]
     self.machine.IncrementGlobalMenuIndex = self._global_menu.IncrementIndex  # pyright: ignore [reportAttributeAccessIssue]
     self.machine.DecrementGlobalMenuIndex = self._global_menu.DecrementIndex  # pyright: ignore [reportAttributeAccessIssue]
+    self.machine.StartReplay = self._StartReplay  # pyright: ignore [reportAttributeAccessIssue]
+    self.machine.ReplayForward = self._replay.Forward  # pyright: ignore [reportAttributeAccessIssue]
+    self.machine.ReplayBackward = self._replay.Backward  # pyright: ignore [reportAttributeAccessIssue]
     # Transitions
     # (trigger, source, destination)
     self.machine.add_transition("back", "*", "SCORE", before="SetEnv")
@@ -207,6 +315,11 @@ class LumaDisplay:
     self.machine.add_transition("right", "GRAPH", "GRAPH")
     self.machine.add_transition("left", "GRAPH", "SCORE")
 
+    # Replay of the night
+    self.machine.add_transition("left", "SCORE", "REPLAY", after="StartReplay")
+    self.machine.add_transition("right", "REPLAY", "REPLAY", after="ReplayForward")
+    self.machine.add_transition("left", "REPLAY", "REPLAY", after="ReplayBackward")
+
     self.machine.add_transition("up", "ERROR", "SCORE")
     self.machine.add_transition("down", "ERROR", "SCORE")
     self.machine.add_transition("left", "ERROR", "SCORE")
@@ -228,10 +341,78 @@ class LumaDisplay:
     self._too_soon = event.kwargs.get("too_soon", False)
     self._last_error = event.kwargs.get("error", None)
 
+  def MarkDirty(self, unused_event=None):
+    """Marks the screen as needing a redraw.
+
+    This is also called by the transitioning state machine, after every
+    transition.
+    """
+    self._dirty = True
+
+  def _GetClockTickInterval(self) -> float | None:
+    """Returns how often the current screen changes on its own, in seconds.
+
+    Returns:
+      float: the interval, or None if the screen only changes with the data.
+    """
+    assert self.machine is not None
+    if self.machine.state == "MENUGLOBAL":
+      return self.CLOCK_TICK_INTERVAL
+    if self.machine.state == "SCORE":
+      rows = self._scoreboard.GetRows()
+      if not rows:
+        return None
+      age = datetime.datetime.now() - max(row.last for row in rows)
+      if age < self.SECONDS_SCAN_AGE:
+        return self.CLOCK_TICK_INTERVAL
+      if age < self.RECENT_SCAN_AGE:
+        return self.SLOW_CLOCK_TICK_INTERVAL
+    return None
+
+  def GetNextDeadline(self) -> float:
+    """Returns when NeedsUpdate() should next be called.
+
+    Events can make the screen dirty earlier.
+
+    Returns:
+      float: the deadline, as a time.monotonic() value.
+    """
+    deadlines = [self._last_data_check + self._data_check_interval]
+    tick_interval = self._GetClockTickInterval()
+    if tick_interval:
+      deadlines.append(self._last_draw + tick_interval)
+    if self.machine.state == "REPLAY":
+      deadlines.append(self._replay.GetNextStepTime())
+    return min(deadlines)
+
+  def NeedsUpdate(self) -> bool:
+    """Returns whether the screen needs to be redrawn.
+
+    The screen is dirty after a state transition, when the data changed, or
+    when the time it shows is out of date.
+
+    Returns:
+      bool: whether Update() should be called.
+    """
+    now = time.monotonic()
+    if now >= self._last_data_check + self._data_check_interval:
+      self._last_data_check = now
+      data_version = self._database.GetDataVersion()
+      if data_version != self._data_version:
+        self._data_version = data_version
+        self._dirty = True
+    tick_interval = self._GetClockTickInterval()
+    if tick_interval and now >= self._last_draw + tick_interval:
+      self._dirty = True
+    if self.machine.state == "REPLAY" and now >= self._replay.GetNextStepTime():
+      self._dirty = True
+    return self._dirty
+
   def Update(self):
     """Draws the display depending on the state of the StateMachine."""
-    self._scoreboard.UpdateData(self._database.GetScoreBoard())
-    self._global_menu.UpdateData(self._GetGlobalMenuRows())
+    self._dirty = False
+    self._last_draw = time.monotonic()
+    self._scoreboard.UpdateData(self._live_scores.GetScoreBoardRows())
     assert self.machine is not None
     if self.machine.state == "SPLASH":
       self.ShowSplash()
@@ -245,9 +426,27 @@ class LumaDisplay:
       else:
         self.ShowScanned()
     elif self.machine.state == "MENUGLOBAL":
+      # Only this screen shows these, and some of them run system commands.
+      self._global_menu.UpdateData(self._GetGlobalMenuRows())
       self.ShowMenuGlobal()
     elif self.machine.state == "GRAPH":
       self.ShowGraph()
+    elif self.machine.state == "REPLAY":
+      self._replay.Tick()
+      self.ShowReplay()
+
+  def _StartReplay(self, unused_event):
+    """Starts replaying the scoreboard, from the first scan of the last night.
+
+    The night stops at the start of the current session, if it started during
+    the night.
+    """
+    last = self._database.GetLatestTimestamp()
+    if not last:
+      self._replay.Start(datetime.datetime.now(), datetime.datetime.now())
+      return
+    first = self._database.GetEntriesForDay(self._database.GetDrinkingDay(last)).first()
+    self._replay.Start(max(first.timestamp, self._database.GetEarliestTimestamp()), last)
 
   def _GetGlobalMenuRows(self):
     """Builds the information to display in the global menu.
@@ -261,18 +460,38 @@ class LumaDisplay:
     last_h = datetime.datetime.now() - datetime.timedelta(hours=1)
     l_per_h = utils.GetShortAmountOfBeer(self._database.GetTotalAmount(since=last_h) / 100.0)
 
-    now = datetime.datetime.now()
-    today = datetime.datetime(now.year, now.month, now.day, 0, 0, 0)
-    first_scan_today = self._database.GetEarliestEntry(after=today)
-
     data.append(DataPoint("Time", system.GetTime()))
     data.append(DataPoint("WiFi", system.GetWifiStatus()))
     data.append(DataPoint("IP", system.GetIpAddress()))
     data.append(DataPoint("Total", total_l, "L"))
     data.append(DataPoint("Last h", l_per_h, "L/h"))
     data.append(DataPoint("Scans nb", self._database.GetEntriesCount()))
+    session = self._database.GetCurrentSession()
+    if session:
+      data.append(DataPoint("Session", session.GetDisplayName()))
+    keg = self._database.GetActiveKeg()
+    if keg:
+      keg_left_l = utils.GetShortAmountOfBeer(max(0, keg.GetRemaining()) / 100.0)
+      data.append(DataPoint("Keg left", keg_left_l, "L"))
+    data.extend(self._GetTodayMenuRows())
+    return data
+
+  def _GetTodayMenuRows(self):
+    """Builds the statistics of the current drinking day, for the global menu.
+
+    Returns:
+      list(DataPoint): the data to display
+    """
+    data = []
+    today = self._database.GetDrinkingDay(datetime.datetime.now())
+    today_cl = self._database.GetDayTotals(first_day=today, last_day=today).get(today, 0)
+    data.append(DataPoint("Today", utils.GetShortAmountOfBeer(today_cl / 100.0), "L"))
+    first_scan_today = self._database.GetEntriesForDay(today).first()
     if first_scan_today:
       data.append(DataPoint("1st today", first_scan_today.character_name))
+    tonight_scoreboard = self._database.GetTonightScoreBoard()
+    if tonight_scoreboard:
+      data.append(DataPoint("Best today", tonight_scoreboard[0].character_name))
     return data
 
   def _DrawTextRow(
@@ -359,8 +578,8 @@ class LumaDisplay:
     """
     all_achievements = []
 
-    total_drunk = self._database.GetAmountFromName(name)
-    glass = self._database.GetGlassFromName(name)
+    total_drunk = self._live_scores.GetAmountFromName(name)
+    glass = self._live_scores.GetGlassFromName(name)
 
     prev_total_drunk = total_drunk - glass
 
@@ -430,19 +649,37 @@ class LumaDisplay:
     _font = ImageFont.truetype("assets/fonts/NotoEmoji-Regular.ttf", 28)
     text_layer.text((4, 4), achievement.emoji, (255, 255, 255), font=_font)
 
-    regulator = framerate_regulator(fps=5)
+    regulator = self._GetFrameRegulator(fps=5)
     for _ in range(15):  # 15 frames at 5fps
       with regulator:
         self.luma_device.display(background.convert(self.luma_device.mode))
 
+  def _ThrottlesAnimations(self) -> bool:
+    """Returns whether animations play at their frame rate. Headless GUIs
+    draw them as fast as possible."""
+    return self.gui_object is None or self.gui_object.throttle_animations
+
+  def _GetFrameRegulator(self, fps: float) -> framerate_regulator:
+    """Returns the regulator to play an animation at its frame rate.
+
+    Args:
+      fps(float): the frame rate of the animation.
+    Returns:
+      framerate_regulator: the regulator, which doesn't wait between the frames
+        if the GUI doesn't throttle animations.
+    """
+    if not self._ThrottlesAnimations():
+      fps = 0
+    return framerate_regulator(fps=fps)
+
   def _ShowDefaultScan(self, name):
     """Show the default scan animation"""
     size = [min(*self.luma_device.size)] * 2
     posn = ((self.luma_device.width - size[0]) // 2, self.luma_device.height - size[1])
-    regulator = framerate_regulator(fps=30)
+    regulator = self._GetFrameRegulator(fps=30)
     image = Image.open(DEFAULT_SCAN_GIF)
 
-    total_drunk = self._database.GetAmountFromName(name)
+    total_drunk = self._live_scores.GetAmountFromName(name)
 
     default_msg = "Cheers " + name + "!"
     default_msg += " {0:s}L".format(utils.GetShortAmountOfBeer(total_drunk / 100.0))
@@ -503,6 +740,30 @@ class LumaDisplay:
         text += f" {utils.GetShortLastBeer(row.last)}"
         self._DrawTextRow(drawer, text, draw_row, selected=selected)
 
+  def _GetReplayRows(self) -> list[beerlogdb.ScoreBoardRow]:
+    """Returns the scoreboard of the replayed night, at the replayed time."""
+    return self._database.GetScoreBoardAt(self._replay.current, since=self._replay.start)
+
+  def ShowReplay(self):
+    """Draws the Scoreboard as it was at the replayed time."""
+    assert self.luma_device is not None
+    current = self._replay.current
+    with canvas(self.luma_device) as drawer:
+      max_name_length = self._max_cols - (3 + 1 + 4 + 1 + 4 + 3)
+      # The replayed time replaces the "Name" header.
+      header = " " * 3 + f"{current:%H:%M}".ljust(max_name_length) + "    L Last"
+      drawer.text((0, 0), header, fill="white", font=self._font)
+      rows = self._GetReplayRows()[: self._max_rows - 1]
+      for position, row in enumerate(rows, start=1):
+        text = f"{position:>2} "
+        if len(row.character_name) <= max_name_length:
+          text += f"{row.character_name:<{max_name_length}}"
+        else:
+          text += self._Truncate(row.character_name, max_name_length)
+        text += f" {utils.GetShortAmountOfBeer(row.total / 100.0)}"
+        text += f" {utils.GetShortLastBeer(row.last, now=current)}"
+        self._DrawTextRow(drawer, text, position)
+
   def ShowSplash(self):
     """Displays the splash screen."""
     background = Image.new(self.luma_device.mode, self.luma_device.size)
@@ -510,7 +771,8 @@ class LumaDisplay:
     posn = ((self.luma_device.width - splash.width) // 2, 0)
     background.paste(splash, posn)
     self.luma_device.display(background)
-    time.sleep(1)
+    if self._ThrottlesAnimations():
+      time.sleep(1)
     self.machine.back()
     self.Update()
 
@@ -526,9 +788,9 @@ class LumaDisplay:
     fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
     plt.figtext(0.5, 0.2, self._current_character_name, color="w", fontsize="large")
 
-    point_data = self._database.GetDataFromName(self._current_character_name)
+    cumulative = self._database.GetCumulativeTotalsFromName(self._current_character_name)
 
-    ax.plot([e.timestamp for e in point_data], [e.sum for e in point_data], "w")
+    ax.plot(cumulative.timestamps, cumulative.totals, "w")
     ax.set_frame_on(False)
 
     buf = io.BytesIO()
@@ -547,7 +809,11 @@ class LumaDisplay:
     except IOError:
       pass
 
-    if is_rpi:
+    if self._headless:
+      from beerlog.gui import headless  # pylint: disable=import-outside-toplevel
+
+      self.gui_object = headless.Headless(self._events_queue, frames_dir=self._frames_dir)
+    elif is_rpi:
       from beerlog.gui import sh1106  # pylint: disable=import-outside-toplevel
 
       self.gui_object = sh1106.WaveShareOLEDHat(self._events_queue)
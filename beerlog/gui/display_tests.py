@@ -1,10 +1,14 @@
 """Tests for display.py"""
 
+import datetime
 import multiprocessing
 import os
+import tempfile
+import time
 import unittest
 
 from beerlog import beerlogdb
+from beerlog import writer
 from beerlog.gui import achievements
 from beerlog.gui import display
 
@@ -38,7 +42,7 @@ class DisplayTests(unittest.TestCase):
     d = display.LumaDisplay(events_queue=events_queue, database=self.db)
 
     self.db.AddEntry("0x0", "pic")
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     a = d.GetAchievements("toto")
     self.assertEqual(len(a), 1)
     self.assertIsInstance(a[0], achievements.FirstBeerAchievement)
@@ -46,23 +50,23 @@ class DisplayTests(unittest.TestCase):
 
     self.db.AddEntry("0x2", "pic")
     self.db.AddEntry("0x3", "pic")
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     self.db.AddEntry("0x3", "pic")
     self.db.AddEntry("0x3", "pic")
     # 'tata' beats 'tutu'
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     a = d.GetAchievements("tata")
     self.assertEqual(a[0].message, "YOU HAVE TAKEN THE LEAD !!!")
 
     self.db.AddEntry("0x0", "pic")
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     a = d.GetAchievements("toto")
     self.assertEqual(a[0].message, "Congrats on taking rank 2!")
 
     self.db.AddEntry("0x0", "pic")
     self.db.AddEntry("0x0", "pic")
     # Toto takes lead and gets more than 1L
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     a = d.GetAchievements("toto")
     self.assertEqual(a[0].message, "YOU HAVE TAKEN THE LEAD !!!")
     self.assertEqual(a[1].message, "Congrats on passing 1L toto!")
@@ -70,13 +74,169 @@ class DisplayTests(unittest.TestCase):
     # Go just over 5L
     for _ in range(12):
       self.db.AddEntry("0x0", "pic")
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     a = d.GetAchievements("toto")
     self.assertEqual(a[0].message, "Congrats on passing 5L toto!")
 
     self.db.AddEntry("0x5", "pic")
     a = d.GetAchievements("tyty")
-    d._scoreboard.UpdateData(self.db.GetScoreBoard())
+    d._scoreboard.UpdateData(self.db.GetScoreBoardRows())
     self.assertEqual(len(a), 2)
     self.assertEqual(a[0].message, "First beer, enjoy the game tyty!")
     self.assertEqual(a[1].message, "Congrats on passing 1L tyty!")
+
+  def testDirtyFlag(self):
+    """Tests that the screen is only redrawn when something changed."""
+    d = display.LumaDisplay(events_queue=multiprocessing.Queue(), database=self.db, headless=True)
+    d.Setup()
+    d.machine.back()
+
+    self.assertTrue(d.NeedsUpdate())
+    d.Update()
+    self.assertFalse(d.NeedsUpdate())
+    # Nothing on an empty scoreboard changes with time.
+    self.assertIsNone(d._GetClockTickInterval())
+
+    # New scans are noticed at the next data check.
+    self.db.AddEntry("0x0", "pic", time=datetime.datetime.now())
+    self.assertFalse(d.NeedsUpdate())
+    d._last_data_check -= self.db.EXTERNAL_CHANGES_CHECK_INTERVAL
+    self.assertTrue(d.NeedsUpdate())
+    d.Update()
+    self.assertFalse(d.NeedsUpdate())
+    # The time since the last scan is shown to the second.
+    self.assertEqual(d.CLOCK_TICK_INTERVAL, d._GetClockTickInterval())
+    self.assertLessEqual(d.GetNextDeadline(), d._last_draw + d.CLOCK_TICK_INTERVAL)
+    d._last_draw -= d.CLOCK_TICK_INTERVAL
+    self.assertTrue(d.NeedsUpdate())
+    d.Update()
+
+    # Then to the minute, and not at all once it's shown in days.
+    d._scoreboard.UpdateData(
+      [row._replace(last=row.last - d.SECONDS_SCAN_AGE) for row in d._scoreboard.data]
+    )
+    self.assertEqual(d.SLOW_CLOCK_TICK_INTERVAL, d._GetClockTickInterval())
+    d._scoreboard.UpdateData(
+      [row._replace(last=row.last - d.RECENT_SCAN_AGE) for row in d._scoreboard.data]
+    )
+    self.assertIsNone(d._GetClockTickInterval())
+
+    # Transitions make the screen dirty.
+    d.machine.down()
+    self.assertTrue(d.NeedsUpdate())
+    d.machine.right()
+    self.assertEqual("GRAPH", d.machine.state)
+    self.assertIsNone(d._GetClockTickInterval())
+
+  def testTodayMenuRows(self):
+    """Tests the statistics of the current drinking day in the global menu."""
+    now = datetime.datetime.now()
+    self.db.AddEntry("0x5", "pic", time=now - datetime.timedelta(days=2))
+    self.db.AddEntry("0x0", "pic", time=now)
+    self.db.AddEntry("0x2", "pic", time=now)
+    d = display.LumaDisplay(events_queue=multiprocessing.Queue(), database=self.db, headless=True)
+    self.assertEqual(
+      [
+        display.DataPoint("Today", "0.83", "L"),
+        display.DataPoint("1st today", "toto"),
+        display.DataPoint("Best today", "tutu"),
+      ],
+      d._GetTodayMenuRows(),
+    )
+
+  def testReplay(self):
+    """Tests that the replay only shows the scans of the last night."""
+    self.db.AddEntry("0x3", "pic", time=datetime.datetime(2019, 1, 1, 21, 0))
+    self.db.AddEntry("0x0", "pic", time=datetime.datetime(2019, 1, 1, 22, 0))
+    self.db.AddEntry("0x0", "pic", time=datetime.datetime(2019, 1, 2, 21, 0))
+    self.db.AddEntry("0x2", "pic", time=datetime.datetime(2019, 1, 2, 22, 0))
+    d = display.LumaDisplay(events_queue=multiprocessing.Queue(), database=self.db, headless=True)
+    d.Setup()
+    d.machine.back()
+    d.machine.left()
+    self.assertEqual("REPLAY", d.machine.state)
+    self.assertEqual(datetime.datetime(2019, 1, 2, 21, 0), d._replay.start)
+
+    frames = []
+    while True:
+      frames.append([(row.character_name, row.total) for row in d._GetReplayRows()])
+      if d._replay.current == d._replay.end:
+        break
+      d._replay.Forward(None)
+    self.assertEqual([("toto", 33)], frames[0])
+    self.assertEqual([("tutu", 50), ("toto", 33)], frames[-1])
+    for rows in frames:
+      self.assertNotIn("tata", [name for name, _ in rows])
+
+  def testIdleWithWriter(self):
+    """Tests that a static screen doesn't poll the database while scans go
+    through an EntryWriter."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+      db = beerlogdb.BeerLogDB(os.path.join(temp_dir, "beerlog.sqlite"))
+      db.known_tags_list = self.db.known_tags_list
+      entry_writer = writer.EntryWriter(db)
+      d = display.LumaDisplay(
+        events_queue=multiprocessing.Queue(), database=db, writer=entry_writer, headless=True
+      )
+      d.Setup()
+      d.machine.back()
+      d.machine.down()
+      d.machine.right()
+      self.assertEqual("GRAPH", d.machine.state)
+      self.assertTrue(d.NeedsUpdate())
+      d.Update()
+      self.assertFalse(d.NeedsUpdate())
+      self.assertGreaterEqual(
+        d.GetNextDeadline(), time.monotonic() + d.SLOW_DATA_CHECK_INTERVAL - 1
+      )
+
+      # Pending scans show up with the next transition.
+      entry_writer.AddEntry("0x0")
+      d.machine.back()
+      self.assertTrue(d.NeedsUpdate())
+      d.Update()
+      self.assertEqual(
+        [("toto", 33)], [(r.character_name, r.total) for r in d._scoreboard.GetRows()]
+      )
+      db.Close()
+
+  def testHeadless(self):
+    """Tests rendering the screens on the headless display."""
+    self.db.AddEntry("0x0", "pic", time=datetime.datetime.now() - datetime.timedelta(hours=1))
+    self.db.AddEntry("0x2", "pic", time=datetime.datetime.now())
+    with tempfile.TemporaryDirectory() as frames_dir:
+      d = display.LumaDisplay(
+        events_queue=multiprocessing.Queue(),
+        database=self.db,
+        headless=True,
+        frames_dir=frames_dir,
+      )
+      d.Setup()
+      device = d.gui_object.GetDevice()
+
+      start = time.monotonic()
+      # The splash screen goes to the scoreboard on its own.
+      d.Update()
+      self.assertEqual("SCORE", d.machine.state)
+      d.machine.scan(who="toto", too_soon=False)
+      d.Update()
+      # Animations don't wait between their frames.
+      self.assertLess(time.monotonic() - start, 2)
+      for transition, kwargs in [
+        ("scan", {"who": "toto", "too_soon": True}),
+        ("error", {"error": "Unknown tag"}),
+        ("back", {}),
+        ("right", {}),
+        ("menu2", {}),
+        ("left", {}),
+      ]:
+        getattr(d.machine, transition)(**kwargs)
+        d.Update()
+      self.assertEqual("REPLAY", d.machine.state)
+
+      self.assertGreater(device.frame_count, 8)
+      self.assertEqual(
+        [os.path.basename(device.GetFramePath(i)) for i in range(1, device.frame_count + 1)],
+        sorted(os.listdir(frames_dir)),
+      )
+      self.assertEqual((128, 64), device.image.size)
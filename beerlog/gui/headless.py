@@ -0,0 +1,84 @@
+"""Module for a headless display, which only draws in memory"""
+
+import os
+
+from luma.core.device import dummy
+
+from beerlog.gui import base as gui_base
+
+
+class FrameDumpDevice(dummy):
+  """Luma device keeping the last frame in memory, and optionally saving every
+  frame as a PNG file.
+
+  Attributes:
+    frames_dir(str): the directory to save the frames to, if any.
+    frame_count(int): the number of frames displayed so far.
+  """
+
+  def __init__(self, frames_dir: str | None = None, width=128, height=64, mode="1"):
+    """Initializes a FrameDumpDevice.
+
+    Args:
+      frames_dir(str): the directory to save the frames to, if any.
+      width(int): the width of the screen, in pixels.
+      height(int): the height of the screen, in pixels.
+      mode(str): the PIL image mode of the screen.
+    """
+    super().__init__(width=width, height=height, mode=mode)
+    self.frames_dir = frames_dir
+    self.frame_count = 0
+
+  def GetFramePath(self, frame_number: int) -> str:
+    """Returns the path a frame is saved to.
+
+    Args:
+      frame_number(int): the number of the frame, starting at 1.
+    Returns:
+      str: the path to the PNG file.
+    """
+    return os.path.join(self.frames_dir or "", "frame-{0:06d}.png".format(frame_number))
+
+  def display(self, image):  # pylint: disable=invalid-name
+    """Displays a frame.
+
+    Args:
+      image(PIL.Image.Image): the frame.
+    """
+    super().display(image)
+    self.frame_count += 1
+    if self.frames_dir:
+      self.image.save(self.GetFramePath(self.frame_count))
+
+
+class Headless(gui_base.BaseGUI):
+  """Implements a GUI without any screen or buttons, ie: for benchmarks and tests.
+
+  It has the size and colors of the WaveShare OLED hat. Animations don't wait
+  between their frames.
+  """
+
+  WIDTH = 128
+  HEIGHT = 64
+
+  def __init__(self, queue, frames_dir: str | None = None):
+    """Initializes a Headless object.
+
+    Args:
+      queue(Queue): the shared events queue.
+      frames_dir(str): the directory to save every frame to, as PNG files.
+    """
+    super().__init__(queue)
+    self.throttle_animations = False
+    self._frames_dir = frames_dir
+
+  def Setup(self):
+    """Sets up the device."""
+    if self._frames_dir:
+      os.makedirs(self._frames_dir, exist_ok=True)
+    self._device = FrameDumpDevice(
+      frames_dir=self._frames_dir, width=self.WIDTH, height=self.HEIGHT
+    )
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
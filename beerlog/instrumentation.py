@@ -0,0 +1,280 @@
+"""Optional profiling of the database queries and methods."""
+
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+
+class Histogram:
+  """Latency histogram, with fixed buckets so that dumps can be compared."""
+
+  # Upper bounds of the buckets, in milliseconds. The last bucket has no bound.
+  BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+  def __init__(self):
+    self.buckets = [0] * (len(self.BOUNDS_MS) + 1)
+    self.count = 0
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+
+  def Add(self, duration_ms: float):
+    """Records one measure.
+
+    Args:
+      duration_ms(float): the duration, in milliseconds.
+    """
+    index = 0
+    while index < len(self.BOUNDS_MS) and duration_ms > self.BOUNDS_MS[index]:
+      index += 1
+    self.buckets[index] += 1
+    self.count += 1
+    self.total_ms += duration_ms
+    self.max_ms = max(self.max_ms, duration_ms)
+
+  def GetPercentile(self, percentile: float) -> float | None:
+    """Returns an upper bound of a percentile.
+
+    Args:
+      percentile(float): the percentile, between 0 and 1.
+    Returns:
+      float: the upper bound of the bucket holding the percentile, in
+        milliseconds, or None if there are no measures.
+    """
+    if not self.count:
+      return None
+    seen = 0
+    for index, count in enumerate(self.buckets):
+      seen += count
+      if seen >= percentile * self.count:
+        return self.BOUNDS_MS[index] if index < len(self.BOUNDS_MS) else round(self.max_ms, 3)
+    return round(self.max_ms, 3)
+
+  def GetStats(self) -> dict:
+    """Returns the histogram as a dict."""
+    labels = ["<={0:g}ms".format(bound) for bound in self.BOUNDS_MS]
+    labels.append(">{0:g}ms".format(self.BOUNDS_MS[-1]))
+    return {
+      "count": self.count,
+      "total_ms": round(self.total_ms, 3),
+      "max_ms": round(self.max_ms, 3),
+      "buckets": dict(zip(labels, self.buckets)),
+    }
+
+
+class _CallStats:
+  """Statistics for one method or operation."""
+
+  def __init__(self):
+    self.latency = Histogram()
+    self.queries = 0
+    self.max_queries = 0
+
+  def Add(self, duration_ms: float, queries: int):
+    """Records one call.
+
+    Args:
+      duration_ms(float): the duration of the call, in milliseconds.
+      queries(int): the number of SQL queries the call issued.
+    """
+    self.latency.Add(duration_ms)
+    self.queries += queries
+    self.max_queries = max(self.max_queries, queries)
+
+  def GetStats(self) -> dict:
+    """Returns the statistics as a dict."""
+    count = self.latency.count
+    return {
+      "calls": count,
+      "queries": self.queries,
+      "queries_per_call": round(self.queries / count, 3) if count else 0.0,
+      "max_queries": self.max_queries,
+      "latency": self.latency.GetStats(),
+    }
+
+
+class Profiler:
+  """Counts the SQL queries, and times the methods and logical operations.
+
+  Operations are the units of work of the application, ie: drawing a frame,
+  handling an event, or serving a web request. Queries and calls are
+  attributed to the operations running in the same thread.
+  """
+
+  def __init__(self, dump_path: str | None = None, report_interval: float = 60.0):
+    """Initializes a Profiler.
+
+    Args:
+      dump_path(str): optional path of the JSON file where Report() writes the
+        statistics.
+      report_interval(float): how often, in seconds, MaybeReport() reports.
+    """
+    self.dump_path = dump_path
+    self.report_interval = report_interval
+    self._last_report = time.monotonic()
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._sql = Histogram()
+    self._methods = {}
+    self._operations = {}
+
+  def _GetQueryCount(self) -> int:
+    """Returns the number of queries issued so far by the current thread."""
+    return getattr(self._local, "queries", 0)
+
+  def _Record(self, stats: dict, name: str, start: float, queries_before: int):
+    """Records a call that just ended.
+
+    Args:
+      stats(dict): the statistics to update, per name.
+      name(str): the name of the method or operation.
+      start(float): the perf_counter() value when the call started.
+      queries_before(int): the query count of the thread when the call started.
+    """
+    duration_ms = (time.perf_counter() - start) * 1000
+    queries = self._GetQueryCount() - queries_before
+    with self._lock:
+      stats.setdefault(name, _CallStats()).Add(duration_ms, queries)
+
+  def InstrumentDatabase(self, database):
+    """Counts and times every SQL statement a peewee database executes.
+
+    Args:
+      database(peewee.Database): the database.
+    """
+    execute_sql = database.execute_sql
+
+    @functools.wraps(execute_sql)
+    def Wrapper(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return execute_sql(*args, **kwargs)
+      finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        self._local.queries = self._GetQueryCount() + 1
+        with self._lock:
+          self._sql.Add(duration_ms)
+
+    database.execute_sql = Wrapper
+
+  def InstrumentObject(self, instance, name: str):
+    """Times the calls to the public methods of an object.
+
+    Args:
+      instance(object): the object, ie: a BeerLogDB.
+      name(str): the prefix for the method names in the statistics.
+    """
+    for attribute in dir(type(instance)):
+      if attribute.startswith("_"):
+        continue
+      method = getattr(instance, attribute)
+      if callable(method) and not isinstance(method, type):
+        setattr(
+          instance, attribute, self._WrapMethod("{0:s}.{1:s}".format(name, attribute), method)
+        )
+
+  def _WrapMethod(self, name: str, method):
+    """Wraps a method to time its calls.
+
+    Args:
+      name(str): the name of the method in the statistics.
+      method(callable): the bound method.
+    Returns:
+      callable: the wrapper.
+    """
+
+    @functools.wraps(method)
+    def Wrapper(*args, **kwargs):
+      start = time.perf_counter()
+      queries_before = self._GetQueryCount()
+      try:
+        return method(*args, **kwargs)
+      finally:
+        self._Record(self._methods, name, start, queries_before)
+
+    return Wrapper
+
+  @contextlib.contextmanager
+  def Operation(self, name: str):
+    """Context manager measuring one logical operation.
+
+    Args:
+      name(str): the name of the operation, ie: "frame".
+    """
+    start = time.perf_counter()
+    queries_before = self._GetQueryCount()
+    try:
+      yield
+    finally:
+      self._Record(self._operations, name, start, queries_before)
+
+  def GetStats(self) -> dict:
+    """Returns all the statistics, as a JSON serializable dict."""
+    with self._lock:
+      return {
+        "sql": self._sql.GetStats(),
+        "operations": {name: s.GetStats() for name, s in sorted(self._operations.items())},
+        "methods": {name: s.GetStats() for name, s in sorted(self._methods.items())},
+      }
+
+  def FormatSummary(self, top: int = 5) -> str:
+    """Returns a human readable summary of the statistics.
+
+    Args:
+      top(int): the number of slowest methods to list.
+    Returns:
+      str: the summary.
+    """
+    with self._lock:
+      lines = [
+        "SQL: {0:d} queries, {1:.1f}ms total, p95 <= {2!s}ms".format(
+          self._sql.count, self._sql.total_ms, self._sql.GetPercentile(0.95)
+        )
+      ]
+      for name, stats in sorted(self._operations.items()):
+        lines.append(
+          "Operation {0:s}: {1:d} calls, {2:.1f} queries/call (max {3:d}), "
+          "p50 <= {4!s}ms, p95 <= {5!s}ms, max {6:.1f}ms".format(
+            name,
+            stats.latency.count,
+            stats.queries / stats.latency.count,
+            stats.max_queries,
+            stats.latency.GetPercentile(0.5),
+            stats.latency.GetPercentile(0.95),
+            stats.latency.max_ms,
+          )
+        )
+      slowest = sorted(self._methods.items(), key=lambda item: -item[1].latency.total_ms)
+      for name, stats in slowest[:top]:
+        lines.append(
+          "Method {0:s}: {1:d} calls, {2:.1f}ms total, {3:d} queries".format(
+            name, stats.latency.count, stats.latency.total_ms, stats.queries
+          )
+        )
+    return "\n".join(lines)
+
+  def Dump(self, path: str):
+    """Writes the statistics to a JSON file.
+
+    Args:
+      path(str): the path to the file.
+    """
+    with open(path, "w") as dump_file:
+      json.dump(self.GetStats(), dump_file, indent=2, sort_keys=True)
+
+  def Report(self):
+    """Logs the summary, and writes the statistics to dump_path if set."""
+    self._last_report = time.monotonic()
+    logging.debug("Profile summary:\n{0:s}".format(self.FormatSummary()))
+    if self.dump_path:
+      self.Dump(self.dump_path)
+
+  def MaybeReport(self):
+    """Reports, if report_interval seconds passed since the last report."""
+    if time.monotonic() - self._last_report >= self.report_interval:
+      self.Report()
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
@@ -0,0 +1,70 @@
+"""Tests for the instrumentation module"""
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from beerlog import beerlogdb
+from beerlog import instrumentation
+
+
+class HistogramTests(unittest.TestCase):
+  """Tests for the Histogram class."""
+
+  def testHistogram(self):
+    """Tests recording durations."""
+    histogram = instrumentation.Histogram()
+    self.assertIsNone(histogram.GetPercentile(0.5))
+    for duration_ms in [0.05, 0.3, 0.4, 0.9, 4000]:
+      histogram.Add(duration_ms)
+    stats = histogram.GetStats()
+    self.assertEqual(5, stats["count"])
+    self.assertEqual(4000, stats["max_ms"])
+    self.assertEqual(1, stats["buckets"]["<=0.1ms"])
+    self.assertEqual(2, stats["buckets"]["<=0.5ms"])
+    self.assertEqual(1, stats["buckets"][">1000ms"])
+    self.assertEqual(0.5, histogram.GetPercentile(0.5))
+    self.assertEqual(4000, histogram.GetPercentile(1))
+
+
+class ProfilerTests(unittest.TestCase):
+  """Tests for the Profiler class."""
+
+  def setUp(self):
+    self.db = beerlogdb.BeerLogDB(":memory:")
+    self.db.known_tags_list = {"0x0": {"name": "toto", "glass": 33}}
+    self.profiler = instrumentation.Profiler()
+    self.profiler.InstrumentDatabase(self.db.database)
+    self.profiler.InstrumentObject(self.db, "BeerLogDB")
+
+  def testOperations(self):
+    """Tests counting queries per operation and per method."""
+    self.db.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 14, 0))
+    with self.profiler.Operation("frame"):
+      self.db.GetScoreBoard()
+    # The second frame is served from the cache.
+    with self.profiler.Operation("frame"):
+      self.db.GetScoreBoard()
+
+    stats = self.profiler.GetStats()
+    frame = stats["operations"]["frame"]
+    self.assertEqual(2, frame["calls"])
+    self.assertGreater(frame["queries"], 0)
+    self.assertEqual(frame["queries"], frame["max_queries"])
+    self.assertEqual(2, stats["methods"]["BeerLogDB.GetScoreBoard"]["calls"])
+    self.assertEqual(frame["queries"], stats["methods"]["BeerLogDB.GetScoreBoard"]["queries"])
+    self.assertEqual(1, stats["methods"]["BeerLogDB.AddEntry"]["calls"])
+    self.assertGreaterEqual(stats["sql"]["count"], frame["queries"])
+    self.assertIn("Operation frame: 2 calls", self.profiler.FormatSummary())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      dump_path = os.path.join(temp_dir, "profile.json")
+      self.profiler.Dump(dump_path)
+      with open(dump_path, "r") as dump_file:
+        self.assertEqual(stats, json.load(dump_file))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,227 @@
+"""Records the events of the kiosk, and replays them."""
+
+import datetime
+import json
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from typing import TextIO
+
+from beerlog import constants
+from beerlog import errors
+from beerlog import events
+from beerlog.bnfc import base as nfc_base
+
+
+def EventToDict(event: events.BaseEvent) -> dict:
+  """Converts an event to a JSON serializable dict.
+
+  Args:
+    event(events.BaseEvent): the event.
+  Returns:
+    dict: the event.
+  """
+  result = {
+    "timestamp": event.timestamp.isoformat(),
+    "type": constants.EVENTTYPES[event.type],
+    "internal": event.internal,
+  }
+  if event.type == constants.EVENTTYPES.NFCSCANNED:
+    result["uid"] = event.uid
+  elif event.type == constants.EVENTTYPES.ERROR:
+    result["message"] = event.message
+  return result
+
+
+def EventFromDict(event_dict: dict) -> events.BaseEvent:
+  """Builds an event from a dict made by EventToDict.
+
+  Args:
+    event_dict(dict): the event.
+  Returns:
+    events.BaseEvent: the event.
+  Raises:
+    errors.BeerLogError: if the dict is not a valid event.
+  """
+  try:
+    event_type = constants.EVENTTYPES.index(event_dict["type"])
+    if event_type == constants.EVENTTYPES.NFCSCANNED:
+      event = nfc_base.NFCEvent(uid=event_dict["uid"])
+    elif event_type == constants.EVENTTYPES.ERROR:
+      event = events.ErrorEvent(event_dict["message"])
+    elif event_type == constants.EVENTTYPES.NOEVENT:
+      event = events.NopEvent()
+    else:
+      event = events.UIEvent(event_type)
+    event.timestamp = datetime.datetime.fromisoformat(event_dict["timestamp"])
+  except (KeyError, TypeError, ValueError) as e:
+    raise errors.BeerLogError("Invalid event {0!s}: {1!s}".format(event_dict, e))
+  event.internal = bool(event_dict.get("internal", False))
+  return event
+
+
+def ReadEvents(input_file: TextIO) -> Iterator[events.BaseEvent]:
+  """Reads recorded events, one at a time, from a JSON Lines file.
+
+  Args:
+    input_file(file): the opened file.
+  Yields:
+    events.BaseEvent: an event.
+  Raises:
+    errors.BeerLogError: if the file can't be parsed.
+  """
+  for line_number, line in enumerate(input_file, start=1):
+    line = line.strip()
+    if not line:
+      continue
+    try:
+      event_dict = json.loads(line)
+    except ValueError as e:
+      raise errors.BeerLogError("Invalid JSON at line {0:d}: {1!s}".format(line_number, e))
+    yield EventFromDict(event_dict)
+
+
+class EventRecorder:
+  """Writes the events to a JSON Lines file, as they are handled.
+
+  It's a context manager: the file is open inside the 'with' block.
+  """
+
+  def __init__(self, path: str):
+    """Initializes an EventRecorder.
+
+    Args:
+      path(str): the file to append the events to.
+    """
+    self._path = path
+    self._lock = threading.Lock()
+    self._output_file: TextIO | None = None
+
+  def __enter__(self):
+    with self._lock:
+      self._output_file = open(self._path, "a", encoding="utf-8")
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.Close()
+
+  def Record(self, event: events.BaseEvent):
+    """Writes an event.
+
+    Args:
+      event(events.BaseEvent): the event.
+    """
+    line = json.dumps(EventToDict(event))
+    with self._lock:
+      if not self._output_file:
+        raise errors.BeerLogError("The recording file {0:s} is not open".format(self._path))
+      self._output_file.write(line + "\n")
+      # So the recording survives a crash, or a power cut.
+      self._output_file.flush()
+
+  def Close(self):
+    """Closes the file, if it's open."""
+    with self._lock:
+      if self._output_file:
+        self._output_file.close()
+        self._output_file = None
+
+
+class VirtualClock:
+  """A clock running N times faster than the real one.
+
+  Attributes:
+    speed(float): how many virtual seconds pass in one real second.
+  """
+
+  def __init__(self, start: datetime.datetime, speed: float = 1.0, clock=time.monotonic):
+    """Initializes a VirtualClock.
+
+    Args:
+      start(datetime.datetime): the virtual time, now.
+      speed(float): how many virtual seconds pass in one real second.
+      clock(callable): returns the real time, in seconds.
+    """
+    if speed <= 0:
+      raise errors.BeerLogError("The speed needs to be positive, got {0!s}".format(speed))
+    self.speed = speed
+    self._start = start
+    self._clock = clock
+    self._real_start = clock()
+
+  def Now(self) -> datetime.datetime:
+    """Returns the virtual time.
+
+    Returns:
+      datetime.datetime: the virtual time.
+    """
+    elapsed = (self._clock() - self._real_start) * self.speed
+    return self._start + datetime.timedelta(seconds=elapsed)
+
+  def GetRealDelay(self, seconds: float) -> float:
+    """Converts a virtual delay to a real one.
+
+    Args:
+      seconds(float): the virtual delay, in seconds.
+    Returns:
+      float: the real delay, in seconds.
+    """
+    return seconds / self.speed
+
+
+class EventReplayer:
+  """Pushes recorded events back at their time on a VirtualClock.
+
+  The internal events (ie: the delayed events) are skipped, as the kiosk
+  generates them again.
+
+  Attributes:
+    clock(VirtualClock): the virtual clock, starting at the first event.
+    replayed(int): the number of events pushed so far.
+  """
+
+  def __init__(self, recorded_events: list, push, speed: float = 1.0, done_callback=None):
+    """Initializes an EventReplayer.
+
+    Args:
+      recorded_events(list[events.BaseEvent]): the events, in order.
+      push(callable): called with each event, when it's due.
+      speed(float): how many times faster than the recording to go.
+      done_callback(callable): called once all the events are pushed.
+    """
+    self._events = [event for event in recorded_events if not event.internal]
+    self._push = push
+    self._done_callback = done_callback
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._Run, name="EventReplayer", daemon=True)
+    self._start = self._events[0].timestamp if self._events else datetime.datetime.now()
+    self.clock = VirtualClock(self._start, speed=speed)
+    self.replayed = 0
+
+  def Start(self):
+    """Starts pushing the events, from a thread. The virtual clock starts
+    again at the first event."""
+    self.clock = VirtualClock(self._start, speed=self.clock.speed)
+    self._thread.start()
+
+  def Stop(self):
+    """Stops pushing the events."""
+    self._stop.set()
+    if self._thread.is_alive():
+      self._thread.join()
+
+  def _Run(self):
+    """Pushes the events when they're due."""
+    for event in self._events:
+      delay = (event.timestamp - self.clock.Now()).total_seconds()
+      if self._stop.wait(max(0.0, self.clock.GetRealDelay(delay))):
+        return
+      self._push(event)
+      self.replayed += 1
+    logging.info("Replayed {0:d} events".format(self.replayed))
+    if self._done_callback:
+      self._done_callback()
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
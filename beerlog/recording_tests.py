@@ -0,0 +1,102 @@
+"""Tests for the recording module"""
+
+import datetime
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from beerlog import constants
+from beerlog import errors
+from beerlog import events
+from beerlog import recording
+from beerlog.bnfc import base as nfc_base
+
+
+class RecordingTests(unittest.TestCase):
+  """Tests for recording and reading events."""
+
+  def testRoundTrip(self):
+    """Tests that recorded events are read back the same."""
+    scan = nfc_base.NFCEvent(uid="0x0")
+    scan.timestamp = datetime.datetime(2019, 1, 1, 20, 0)
+    error = events.ErrorEvent("Unknown tag")
+    error.timestamp = datetime.datetime(2019, 1, 1, 20, 0, 1)
+    escape = events.UIEvent(constants.EVENTTYPES.ESCAPE)
+    escape.timestamp = datetime.datetime(2019, 1, 1, 20, 0, 2, 500)
+    escape.internal = True
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      path = os.path.join(temp_dir, "events.jsonl")
+      with recording.EventRecorder(path) as recorder:
+        for event in [scan, error, escape]:
+          recorder.Record(event)
+      with self.assertRaises(errors.BeerLogError):
+        recorder.Record(scan)
+      with open(path, "r", encoding="utf-8") as input_file:
+        read_events = list(recording.ReadEvents(input_file))
+
+    self.assertEqual(
+      [recording.EventToDict(event) for event in [scan, error, escape]],
+      [recording.EventToDict(event) for event in read_events],
+    )
+    self.assertIsInstance(read_events[0], nfc_base.NFCEvent)
+    self.assertEqual("0x0", read_events[0].uid)
+    self.assertEqual("Unknown tag", read_events[1].message)
+    self.assertTrue(read_events[2].internal)
+
+  def testReadErrors(self):
+    """Tests that invalid recordings raise BeerLogError."""
+    with self.assertRaises(errors.BeerLogError):
+      list(recording.ReadEvents(io.StringIO("\n{not json}\n")))
+    with self.assertRaises(errors.BeerLogError):
+      list(recording.ReadEvents(io.StringIO('{"type": "KEYUP"}\n')))
+    with self.assertRaises(errors.BeerLogError):
+      list(recording.ReadEvents(io.StringIO('{"type": "DANCE", "timestamp": "2019-01-01"}\n')))
+
+
+class VirtualClockTests(unittest.TestCase):
+  """Tests for the VirtualClock class."""
+
+  def testSpeed(self):
+    """Tests that virtual time goes N times faster."""
+    now = [10.0]
+    start = datetime.datetime(2019, 1, 1, 20, 0)
+    clock = recording.VirtualClock(start, speed=60, clock=lambda: now[0])
+    self.assertEqual(start, clock.Now())
+    now[0] = 11.0
+    self.assertEqual(datetime.datetime(2019, 1, 1, 20, 1), clock.Now())
+    self.assertEqual(0.5, clock.GetRealDelay(30))
+    with self.assertRaises(errors.BeerLogError):
+      recording.VirtualClock(start, speed=0)
+
+
+class EventReplayerTests(unittest.TestCase):
+  """Tests for the EventReplayer class."""
+
+  def testReplay(self):
+    """Tests that external events are pushed in order, at the replay speed."""
+    recorded_events = []
+    for seconds, internal in [(0, False), (2, True), (3600, False)]:
+      event = events.UIEvent(constants.EVENTTYPES.KEYUP)
+      event.timestamp = datetime.datetime(2019, 1, 1, 20, 0) + datetime.timedelta(seconds=seconds)
+      event.internal = internal
+      recorded_events.append(event)
+
+    pushed = []
+    done = threading.Event()
+    replayer = recording.EventReplayer(
+      recorded_events, pushed.append, speed=36000, done_callback=done.set
+    )
+    replayer.Start()
+    self.assertTrue(done.wait(5))
+    replayer.Stop()
+
+    self.assertEqual([recorded_events[0], recorded_events[2]], pushed)
+    self.assertEqual(2, replayer.replayed)
+    self.assertGreaterEqual(replayer.clock.Now(), recorded_events[2].timestamp)
+
+
+if __name__ == "__main__":
+  unittest.main()
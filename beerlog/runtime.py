@@ -0,0 +1,165 @@
+"""asyncio runtime for the kiosk, driving the events, timers and rendering."""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+
+class AsyncEventQueue:
+  """The events queue of an asyncio event loop.
+
+  Like the multiprocessing.Queue it replaces, events can be put from any
+  thread, ie: the GPIO callbacks, the GTK thread of the emulator, or the NFC
+  executor.
+  """
+
+  def __init__(self, loop: asyncio.AbstractEventLoop):
+    """Initializes an AsyncEventQueue.
+
+    Args:
+      loop(asyncio.AbstractEventLoop): the event loop reading the events.
+    """
+    self._loop = loop
+    self._queue = asyncio.Queue()
+
+  def put(self, event):
+    """Pushes an event, from any thread.
+
+    Args:
+      event(events.BaseEvent): the event.
+    """
+    self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+  async def get(self):
+    """Waits for the next event.
+
+    Returns:
+      events.BaseEvent: the event.
+    """
+    return await self._queue.get()
+
+
+class AsyncRuntime:
+  """Runs the kiosk on an asyncio event loop.
+
+  The event loop waits for the events, and for the next deadline of the kiosk,
+  when a delayed event is due or the display needs to be redrawn. The blocking
+  work runs in executors:
+    - the NFC reader (nfcpy), in its own thread.
+    - the database, the event handlers and the rendering, in one worker thread,
+      as the SQLite connection and the display are used from a single thread.
+
+  The GPIO callbacks and the GTK thread of the emulator still run in the
+  threads of their libraries, and push their events to the queue.
+
+  Attributes:
+    events_queue(AsyncEventQueue): the events queue, once running.
+  """
+
+  def __init__(self, app, nfc_path: str | None = None):
+    """Initializes an AsyncRuntime.
+
+    Args:
+      app(beerlog_cli.BeerLog): the kiosk.
+      nfc_path(str): the path to the NFC reader.
+    """
+    self._app = app
+    self._nfc_path = nfc_path
+    self._loop: asyncio.AbstractEventLoop
+    self._wakeup: asyncio.Event
+    self._stop: asyncio.Event
+    self._terminating = threading.Event()
+    self._worker = concurrent.futures.ThreadPoolExecutor(
+      max_workers=1, thread_name_prefix="BeerLogWorker"
+    )
+    self._nfc_executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers=1, thread_name_prefix="BeerLogNFC"
+    )
+    self.events_queue: AsyncEventQueue
+
+  def Run(self):
+    """Runs the kiosk until Stop() is called, or an error happens."""
+    asyncio.run(self._Main())
+
+  def Stop(self):
+    """Stops the kiosk, from any thread."""
+    self._loop.call_soon_threadsafe(self._stop.set)
+
+  async def _RunInWorker(self, function, *args):
+    """Runs a function in the worker thread.
+
+    Args:
+      function(callable): the function.
+      args(list): the arguments of the function.
+    Returns:
+      object: the result of the function.
+    """
+    return await self._loop.run_in_executor(self._worker, function, *args)
+
+  async def _HandleEvents(self):
+    """Handles the events, one at a time."""
+    while True:
+      event = await self.events_queue.get()
+      await self._RunInWorker(self._app.ProcessEvent, event)
+      self._wakeup.set()
+
+  def _RenderAndGetDeadline(self) -> float:
+    """Pushes the delayed events that are due, and redraws the display if
+    needed.
+
+    Returns:
+      float: when to wake up again, as a time.monotonic() value.
+    """
+    self._app.RunTimers()
+    self._app.Render()
+    return self._app.GetNextDeadline()
+
+  async def _Render(self):
+    """Redraws the display after events, or when the next deadline is due."""
+    while True:
+      deadline = await self._RunInWorker(self._RenderAndGetDeadline)
+      timer = self._loop.call_later(max(0.0, deadline - time.monotonic()), self._wakeup.set)
+      try:
+        await self._wakeup.wait()
+      finally:
+        timer.cancel()
+      self._wakeup.clear()
+
+  async def _Main(self):
+    """Initializes the kiosk, and runs it."""
+    self._loop = asyncio.get_running_loop()
+    self._wakeup = asyncio.Event()
+    self._stop = asyncio.Event()
+    self.events_queue = AsyncEventQueue(self._loop)
+    self._app.SetAsyncRuntime(self)
+    tasks = []
+    try:
+      await self._RunInWorker(self._app.InitDB)
+      self._app.InitNFC(path=self._nfc_path, start_process=False)
+      await self._RunInWorker(self._app.InitUI)
+
+      tasks.append(asyncio.ensure_future(self._stop.wait()))
+      tasks.append(asyncio.ensure_future(self._HandleEvents()))
+      tasks.append(asyncio.ensure_future(self._Render()))
+      if self._app.nfc_reader:
+        tasks.append(
+          self._loop.run_in_executor(
+            self._nfc_executor, self._app.nfc_reader.ReadTags, self._terminating.is_set
+          )
+        )
+      done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+      for task in done:
+        # Raises the error that stopped the kiosk, if any.
+        task.result()
+    finally:
+      self._terminating.set()
+      for task in tasks:
+        task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+      await self._RunInWorker(self._app.Terminate)
+      self._worker.shutdown()
+      self._nfc_executor.shutdown(wait=False)
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
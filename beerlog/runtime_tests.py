@@ -0,0 +1,102 @@
+"""Tests for the runtime module"""
+
+import threading
+import time
+import unittest
+
+from beerlog import runtime
+from beerlog import scheduler
+from beerlog.bnfc import base as nfc_base
+
+
+class FakeUI:
+  """UI which never needs to be redrawn on its own."""
+
+  def GetNextDeadline(self):
+    return time.monotonic() + 60
+
+
+class FakeApp:
+  """Kiosk recording how the runtime drives it."""
+
+  def __init__(self, fail_render=False):
+    self.nfc_reader = nfc_base.BaseNFC(events_queue=None)
+    self.ui = FakeUI()
+    self.calls = []
+    self.threads = set()
+    self.async_runtime = None
+    self.scheduler = scheduler.Scheduler()
+    self._fail_render = fail_render
+
+  def _Record(self, call):
+    self.calls.append(call)
+    self.threads.add(threading.current_thread().name)
+
+  def SetAsyncRuntime(self, async_runtime):
+    self.async_runtime = async_runtime
+
+  def InitDB(self):
+    self._Record("InitDB")
+
+  def InitNFC(self, path=None, start_process=True):
+    self.calls.append("InitNFC {0!s} {1!s}".format(path, start_process))
+
+  def InitUI(self):
+    self._Record("InitUI")
+    # Like a button pressed from another thread.
+    threading.Thread(target=self.async_runtime.events_queue.put, args=("button",)).start()
+
+  def ProcessEvent(self, event):
+    self._Record("ProcessEvent {0:s}".format(event))
+    if event == "button":
+      self.scheduler.Schedule(0.01, self.async_runtime.events_queue.put, "delayed")
+      key = self.scheduler.Schedule(0.01, self.async_runtime.events_queue.put, "cancelled")
+      self.scheduler.Cancel(key)
+    elif event == "delayed":
+      self.async_runtime.Stop()
+
+  def RunTimers(self):
+    self.threads.add(threading.current_thread().name)
+    self.scheduler.RunDue()
+
+  def GetNextDeadline(self):
+    deadline = self.scheduler.GetNextDeadline()
+    if deadline is None:
+      return self.ui.GetNextDeadline()
+    return min(deadline, self.ui.GetNextDeadline())
+
+  def Render(self):
+    self._Record("Render")
+    if self._fail_render:
+      raise ValueError("Broken display")
+
+  def Terminate(self):
+    self._Record("Terminate")
+
+
+class AsyncRuntimeTests(unittest.TestCase):
+  """Tests for the AsyncRuntime class."""
+
+  def testRun(self):
+    """Tests that events, delayed events and rendering go through the loop."""
+    app = FakeApp()
+    runtime.AsyncRuntime(app, nfc_path="usb").Run()
+
+    self.assertEqual(["InitDB", "InitNFC usb False", "InitUI"], app.calls[:3])
+    events = [call for call in app.calls if call.startswith("ProcessEvent")]
+    self.assertEqual(["ProcessEvent button", "ProcessEvent delayed"], events)
+    self.assertEqual("Render", app.calls[app.calls.index("ProcessEvent button") + 1])
+    self.assertEqual("Terminate", app.calls[-1])
+    # The database and the display are only used from the worker thread.
+    self.assertEqual(1, len(app.threads))
+
+  def testError(self):
+    """Tests that errors stop the loop, and that the kiosk is terminated."""
+    app = FakeApp(fail_render=True)
+    with self.assertRaises(ValueError):
+      runtime.AsyncRuntime(app).Run()
+    self.assertEqual("Terminate", app.calls[-1])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,155 @@
+"""Scheduler for the delayed events of the kiosk."""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class Scheduler:
+  """Keeps a heap of deadlines, and runs the calls that are due.
+
+  It has no thread of its own: the main loop of the kiosk waits until
+  GetNextDeadline(), and calls RunDue(). Each call has a key, so it can be
+  cancelled or rescheduled. Scheduling a call with the key of a pending one
+  replaces it.
+  """
+
+  def __init__(self, clock=time.monotonic):
+    """Initializes a Scheduler.
+
+    Args:
+      clock(callable): returns the current time, in seconds.
+    """
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._heap = []
+    # Maps a key to its entry in the heap. Cancelled entries stay in the heap,
+    # with no callback, until they're popped.
+    self._entries = {}
+    self._counter = itertools.count()
+
+  def __len__(self):
+    with self._lock:
+      return len(self._entries)
+
+  def Schedule(self, delay: float, callback, *args, key=None):
+    """Schedules a call.
+
+    Args:
+      delay(float): the delay, in seconds.
+      callback(callable): the function to call.
+      args(list): the arguments of the function.
+      key(object): the key of the call. Defaults to a new unique key.
+    Returns:
+      object: the key of the call.
+    """
+    deadline = self._clock() + delay
+    with self._lock:
+      count = next(self._counter)
+      if key is None:
+        key = ("call", count)
+      self._CancelLocked(key)
+      entry = [deadline, count, key, callback, args]
+      self._entries[key] = entry
+      heapq.heappush(self._heap, entry)
+    return key
+
+  def Reschedule(self, key, delay: float) -> bool:
+    """Moves a pending call to a new deadline.
+
+    Args:
+      key(object): the key of the call.
+      delay(float): the new delay, in seconds, from now.
+    Returns:
+      bool: whether the call was pending.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+    if not entry:
+      return False
+    self.Schedule(delay, entry[3], *entry[4], key=key)
+    return True
+
+  def _CancelLocked(self, key) -> bool:
+    """Cancels a call. The lock needs to be held.
+
+    Args:
+      key(object): the key of the call.
+    Returns:
+      bool: whether the call was pending.
+    """
+    entry = self._entries.pop(key, None)
+    if not entry:
+      return False
+    entry[3] = None
+    return True
+
+  def Cancel(self, key) -> bool:
+    """Cancels a call.
+
+    Args:
+      key(object): the key of the call.
+    Returns:
+      bool: whether the call was pending.
+    """
+    with self._lock:
+      return self._CancelLocked(key)
+
+  def CancelAll(self):
+    """Cancels all the pending calls."""
+    with self._lock:
+      self._heap = []
+      self._entries = {}
+
+  def GetPending(self) -> list:
+    """Returns the pending calls.
+
+    Returns:
+      list[tuple]: the key and deadline of each call, soonest first.
+    """
+    with self._lock:
+      entries = sorted(self._entries.values())
+    return [(entry[2], entry[0]) for entry in entries]
+
+  def GetNextDeadline(self) -> float | None:
+    """Returns when the next call is due.
+
+    Returns:
+      float: the deadline, in the time of the clock, or None if nothing is
+        pending.
+    """
+    with self._lock:
+      self._DropCancelledLocked()
+      if self._heap:
+        return self._heap[0][0]
+    return None
+
+  def _DropCancelledLocked(self):
+    """Pops the cancelled calls off the top of the heap. The lock needs to be
+    held."""
+    while self._heap and self._heap[0][3] is None:
+      heapq.heappop(self._heap)
+
+  def RunDue(self) -> int:
+    """Runs the calls which deadline has passed.
+
+    Returns:
+      int: the number of calls that ran.
+    """
+    now = self._clock()
+    due = []
+    with self._lock:
+      self._DropCancelledLocked()
+      while self._heap and self._heap[0][0] <= now:
+        entry = heapq.heappop(self._heap)
+        del self._entries[entry[2]]
+        due.append(entry)
+        self._DropCancelledLocked()
+    # The calls may schedule new ones, so they run without the lock.
+    for _, _, _, callback, args in due:
+      callback(*args)
+    return len(due)
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
@@ -0,0 +1,62 @@
+"""Tests for the scheduler module"""
+
+import unittest
+
+from beerlog import scheduler
+
+
+class SchedulerTests(unittest.TestCase):
+  """Tests for the Scheduler class."""
+
+  def setUp(self):
+    self.now = 100.0
+    self.calls = []
+    self.scheduler = scheduler.Scheduler(clock=lambda: self.now)
+
+  def testRunDue(self):
+    """Tests that calls run in order, once their deadline has passed."""
+    self.scheduler.Schedule(2, self.calls.append, "second")
+    self.scheduler.Schedule(1, self.calls.append, "first")
+    self.assertEqual(101.0, self.scheduler.GetNextDeadline())
+    self.assertEqual(0, self.scheduler.RunDue())
+
+    self.now = 102.0
+    self.assertEqual(2, self.scheduler.RunDue())
+    self.assertEqual(["first", "second"], self.calls)
+    self.assertIsNone(self.scheduler.GetNextDeadline())
+    self.assertEqual(0, len(self.scheduler))
+
+  def testKeys(self):
+    """Tests cancelling and rescheduling calls by key."""
+    self.scheduler.Schedule(2, self.calls.append, "escape", key="escape-after-scan")
+    self.scheduler.Schedule(2, self.calls.append, "escape again", key="escape-after-scan")
+    key = self.scheduler.Schedule(1, self.calls.append, "other")
+    self.assertEqual([(key, 101.0), ("escape-after-scan", 102.0)], self.scheduler.GetPending())
+
+    self.assertTrue(self.scheduler.Cancel(key))
+    self.assertFalse(self.scheduler.Cancel(key))
+    self.assertEqual(102.0, self.scheduler.GetNextDeadline())
+
+    self.assertTrue(self.scheduler.Reschedule("escape-after-scan", 5))
+    self.assertFalse(self.scheduler.Reschedule("missing", 5))
+    self.now = 104.0
+    self.assertEqual(0, self.scheduler.RunDue())
+    self.now = 105.0
+    self.assertEqual(1, self.scheduler.RunDue())
+    self.assertEqual(["escape again"], self.calls)
+
+  def testCancelAll(self):
+    """Tests that cancelled calls never run, and that calls can schedule new ones."""
+    self.scheduler.Schedule(1, self.calls.append, "cancelled")
+    self.scheduler.CancelAll()
+    self.scheduler.Schedule(
+      1, lambda: self.scheduler.Schedule(0, self.calls.append, "next"), key="chained"
+    )
+    self.now = 101.0
+    self.assertEqual(1, self.scheduler.RunDue())
+    self.assertEqual(1, self.scheduler.RunDue())
+    self.assertEqual(["next"], self.calls)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,101 @@
+"""Reads and writes scans as CSV and JSON Lines files."""
+
+import csv
+import datetime
+import json
+import os
+from collections.abc import Iterable, Iterator
+from typing import TextIO
+
+from beerlog import errors
+
+FORMATS = ["csv", "jsonl"]
+# The fields of exported scans, which can be imported back.
+EXPORT_FIELDS = ["timestamp", "character_name", "amount", "pic", "scans"]
+
+
+def GuessFormat(path: str) -> str:
+  """Guesses the format of a file from its extension.
+
+  Args:
+    path(str): the path to the file.
+  Returns:
+    str: one of FORMATS.
+  Raises:
+    errors.BeerLogError: if the extension is not supported.
+  """
+  extension = os.path.splitext(path)[1].lower().lstrip(".")
+  if extension == "json":
+    extension = "jsonl"
+  if extension not in FORMATS:
+    raise errors.BeerLogError(
+      "Unknown format for {0:s}, expected one of {1:s}".format(path, ", ".join(FORMATS))
+    )
+  return extension
+
+
+def ReadEntries(input_file: TextIO, file_format: str) -> Iterator[dict]:
+  """Reads scans, one at a time, from a file.
+
+  CSV files need a header line. JSON Lines files have one object per line.
+  Each scan has a 'timestamp' field, and either a 'uid' field, or
+  'character_name' and 'amount' fields. The 'pic' field is optional, and so is
+  'scans', the number of scans a compacted entry stands for, which defaults to
+  1 when the scans are imported.
+
+  Args:
+    input_file(file): the opened file.
+    file_format(str): one of FORMATS.
+  Yields:
+    dict: a scan.
+  Raises:
+    errors.BeerLogError: if the file can't be parsed.
+  """
+  if file_format == "csv":
+    for row in csv.DictReader(input_file):
+      yield {key: value for key, value in row.items() if value != ""}
+  elif file_format == "jsonl":
+    for line_number, line in enumerate(input_file, start=1):
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        yield json.loads(line)
+      except ValueError as e:
+        raise errors.BeerLogError("Invalid JSON at line {0:d}: {1!s}".format(line_number, e))
+  else:
+    raise errors.BeerLogError("Unknown format {0:s}".format(file_format))
+
+
+def WriteEntries(output_file: TextIO, entries: Iterable[tuple], file_format: str) -> int:
+  """Writes scans, one at a time, to a file.
+
+  Args:
+    output_file(file): the opened file.
+    entries(iterable[tuple]): the scans, with the values of EXPORT_FIELDS.
+    file_format(str): one of FORMATS.
+  Returns:
+    int: the number of written scans.
+  Raises:
+    errors.BeerLogError: if the format is not supported.
+  """
+  count = 0
+  if file_format == "csv":
+    writer = csv.writer(output_file)
+    writer.writerow(EXPORT_FIELDS)
+    for entry in entries:
+      writer.writerow(entry)
+      count += 1
+  elif file_format == "jsonl":
+    for entry in entries:
+      row = dict(zip(EXPORT_FIELDS, entry))
+      if isinstance(row["timestamp"], datetime.datetime):
+        row["timestamp"] = str(row["timestamp"])
+      output_file.write(json.dumps(row) + "\n")
+      count += 1
+  else:
+    raise errors.BeerLogError("Unknown format {0:s}".format(file_format))
+  return count
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
@@ -0,0 +1,87 @@
+"""Tests for the serialization module"""
+
+import datetime
+import io
+import unittest
+
+from beerlog import errors
+from beerlog import serialization
+
+
+class SerializationTests(unittest.TestCase):
+  """Tests for the serialization module."""
+
+  def testGuessFormat(self):
+    """Tests the GuessFormat() function."""
+    self.assertEqual("csv", serialization.GuessFormat("/tmp/scans.CSV"))
+    self.assertEqual("jsonl", serialization.GuessFormat("scans.jsonl"))
+    self.assertEqual("jsonl", serialization.GuessFormat("scans.json"))
+    with self.assertRaises(errors.BeerLogError):
+      serialization.GuessFormat("scans.xls")
+
+  def testReadEntries(self):
+    """Tests the ReadEntries() function."""
+    csv_file = io.StringIO(
+      "uid,character_name,amount,timestamp\n"
+      "0x0,,,2019-01-01 14:00:00\n"
+      ",toto,33,2019-01-01T15:00:00\n"
+    )
+    self.assertEqual(
+      [
+        {"uid": "0x0", "timestamp": "2019-01-01 14:00:00"},
+        {"character_name": "toto", "amount": "33", "timestamp": "2019-01-01T15:00:00"},
+      ],
+      list(serialization.ReadEntries(csv_file, "csv")),
+    )
+
+    jsonl_file = io.StringIO('{"uid": "0x0", "timestamp": "2019-01-01 14:00:00"}\n\n')
+    self.assertEqual(
+      [{"uid": "0x0", "timestamp": "2019-01-01 14:00:00"}],
+      list(serialization.ReadEntries(jsonl_file, "jsonl")),
+    )
+    with self.assertRaises(errors.BeerLogError):
+      list(serialization.ReadEntries(io.StringIO("{nope\n"), "jsonl"))
+
+  def testWriteEntries(self):
+    """Tests the WriteEntries() function, and reading back its output."""
+    entries = [
+      (datetime.datetime(2019, 1, 1, 14, 0), "toto", 33, None, 1),
+      (datetime.datetime(2019, 1, 1, 15, 0, 30, 500), "tutu", 50, "pic1", 2),
+    ]
+    expected = [
+      {
+        "timestamp": "2019-01-01 14:00:00",
+        "character_name": "toto",
+        "amount": 33,
+        "pic": None,
+        "scans": 1,
+      },
+      {
+        "timestamp": "2019-01-01 15:00:30.000500",
+        "character_name": "tutu",
+        "amount": 50,
+        "pic": "pic1",
+        "scans": 2,
+      },
+    ]
+
+    jsonl_file = io.StringIO()
+    self.assertEqual(2, serialization.WriteEntries(jsonl_file, entries, "jsonl"))
+    jsonl_file.seek(0)
+    self.assertEqual(expected, list(serialization.ReadEntries(jsonl_file, "jsonl")))
+
+    csv_file = io.StringIO()
+    self.assertEqual(2, serialization.WriteEntries(csv_file, entries, "csv"))
+    csv_file.seek(0)
+    expected[0].pop("pic")
+    for row in expected:
+      row["amount"] = str(row["amount"])
+      row["scans"] = str(row["scans"])
+    self.assertEqual(expected, list(serialization.ReadEntries(csv_file, "csv")))
+
+    with self.assertRaises(errors.BeerLogError):
+      serialization.WriteEntries(io.StringIO(), entries, "xls")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,325 @@
+"""Writes scans to the database from a background thread."""
+
+import collections
+import contextlib
+import datetime
+import logging
+import queue
+import threading
+import time
+
+import peewee
+
+from beerlog import beerlogdb
+from beerlog import errors
+
+# A scan waiting to be written.
+PendingScan = collections.namedtuple("PendingScan", ["uid", "name", "amount", "timestamp"])
+
+
+def _IsBusyError(error: Exception) -> bool:
+  """Returns whether an error means that another connection holds the lock.
+
+  Args:
+    error(Exception): the error.
+  Returns:
+    bool: whether the error is temporary.
+  """
+  message = str(error).lower()
+  return isinstance(error, peewee.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class EntryWriter:
+  """Queues scans, and writes them to the database from a dedicated thread.
+
+  Scans queued while a transaction is being committed are all written in the
+  next one (group commit), so a rush at the taps costs a few transactions
+  instead of one per scan.
+
+  Until they're written, queued scans are added to the results of
+  GetScoreBoardRows(), GetAmountFromName() and GetGlassFromName(), so the kiosk
+  can show them right away.
+
+  The writer thread has its own BeerLogDB, on the same file, so it shares no
+  cache or connection with the threads reading the database.
+  """
+
+  # Maximum number of scans written in one transaction.
+  MAX_BATCH_SIZE = 100
+  # How many times to try again a transaction which fails because another
+  # connection holds the lock (ie: the compact or import commands).
+  BUSY_RETRIES = 5
+  # How long to wait before the first retry, in seconds. It doubles each time.
+  BUSY_RETRY_DELAY = 0.5
+
+  def __init__(self, database: beerlogdb.BeerLogDB, error_callback=None):
+    """Initializes an EntryWriter.
+
+    Args:
+      database(beerlogdb.BeerLogDB): the database the kiosk reads, and looks
+        the tags up in. It needs to be on disk, as the writer thread opens it
+        again.
+      error_callback(callable): called from the writer thread with an error
+        message when scans could not be written.
+    """
+    self._database = database
+    self._error_callback = error_callback
+    self._queue = queue.Queue()
+    # Held while reading the database with the pending scans. The writer thread
+    # takes it right before committing, and removes the written scans before
+    # releasing it, so that a scan is never counted twice, or not at all.
+    self._lock = threading.Lock()
+    self._pending = collections.OrderedDict()
+    self._next_pending_id = 0
+    self._thread = None
+    # Set by Stop(), to cut the waits between retries short.
+    self._stopping = threading.Event()
+
+  def Start(self):
+    """Starts the writer thread."""
+    self._stopping.clear()
+    self._thread = threading.Thread(target=self._Run, name="EntryWriter", daemon=True)
+    self._thread.start()
+
+  def Stop(self):
+    """Writes the queued scans, and stops the writer thread.
+
+    Scans which can't be written because the database is locked aren't retried
+    anymore, and stay pending.
+    """
+    if self._thread:
+      self._stopping.set()
+      self._queue.put(None)
+      self._thread.join()
+      self._thread = None
+
+  def AddEntry(self, character_hexid: str, time: datetime.datetime | None = None):
+    """Queues a scan.
+
+    Args:
+      character_hexid(str): the hexid of the character in the tag.
+      time(datetime): the optional time of the scan. Defaults to now.
+    Raises:
+      errors.BeerLogError: if the tag is unknown.
+    """
+    name = self._database.GetNameFromHexID(character_hexid)
+    amount = self._database.GetGlassFromHexID(character_hexid)
+    self._Queue(PendingScan(character_hexid, name, amount, time or datetime.datetime.now()))
+
+  def AddNameEntry(self, character_name: str, time: datetime.datetime | None = None):
+    """Queues a scan for a character, by their realname.
+
+    Args:
+      character_name(str): the realname of the character.
+      time(datetime): the optional time of the scan. Defaults to now.
+    Raises:
+      errors.BeerLogError: if no tag has this realname.
+    """
+    character_hexid = self._database.GetHexFromName(character_name)
+    if not character_hexid:
+      raise errors.BeerLogError(f"cannot find realname {character_name}")
+    self.AddEntry(character_hexid, time=time)
+
+  def _Queue(self, scan: PendingScan):
+    """Adds a scan to the pending scans, and to the queue of the writer thread.
+
+    Args:
+      scan(PendingScan): the scan.
+    """
+    with self._lock:
+      pending_id = self._next_pending_id
+      self._next_pending_id += 1
+      self._pending[pending_id] = scan
+    self._queue.put(pending_id)
+
+  def _OpenDatabase(self) -> beerlogdb.BeerLogDB:
+    """Opens the database of the writer thread.
+
+    Returns:
+      beerlogdb.BeerLogDB: a new connection to the database of the kiosk.
+    """
+    return beerlogdb.BeerLogDB(self._database.database_path, pragmas=self._database.pragmas)
+
+  def _Run(self):
+    """Writes the queued scans, until Stop() is called."""
+    writer_database = self._OpenDatabase()
+    try:
+      stopping = False
+      while not stopping:
+        batch = [self._queue.get()]
+        while len(batch) < self.MAX_BATCH_SIZE:
+          try:
+            batch.append(self._queue.get_nowait())
+          except queue.Empty:
+            break
+        if None in batch:
+          stopping = True
+          batch = [pending_id for pending_id in batch if pending_id is not None]
+        if batch:
+          retried = self._WriteBatch(writer_database, batch)
+          if stopping and retried:
+            # Last chance, the scans which are still pending are logged below.
+            retried = self._WriteBatch(writer_database, retried)
+          for pending_id in retried:
+            self._queue.put(pending_id)
+    finally:
+      writer_database.Close()
+      if self._pending:
+        logging.error("Stopped with {0:d} scans not saved".format(len(self._pending)))
+
+  def _WriteBatch(self, writer_database: beerlogdb.BeerLogDB, batch: list[int]) -> list[int]:
+    """Writes some pending scans, in one transaction if possible.
+
+    If the transaction fails, the scans are written one by one, so that one bad
+    scan doesn't take the others down. Scans which can't be written because the
+    database stays locked stay pending.
+
+    Args:
+      writer_database(beerlogdb.BeerLogDB): the database of the writer thread.
+      batch(list[int]): the ids of the pending scans.
+    Returns:
+      list[int]: the ids of the scans to try again later.
+    """
+    start = time.monotonic()
+    with self._lock:
+      scans = {pending_id: self._pending[pending_id] for pending_id in batch}
+    written = []
+    failed = {}
+    try:
+      self._Commit(writer_database, batch)
+      written = batch
+    except Exception as e:  # pylint: disable=broad-except
+      logging.warning("Could not save {0:d} scans at once: {1!s}".format(len(scans), e))
+      for pending_id in batch:
+        try:
+          self._Commit(writer_database, [pending_id])
+          written.append(pending_id)
+        except Exception as scan_error:  # pylint: disable=broad-except
+          failed[pending_id] = scan_error
+
+    retried = [pending_id for pending_id, e in failed.items() if _IsBusyError(e)]
+    dropped = [pending_id for pending_id in failed if pending_id not in retried]
+    with self._lock:
+      for pending_id in dropped:
+        del self._pending[pending_id]
+    for pending_id in dropped:
+      self._ReportError(
+        "Could not save scan {0!s}: {1!s}".format(scans[pending_id], failed[pending_id])
+      )
+    logging.debug(
+      "Wrote {0:d} scans in {1:.1f}ms".format(len(written), (time.monotonic() - start) * 1000)
+    )
+    return retried
+
+  def _Commit(self, writer_database: beerlogdb.BeerLogDB, batch: list[int]):
+    """Writes pending scans in one transaction, retrying while the database is
+    locked, until Stop() is called.
+
+    Args:
+      writer_database(beerlogdb.BeerLogDB): the database of the writer thread.
+      batch(list[int]): the ids of the pending scans.
+    Raises:
+      Exception: if the transaction failed.
+    """
+    delay = self.BUSY_RETRY_DELAY
+    for retry in range(self.BUSY_RETRIES + 1):
+      try:
+        self._AddEntries(writer_database, batch)
+        return
+      except peewee.OperationalError as e:
+        if retry == self.BUSY_RETRIES or not _IsBusyError(e):
+          raise
+        logging.debug("Database is busy, retrying in {0:.1f}s".format(delay))
+        if self._stopping.wait(delay):
+          raise
+        delay *= 2
+
+  def _AddEntries(self, writer_database: beerlogdb.BeerLogDB, batch: list[int]):
+    """Writes pending scans in one transaction, and removes them from the
+    pending scans.
+
+    The lock is taken before committing, and released once the scans are
+    removed: the readers see them either pending, or in the database.
+
+    Args:
+      writer_database(beerlogdb.BeerLogDB): the database of the writer thread.
+      batch(list[int]): the ids of the pending scans.
+    Raises:
+      Exception: if the transaction failed. The scans stay pending then.
+    """
+    with self._lock:
+      scans = [self._pending[pending_id] for pending_id in batch]
+    with contextlib.ExitStack() as stack:
+      writer_database.AddTagEntries(scans, before_commit=lambda: stack.enter_context(self._lock))
+      for pending_id in batch:
+        del self._pending[pending_id]
+      self._database.NotifyExternalChange()
+
+  def _ReportError(self, message: str):
+    """Logs an error, and passes it to the error callback.
+
+    Args:
+      message(str): the error message.
+    """
+    logging.error(message)
+    if self._error_callback:
+      self._error_callback(message)
+
+  def GetPendingCount(self) -> int:
+    """Returns the number of scans waiting to be written."""
+    with self._lock:
+      return len(self._pending)
+
+  def GetScoreBoardRows(self) -> list[beerlogdb.ScoreBoardRow]:
+    """Returns the scoreboard of the current session, with the pending scans.
+
+    Returns:
+      list[beerlogdb.ScoreBoardRow]: the scoreboard rows, best drinker first.
+    """
+    with self._lock:
+      scoreboard = self._database.GetScoreBoardRows()
+      if not self._pending:
+        return scoreboard
+      rows = {row.character_name.lower(): row for row in scoreboard}
+      for scan in self._pending.values():
+        row = rows.get(scan.name.lower())
+        if row:
+          rows[scan.name.lower()] = row._replace(
+            total=row.total + scan.amount, scans=row.scans + 1, last=max(row.last, scan.timestamp)
+          )
+        else:
+          rows[scan.name.lower()] = beerlogdb.ScoreBoardRow(
+            scan.name, scan.amount, 1, scan.timestamp
+          )
+    return sorted(rows.values(), key=lambda row: (-row.total, row.last))
+
+  def GetAmountFromName(self, name: str) -> int:
+    """Returns the amount of beer drunk by a character, with the pending scans.
+
+    Args:
+      name(str): the name of a character.
+    Returns:
+      int: the amount of beer, in cL.
+    """
+    with self._lock:
+      pending = sum(
+        scan.amount for scan in self._pending.values() if scan.name.lower() == name.lower()
+      )
+      return self._database.GetAmountFromName(name) + pending
+
+  def GetGlassFromName(self, name: str) -> int:
+    """Returns the glass size of the last scan of a character, pending or not.
+
+    Args:
+      name(str): the name of a character.
+    Returns:
+      int: the glass size.
+    """
+    with self._lock:
+      for scan in reversed(self._pending.values()):
+        if scan.name.lower() == name.lower():
+          return scan.amount
+      return self._database.GetGlassFromName(name)
+
+
+# vim: tabstop=2 shiftwidth=2 expandtab
@@ -0,0 +1,162 @@
+"""Tests for the writer module"""
+
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+import peewee
+
+from beerlog import beerlogdb
+from beerlog import errors
+from beerlog import writer
+
+# pylint: disable=protected-access
+
+
+class BusyBeerLogDB(beerlogdb.BeerLogDB):
+  """BeerLogDB which fails its first transactions, as if the database was locked."""
+
+  def __init__(self, *args, busy_commits=0, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.busy_commits = busy_commits
+
+  def AddTagEntries(self, scans, before_commit=None):
+    if self.busy_commits:
+      self.busy_commits -= 1
+      raise peewee.OperationalError("database is locked")
+    super().AddTagEntries(scans, before_commit=before_commit)
+
+
+class RecordingEntryWriter(writer.EntryWriter):
+  """EntryWriter that records the size of every batch it writes."""
+
+  BUSY_RETRY_DELAY = 0.001
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.batch_sizes = []
+    self.busy_commits = 0
+
+  def _OpenDatabase(self):
+    return BusyBeerLogDB(self._database.database_path, busy_commits=self.busy_commits)
+
+  def _WriteBatch(self, writer_database, batch):
+    self.batch_sizes.append(len(batch))
+    return super()._WriteBatch(writer_database, batch)
+
+
+class EntryWriterTests(unittest.TestCase):
+  """Tests for the EntryWriter class."""
+
+  def setUp(self):
+    self._temp_dir = tempfile.TemporaryDirectory()
+    # The writer thread needs its own connection, to the same database.
+    self.db = beerlogdb.BeerLogDB(os.path.join(self._temp_dir.name, "beerlog.sqlite"))
+    self.db.known_tags_list = {
+      "0x0": {"name": "toto", "realname": "toto", "glass": 33},
+      "0x1": {"name": "toto", "glass": 45},
+      "0x2": {"name": "tutu", "glass": 50},
+    }
+    self.errors = []
+    self.writer = RecordingEntryWriter(self.db, error_callback=self.errors.append)
+
+  def tearDown(self):
+    self.writer.Stop()
+    self.db.Close()
+    self._temp_dir.cleanup()
+
+  def testPendingScans(self):
+    """Tests that queued scans are counted before they're written."""
+    self.db.AddEntry("0x2", time=datetime.datetime(2019, 1, 1, 14, 0))
+    self.writer.AddEntry("0x0", time=datetime.datetime(2019, 1, 1, 15, 0))
+    self.writer.AddEntry("0x1", time=datetime.datetime(2019, 1, 1, 16, 0))
+    self.writer.AddNameEntry("toto", time=datetime.datetime(2019, 1, 1, 17, 0))
+    with self.assertRaises(errors.BeerLogError):
+      self.writer.AddEntry("0x9")
+
+    self.assertEqual(3, self.writer.GetPendingCount())
+    self.assertEqual(0, self.db.GetAmountFromName("toto"))
+    self.assertEqual(33 + 45 + 33, self.writer.GetAmountFromName("toto"))
+    self.assertEqual(50, self.writer.GetAmountFromName("tutu"))
+    self.assertEqual(33, self.writer.GetGlassFromName("toto"))
+    self.assertEqual(50, self.writer.GetGlassFromName("tutu"))
+    expected = [
+      ("toto", 33 + 45 + 33, 3, datetime.datetime(2019, 1, 1, 17, 0)),
+      ("tutu", 50, 1, datetime.datetime(2019, 1, 1, 14, 0)),
+    ]
+    self.assertEqual(
+      expected,
+      [(r.character_name, r.total, r.scans, r.last) for r in self.writer.GetScoreBoardRows()],
+    )
+
+    # The scans queued before the thread starts are written in one transaction.
+    self.writer.Start()
+    self.writer.Stop()
+    self.assertEqual([3], self.writer.batch_sizes)
+    self.assertEqual(0, self.writer.GetPendingCount())
+    self.assertEqual(33 + 45 + 33, self.db.GetAmountFromName("toto"))
+    self.assertEqual(
+      expected,
+      [(r.character_name, r.total, r.scans, r.last) for r in self.writer.GetScoreBoardRows()],
+    )
+    self.assertEqual([], self.errors)
+
+  def testWriteError(self):
+    """Tests that a scan which can't be written doesn't take the others down."""
+    self.writer.AddEntry("0x0")
+    # The tags are looked up when the scans are queued.
+    self.db.known_tags_list = {}
+    self.writer._Queue(writer.PendingScan("0x9", "titi", None, datetime.datetime.now()))
+    self.writer._Queue(writer.PendingScan("0x2", "tutu", 50, datetime.datetime.now()))
+    self.writer.Start()
+    self.writer.Stop()
+    self.assertEqual(1, len(self.errors))
+    self.assertIn("Could not save scan", self.errors[0])
+    self.assertIn("titi", self.errors[0])
+    self.assertEqual(0, self.writer.GetPendingCount())
+    self.assertEqual(2, self.db.GetEntriesCount())
+    self.assertEqual(50, self.db.GetAmountFromName("tutu"))
+
+  def testBusyDatabase(self):
+    """Tests that scans are kept, and written again, while the database is locked."""
+    self.writer.AddEntry("0x0")
+    self.writer.AddEntry("0x2")
+    # Stopping doesn't wait for the next retry.
+    self.writer.BUSY_RETRY_DELAY = 60
+    self.writer.busy_commits = 1000
+    self.writer.Start()
+    start = time.monotonic()
+    self.writer.Stop()
+    self.assertLess(time.monotonic() - start, 10)
+    self.assertEqual([], self.errors)
+    self.assertEqual(2, self.writer.GetPendingCount())
+
+    self.writer.BUSY_RETRY_DELAY = RecordingEntryWriter.BUSY_RETRY_DELAY
+
+    self.writer.busy_commits = self.writer.BUSY_RETRIES
+    self.writer.Start()
+    self.writer.AddEntry("0x1")
+    self.writer.Stop()
+    self.assertEqual([], self.errors)
+    self.assertEqual(0, self.writer.GetPendingCount())
+    self.assertEqual(33 + 50 + 45, self.db.GetTotalAmount())
+
+  def testNoDoubleCount(self):
+    """Tests that written scans are never counted both pending and in the database."""
+    self.writer.Start()
+    totals = []
+    for _ in range(50):
+      self.writer.AddEntry("0x2")
+      totals.append(self.writer.GetAmountFromName("tutu"))
+      self.db.NotifyExternalChange()
+      totals.append(self.writer.GetAmountFromName("tutu"))
+    self.writer.Stop()
+    self.assertEqual(sorted(totals), totals)
+    self.assertLessEqual(totals[-1], 50 * 50)
+    self.assertEqual(50 * 50, self.writer.GetAmountFromName("tutu"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,150 @@
+"""Compares the model and the row versions of the BeerLogDB read methods"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+from beerlog import beerlogdb
+
+DEFAULT_SCANS = 20000
+DEFAULT_CHARACTERS = 30
+DEFAULT_REPEAT = 5
+
+
+def FillDatabase(db: beerlogdb.BeerLogDB, scans: int, characters: int):
+  """Adds random scans to a database, over a few sessions.
+
+  Args:
+    db(beerlogdb.BeerLogDB): the database.
+    scans(int): the number of scans to add.
+    characters(int): the number of characters scanning.
+  """
+  random.seed(scans)
+  start = datetime.datetime(2019, 1, 1, 18, 0)
+  sessions = 4
+  for session in range(sessions):
+    session_start = start + datetime.timedelta(days=7 * session)
+    db.StartSession(started_at=session_start)
+    db.AddEntries(
+      {
+        "timestamp": session_start + datetime.timedelta(seconds=random.randrange(3 * 86400)),
+        "character_name": "drinker{0:d}".format(random.randrange(characters)),
+        "amount": random.choice([25, 33, 50]),
+      }
+      for _ in range(scans // sessions)
+    )
+
+
+def Benchmark(db: beerlogdb.BeerLogDB, repeat: int) -> list:
+  """Times the model and the row versions of each read method.
+
+  The cache is cleared before every call, so the queries actually run.
+
+  Args:
+    db(beerlogdb.BeerLogDB): the database.
+    repeat(int): the number of calls to time for each method.
+  Returns:
+    list[tuple]: the name, model time and row time, in milliseconds, of each
+      method.
+  """
+  name = db.GetAllCharacterNames()[0]
+  start = db.GetEarliestTimestamp(all_time=True)
+  end = start + datetime.timedelta(hours=12)
+  pairs = [
+    ("GetScoreBoard", db.GetScoreBoard, db.GetScoreBoardRows),
+    (
+      "GetScoreBoard(all_time)",
+      lambda: db.GetScoreBoard(all_time=True),
+      lambda: db.GetScoreBoardRows(all_time=True),
+    ),
+    ("GetAllData", db.GetAllData, db.GetAllEntryRows),
+    (
+      "GetEntriesInWindow",
+      lambda: list(db.GetEntriesInWindow(start, end)),
+      lambda: db.GetEntryRowsInWindow(start, end),
+    ),
+    (
+      "GetDataFromName",
+      lambda: list(db.GetDataFromName(name)),
+      lambda: db.GetDataRowsFromName(name),
+    ),
+  ]
+
+  def Time(method) -> float:
+    def Call():
+      db.cache.Invalidate()
+      method()
+
+    return min(timeit.repeat(Call, number=1, repeat=repeat)) * 1000
+
+  return [(label, Time(models), Time(rows)) for label, models, rows in pairs]
+
+
+def ParseArguments() -> argparse.Namespace:
+  """Parses arguments.
+
+  Returns:
+    argparse.NameSpace: the parsed arguments.
+  """
+  parser = argparse.ArgumentParser(description="Benchmarks the BeerLogDB read methods")
+  parser.add_argument(
+    "--database",
+    dest="database",
+    action="store",
+    default=None,
+    help="the sqlite file to read. Defaults to a temporary database with random scans.",
+  )
+  parser.add_argument(
+    "--scans",
+    dest="scans",
+    action="store",
+    default=DEFAULT_SCANS,
+    type=int,
+    help="the number of random scans in the temporary database",
+  )
+  parser.add_argument(
+    "--characters",
+    dest="characters",
+    action="store",
+    default=DEFAULT_CHARACTERS,
+    type=int,
+    help="the number of characters in the temporary database",
+  )
+  parser.add_argument(
+    "--repeat",
+    dest="repeat",
+    action="store",
+    default=DEFAULT_REPEAT,
+    type=int,
+    help="the number of calls to time, the best one is kept",
+  )
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  args = ParseArguments()
+  with tempfile.TemporaryDirectory() as temp_dir:
+    if args.database:
+      if not os.path.isfile(args.database):
+        print("Could not find a sqlite file at {0!s}".format(args.database))
+        sys.exit(1)
+      database = beerlogdb.BeerLogDB(args.database, read_only=True)
+    else:
+      database = beerlogdb.BeerLogDB(os.path.join(temp_dir, "beerlog.sqlite"))
+      FillDatabase(database, args.scans, args.characters)
+
+    print("{0:d} entries".format(database.GetEntriesCount(all_time=True)))
+    print("{0:<25s} {1:>10s} {2:>10s} {3:>8s}".format("Method", "Models", "Rows", "Speedup"))
+    for label, models_ms, rows_ms in Benchmark(database, args.repeat):
+      print(
+        "{0:<25s} {1:>8.1f}ms {2:>8.1f}ms {3:>7.1f}x".format(
+          label, models_ms, rows_ms, models_ms / rows_ms
+        )
+      )
+    database.Close()
+
+# vim: tabstop=2 shiftwidth=2 expandtab
@@ -3,6 +3,7 @@
 import argparse
 import datetime
 import html
+import io
 import os
 import sys
 import http.server
@@ -10,7 +11,13 @@ import json
 import socketserver
 import urllib.parse
 
+import numpy
+
+from beerlog import analytics
 from beerlog import beerlogdb
+from beerlog import errors
+from beerlog import instrumentation
+from beerlog import serialization
 
 socketserver.TCPServer.allow_reuse_address = True
 
@@ -24,7 +31,15 @@ MAX_HOURS = 30 * 24  # 1 month
 class Handler(http.server.BaseHTTPRequestHandler):
   """Implements a simple HTTP server."""
 
-  DB = None
+  # The BeerLogDB shared by all requests. It's opened read-only, so it can't
+  # block the kiosk writing scans to the same file.
+  DB: beerlogdb.BeerLogDB | None = None
+  # The scans of DB, as arrays for the statistics.
+  COLUMNS: analytics.EntryColumns | None = None
+  # Optional profiler, shared by all requests.
+  PROFILER: instrumentation.Profiler | None = None
+  # The paths we serve, each profiled as its own operation.
+  PATHS = ("/", "/chart.js", "/beer.js", "/predict", "/export.csv", "/data", "/character")
   TEMPLATE_HTML = """
 <html>
 <head>
@@ -74,21 +89,29 @@ class Handler(http.server.BaseHTTPRequestHandler):
 
   def __init__(self, *args, **kwargs):
     self._db: beerlogdb.BeerLogDB
-    self._characters: list[str]
+    self._columns: analytics.EntryColumns
     self._Setup()
     super().__init__(*args, **kwargs)
     self.options: argparse.Namespace
 
   def _Setup(self):
     """Initiates some useful objects"""
-    assert self.options is not None, "options should be set before calling _Setup"
-    self._db = beerlogdb.BeerLogDB(self.options.database)
-    self._db.LoadTagsDB(self.options.known_tags)
-    self._characters = self._db.GetAllCharacterNames()
-    self._all_data = self._db.GetAllData()
+    assert self.DB is not None, "DB should be set before calling _Setup"
+    self._db = self.DB
+    self._columns = self.COLUMNS or analytics.EntryColumns(self.DB)
 
   def do_GET(self):  # pylint: disable=invalid-name
     """Handles all GET requests."""
+    if not self.PROFILER:
+      self._HandleGet()
+      return
+    path = urllib.parse.urlparse(self.path).path
+    with self.PROFILER.Operation("GET {0:s}".format(path if path in self.PATHS else "other")):
+      self._HandleGet()
+    self.PROFILER.MaybeReport()
+
+  def _HandleGet(self):
+    """Serves a GET request."""
     parsed_path = urllib.parse.urlparse(self.path)
     if parsed_path.path == "/":
       self.send_response(200)
@@ -109,14 +132,35 @@ class Handler(http.server.BaseHTTPRequestHandler):
         self.wfile.write(js.read())
     elif parsed_path.path == "/predict":
       self._HandlePredictRequest()
+    elif parsed_path.path == "/export.csv":
+      self._HandleExportRequest()
     elif parsed_path.path == "/data":
+      all_time = self._ParseQueryParams().get("all_time", ["0"])[0] == "1"
+      self.send_response(200)
+      self.send_header("Content-type", "application/json")
+      self.end_headers()
+      self.wfile.write(self.GetData(all_time=all_time))
+    elif parsed_path.path == "/character":
+      name = self._ParseQueryParams().get("name", [""])[0]
       self.send_response(200)
       self.send_header("Content-type", "application/json")
       self.end_headers()
-      self.wfile.write(self.GetData())
+      self.wfile.write(self.GetCharacterData(name))
     else:
       self.send_error(404, "error")
 
+  def _HandleExportRequest(self):
+    """Streams all the scans as a CSV file."""
+    self.send_response(200)
+    self.send_header("Content-type", "text/csv")
+    self.send_header("Content-Disposition", 'attachment; filename="beerlog.csv"')
+    self.end_headers()
+    # The wrapper buffers the CSV lines before they're sent to the socket.
+    output = io.TextIOWrapper(self.wfile, encoding="utf-8", newline="")
+    serialization.WriteEntries(output, self._db.IterEntries(), "csv")
+    output.flush()
+    output.detach()
+
   def _ParseQueryParams(self):
     parsed = urllib.parse.urlparse(self.path)
     return urllib.parse.parse_qs(parsed.query)
@@ -125,7 +169,20 @@ class Handler(http.server.BaseHTTPRequestHandler):
     params = self._ParseQueryParams()
     keg_sizes = params.get("keg_size") or params.get("size")
     if not keg_sizes:
-      self._RenderPredictPage()
+      active_keg = self._db.GetActiveKeg()
+      if not active_keg:
+        self._RenderPredictPage()
+        return
+      try:
+        prediction = self._db.MakeKegPrediction()
+      except errors.BeerLogError as e:
+        self._RenderPredictPage(error=str(e), keg_size=active_keg.size_cl)
+        return
+      self._RenderPredictPage(
+        prediction=prediction,
+        keg_size=prediction["keg_size_cl"],
+        drinking_days=self._db.GetDrinkingDays(),
+      )
       return
 
     try:
@@ -136,10 +193,79 @@ class Handler(http.server.BaseHTTPRequestHandler):
       self._RenderPredictPage(error="keg_size must be a positive number", keg_size=keg_sizes[0])
       return
 
-    prediction = self._db.MakeKegPrediction(keg_size_cl)
-    self._RenderPredictPage(prediction=prediction, keg_size=keg_size_cl)
+    try:
+      prediction = self._db.MakeKegPrediction(keg_size_cl)
+    except errors.BeerLogError as e:
+      self._RenderPredictPage(error=str(e), keg_size=keg_size_cl)
+      return
+    self._RenderPredictPage(
+      prediction=prediction, keg_size=keg_size_cl, drinking_days=self._db.GetDrinkingDays()
+    )
+
+  def _RenderKegs(self, kegs):
+    """Builds the HTML table of tapped kegs.
 
-  def _RenderPredictPage(self, prediction=None, keg_size=None, error=None):
+    Args:
+      kegs(list[beerlogdb.Keg]): the kegs to display.
+    Returns:
+      str: the HTML table, or an empty string if no keg was tapped.
+    """
+    if not kegs:
+      return ""
+    rows = []
+    for keg in kegs:
+      rows.append(
+        f"""
+        <tr>
+          <td>{keg.tapped_at:%a %Y-%m-%d %H:%M}</td><td>{keg.size_cl / 100:.2f}</td>
+          <td>{keg.consumed_cl / 100:.2f}</td><td>{keg.loss_percent:g}%</td>
+          <td>{max(0, keg.GetRemaining()) / 100:.2f}</td>
+        </tr>"""
+      )
+    return f"""
+    <h2>Kegs</h2>
+    <table>
+      <thead>
+        <tr>
+          <th>Tapped</th><th>Size (L)</th><th>Consumed (L)</th><th>Loss</th><th>Left (L)</th>
+        </tr>
+      </thead>
+      <tbody>{"".join(rows)}
+      </tbody>
+    </table>"""
+
+  def _RenderDrinkingDays(self, drinking_days):
+    """Builds the HTML table of drinking days.
+
+    Args:
+      drinking_days(list[beerlogdb.DrinkingDay]): the days to display.
+    Returns:
+      str: the HTML table.
+    """
+    rows = []
+    for day in reversed(drinking_days):
+      speed = day.total_cl / day.active_hours / 100 if day.active_hours > 0 else 0
+      rows.append(
+        f"""
+        <tr>
+          <td>{day.day:%a %Y-%m-%d}</td><td>{day.first:%H:%M}</td><td>{day.last:%H:%M}</td>
+          <td>{day.total_cl / 100:.2f}</td><td>{day.active_hours:.1f}</td><td>{speed:.2f}</td>
+        </tr>"""
+      )
+    return f"""
+    <h2>Drinking days</h2>
+    <table>
+      <thead>
+        <tr>
+          <th>Day</th><th>First scan</th><th>Last scan</th><th>Total (L)</th>
+          <th>Active hours</th><th>L/h</th>
+        </tr>
+      </thead>
+      <tbody>{"".join(rows)}
+      </tbody>
+    </table>"""
+
+  def _RenderPredictPage(self, prediction=None, keg_size=None, error=None, drinking_days=None):
     error_html = ""
     if error:
       error_html = '<p style="color:red;">{0}</p>'.format(html.escape(error))
@@ -168,6 +294,7 @@ class Handler(http.server.BaseHTTPRequestHandler):
     </form>
     {error_html}
 """.format(keg_size=int(keg_size or 2000) / 100, error_html=error_html)
+    page += self._RenderKegs(self._db.GetKegs())
 
     if prediction is not None:
       page += f"""
@@ -190,7 +317,7 @@ class Handler(http.server.BaseHTTPRequestHandler):
           <th>Should open new keg?</th><td><strong>{"Yes" if prediction["should_open_new_keg"] else "No"}</strong> (empty before {datetime.datetime.now().replace(hour=1, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)})</td>
         </tr>
       </tbody>
-    </table>
+    </table>{self._RenderDrinkingDays(drinking_days or [])}
   </div>
 </body>
 </html>
@@ -201,29 +328,36 @@ class Handler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
     self.wfile.write(page.encode())
 
-  def _GetAmountFromName(self, name, at=None):
-    """Gets the amount of beer consumed by a character at a specific time.
+  def GetCharacterData(self, name: str) -> bytes:
+    """Builds the cumulative amount drunk by a character, for Chart.js.
 
     Args:
-      name(str): the realname of the character.
-      at(datetime): the time to get the amount at. If None, gets the latest amount.
-
+      name(str): the name of the character.
     Returns:
-      int: the amount of beer consumed in cl.
+      bytes: the JSON data.
+    """
+    cumulative = self._db.GetCumulativeTotalsFromName(name)
+    return json.dumps(
+      {
+        "data": {
+          "name": name,
+          "labels": [timestamp.strftime("%a %Hh%M") for timestamp in cumulative.timestamps],
+          "totals": cumulative.totals,
+        }
+      }
+    ).encode()
+
+  def GetData(self, all_time=False):
+    """Builds a dict to use with Chart.js.
+
+    Args:
+      all_time(bool): whether to show all the sessions, or only the current one.
     """
-    total = 0
-    if at is None:
-      at = datetime.datetime.now()
-    for entry in reversed(self._all_data):
-      if entry.character_name.lower() == name.lower() and entry.timestamp <= at:
-        total += entry.amount
-
-    return total
-
-  def GetData(self):
-    """Builds a dict to use with Chart.js."""
-    first_scan = self._db.GetEarliestTimestamp().replace(minute=0, second=0, microsecond=0)
-    last_scan = self._db.GetLatestTimestamp().replace(
+    characters = self._db.GetAllCharacterNames(all_time=all_time)
+    first_scan = self._db.GetEarliestTimestamp(all_time=all_time).replace(
+      minute=0, second=0, microsecond=0
+    )
+    last_scan = self._db.GetLatestTimestamp(all_time=all_time).replace(
       minute=0, second=0, microsecond=0
     ) + datetime.timedelta(hours=1)
     delta = last_scan - first_scan
@@ -238,59 +372,36 @@ class Handler(http.server.BaseHTTPRequestHandler):
     fields = []  # This is the X axis
     datasets = {}  # {'alcoolique': ['L cummulés']}
 
-    total_drunk = 0
-    for entry in self._db.GetEntriesInWindow(start=first_scan, end=last_scan).execute():
-      total_drunk += entry.amount
+    total_drunk = self._db.GetTotalAmount(all_time=all_time)
 
-    for hour in range(total_hours + 1):
-      timestamp = first_scan + datetime.timedelta(seconds=hour * 3600)
-      fields.append(timestamp.strftime("%a %Hh%M"))
-      for alcoolique in self._characters:
-        cl = self._GetAmountFromName(alcoolique, at=timestamp)
-        if alcoolique in datasets:
-          datasets[alcoolique].append(cl)
-        else:
-          datasets[alcoolique] = [cl]
-
-    total_by_hour = [
-      sum(datasets[name][hour] for name in self._characters) for hour in range(total_hours)
-    ]
     window_size = 2
+    session = None if all_time else self._db.GetCurrentSession()
+    series = self._columns.GetHourlySeries(
+      first_scan, last_scan, window_hours=window_size, session_id=session.id if session else None
+    )
+    for timestamp in series.hours:
+      fields.append(timestamp.strftime("%a %Hh%M"))
+    zeros = numpy.zeros(len(series.hours), dtype=numpy.int64)
+    for alcoolique in characters:
+      datasets[alcoolique] = series.cumulative.get(alcoolique, zeros)
+
+    total_by_hour = sum(datasets.values(), zeros)[:total_hours]
     peaks_window = {"total": {"amount": 0, "start": None}}
 
-    speeds_by_hour = []
+    speeds_by_hour = numpy.zeros(0)
 
     if total_hours > window_size:
-      for hour in range(total_hours + 1):
-        total_l_per_hour = 0
-        entries_hour = self._db.GetEntriesInWindow(
-          start=first_scan + datetime.timedelta(seconds=(hour - (window_size / 2)) * 3600),
-          end=first_scan + datetime.timedelta(seconds=(hour + (window_size / 2)) * 3600),
-        ).execute()
-        for entry in entries_hour:
-          total_l_per_hour += entry.amount
-
-        total_l_per_hour = total_l_per_hour / window_size
-        speeds_by_hour.append(total_l_per_hour / 100.0)
-        if total_l_per_hour / 100 > peaks_window["total"]["amount"]:
-          peaks_window["total"] = {
-            "amount": total_l_per_hour / 100,
-            "time": str(first_scan + datetime.timedelta(seconds=hour * 3600)),
-          }
-        for alcoolique in self._characters:
-          consumed_char = 0
-          for entry in entries_hour:
-            if entry.character_name == alcoolique:
-              consumed_char += entry.amount
-          consumed_char_speed = consumed_char / window_size / 100.0
-          if (
-            alcoolique not in peaks_window
-            or consumed_char_speed > peaks_window[alcoolique]["amount"]
-          ):
-            peaks_window[alcoolique] = {
-              "amount": consumed_char_speed,
-              "time": str(first_scan + datetime.timedelta(seconds=hour * 3600)),
-            }
+      speeds_by_hour = sum(series.windowed.values(), zeros) / window_size / 100.0
+      peak = analytics.FindPeak(speeds_by_hour)
+      if speeds_by_hour[peak] > 0:
+        peaks_window["total"] = {
+          "amount": float(speeds_by_hour[peak]),
+          "time": str(series.hours[peak]),
+        }
+      for alcoolique in characters:
+        speeds = series.windowed.get(alcoolique, zeros) / window_size / 100.0
+        peak = analytics.FindPeak(speeds)
+        peaks_window[alcoolique] = {"amount": float(speeds[peak]), "time": str(series.hours[peak])}
 
     peak_by_character = [[c, p] for c, p in peaks_window.items() if c != "total"]
     peak_by_character.sort(key=lambda x: x[1]["amount"], reverse=True)
@@ -299,15 +410,19 @@ class Handler(http.server.BaseHTTPRequestHandler):
 
     output_datasets = []  # [{'label': 'alcoolique', 'data': ['L cummulés']}]
     for k, v in sorted(datasets.items(), key=lambda x: x[1][-1], reverse=True):
-      output_datasets.append({"label": k, "data": v})
-    output_datasets.append({"label": "Total cumulative", "data": total_by_hour, "order": 0})
-    output_datasets.append({"label": "Total speed", "data": speeds_by_hour[0:-1], "order": 1})
+      output_datasets.append({"label": k, "data": v.tolist()})
+    output_datasets.append(
+      {"label": "Total cumulative", "data": total_by_hour.tolist(), "order": 0}
+    )
+    output_datasets.append(
+      {"label": "Total speed", "data": speeds_by_hour[0:-1].tolist(), "order": 1}
+    )
     return json.dumps(
       {
         "data": {
           "labels": fields,
           "datasets": output_datasets,
-          "drinkers": self._characters,
+          "drinkers": characters,
           "total": total_drunk / 100.0,
           "peak_total": peaks_window["total"],
           "peak_by_character": peak_by_character,
@@ -338,9 +453,29 @@ def ParseArguments() -> argparse.Namespace:
     default=DEFAULT_TAGS_FILE,
     help="the known tags file to use to use",
   )
+  parser.add_argument(
+    "--sqlite_cache_size",
+    dest="sqlite_cache_size",
+    type=int,
+    default=None,
+    help="the SQLite cache_size pragma, in pages, or in KiB if negative (default: -8000)",
+  )
+  parser.add_argument(
+    "--sqlite_mmap_size",
+    dest="sqlite_mmap_size",
+    type=int,
+    default=None,
+    help="the SQLite mmap_size pragma, in bytes (default: 0)",
+  )
   parser.add_argument(
     "--port", dest="port", action="store", default=DEFAULT_PORT, type=int, help="port to listen at"
   )
+  parser.add_argument(
+    "--profile_dump",
+    dest="profile_dump",
+    default=None,
+    help="profiles the queries, and periodically writes the statistics as JSON to this file",
+  )
 
   parsed_args = parser.parse_args()
 
@@ -359,9 +494,27 @@ def ParseArguments() -> argparse.Namespace:
 def MakeHandlerClassFromArgv(init_args: argparse.Namespace):
   """Generates a class that inherits from Handler, with the proper attributes"""
 
+  db = beerlogdb.BeerLogDB(
+    init_args.database,
+    pragmas=beerlogdb.MakePragmas(
+      cache_size=init_args.sqlite_cache_size, mmap_size=init_args.sqlite_mmap_size
+    ),
+    read_only=True,
+  )
+  db.LoadTagsDB(init_args.known_tags)
+  profiler = None
+  if getattr(init_args, "profile_dump", None):
+    profiler = instrumentation.Profiler(dump_path=init_args.profile_dump)
+    profiler.InstrumentDatabase(db.database)
+    profiler.InstrumentObject(db, "BeerLogDB")
+
   class CustomHandler(Handler):
     """Wrapper around Handler that sets the required attributes"""
 
+    DB = db
+    COLUMNS = analytics.EntryColumns(db)
+    PROFILER = profiler
+
     def __init__(self, *args, **kwargs):
       self.options = init_args
       super().__init__(*args, **kwargs)
@@ -381,3 +534,6 @@ if __name__ == "__main__":
     pass
   print("Shutting Down")
   httpd.server_close()
+  if HandlerClass.PROFILER:
+    HandlerClass.PROFILER.Report()
+  HandlerClass.DB.Close()